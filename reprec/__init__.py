@@ -1,15 +1,52 @@
 #!/usr/bin/env python3
 
+import bisect
+import collections
+import copy
 import getopt
+import heapq
 import io
 import os
-import random
+import queue
+import stat
 import re
+import signal
 import sys
+import threading
+import time
+
+from reprec import regex_analysis
+from reprec.ahocorasick import AhoCorasick
+from reprec.compressed import FORMATS, CompressedTempFile, compression, inner_name, open_compressed
+from reprec.engines import ENGINES, compile_regex
+from reprec.journal import Journal, JournalMismatch
+from reprec.pathfilter import GitIgnore, PathFilter
+from reprec.scancache import DEFAULT_MAX_ENTRIES, ScanCache, stat_signature
+from reprec.trigramindex import TrigramIndex
+from reprec.writer import DURABILITY_LEVELS, FileWriter
 
 STD_EXCLUDES = ['.svn', 'CVS', '.git', '.hg', '.bzr',
                 '.idea', '.tox', 'dist']
 
+# Block size of --stream
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Longest match of --stream --dotall
+DEFAULT_MAX_MATCH_SPAN = 64 * 1024
+
+# Bytes at the start of a file which get checked by ReplaceRecursive.is_binary()
+BINARY_SNIFF_SIZE = 8 * 1024
+
+# Bytes which are usual in text files. Bytes above 127 are part of
+# UTF-8 or latin1 encoded text.
+TEXT_BYTES = bytes([7, 8, 9, 10, 12, 13, 27]) + bytes(range(32, 127)) + bytes(range(128, 256))
+
+# Values of --hardlinks
+HARDLINK_MODES = ('report', 'keep')
+
+# Bytes of changed content kept by --dedupe-content
+DEFAULT_MEMO_SIZE = 64 * 1024 * 1024
+
 
 def usage():
     print('''Usage: %s
@@ -24,8 +61,34 @@ def usage():
              [--ignorecase]
              [--no-std-exclude]
              [--files-from file|-]
+             [--files-from0 file|-]
              [--ignore regex]
              [--print-std-exclude]
+             [-j|--jobs N]
+             [--stream]
+             [--buffer-size bytes]
+             [--max-match-span bytes]
+             [--rules file]
+             [--no-binary-detection]
+             [--binary-by-ending]
+             [--exclude glob]
+             [--exclude-dir glob]
+             [--include glob]
+             [--gitignore]
+             [--cache file]
+             [--cache-size files]
+             [--index file]
+             [--durability none|file|dir]
+             [--journal file]
+             [--resume file]
+             [--stats]
+             [--stats-json file|-]
+             [--engine re|re2|auto|literal]
+             [--timeout seconds]
+             [--hardlinks report|keep]
+             [--dedupe-content]
+             [--compressed]
+             [--no-daemon]
 
              dirs
 
@@ -56,14 +119,141 @@ def usage():
         ask:         Aks before replacing (interactive).
 
         files-from:  Read filenames from file or stdin if '-'.
-                     Skip directories.
+                     Skip directories. The names get read while the files get
+                     processed, so the replacing starts before the command
+                     which writes the names is finished.
+
+        files-from0: Like files-from, but the names are separated by NUL
+                     characters, like the output of 'find -print0' or
+                     'git ls-files -z'.
 
         ignore:      Ignore lines that match a regular expression.
-                     This options can be given several times.
+                     This options can be given several times. With --dotall,
+                     matches which touch an ignored line don't get replaced.
 
         print-std-exclude: print the directories which get ignored (use --no-std-exclude to
                      not ignore them)
 
+        jobs:        Number of files which get processed in parallel (default 1).
+                     Uses processes, or threads if --no-regex is used.
+                     Not supported with --ask.
+
+        stream:      Don't load whole files into memory. The changed content
+                     gets written to FILE_RANDOMINTEGER while reading. Needs
+                     memory for --buffer-size bytes plus the longest line.
+
+        buffer-size: Size of the blocks read by --stream. Default: 1048576
+
+        max-match-span: Used by --stream together with --dotall: the file is
+                     scanned in overlapping windows. The result is the same as
+                     without --stream, if no match is longer than this.
+                     Default: 65536. With --no-regex, several rules, --ignore
+                     or a pattern which can match the empty string, the whole
+                     file gets read into memory (with a warning).
+
+        rules:       Read more patterns from a file. One rule per line: the pattern,
+                     a tab character and the text which gets inserted. Empty lines
+                     and lines starting with '#' are skipped. The rules get applied
+                     one after the other to each line (or file if --dotall is used).
+                     With --no-regex all strings get replaced in one pass, if two
+                     of them start at the same position, the longer one wins.
+                     The pattern and insert from the command line are optional
+                     if this option is used.
+
+        no-binary-detection: Don't skip binary files. By default the first bytes
+                     of each file get checked for NUL bytes and control characters.
+
+        binary-by-ending: Reuse the result of the binary detection for all files
+                     with the same file ending: once a file is binary, the other
+                     files with its ending get skipped without reading them.
+
+        exclude:     Skip files and directories matching the glob. Can be given
+                     several times. A glob without a slash matches the name, a glob
+                     with a slash the path relative to the directory given on the
+                     command line. '*' does not match a slash, '**' matches any
+                     number of directories. Example: --exclude '*.min.js'
+
+        exclude-dir: Don't walk directories matching the glob. Can be given several
+                     times. Example: --exclude-dir node_modules
+
+        include:     Only check files matching the glob. Can be given several times.
+
+        gitignore:   Skip files and directories which are ignored by .gitignore
+                     files found while walking the directories.
+
+        cache:       Remember the files without a match in this sqlite database.
+                     The next run with the same patterns and options skips them,
+                     if size, mtime and inode did not change.
+
+        cache-size:  Maximum number of files in the cache. The least recently
+                     used entries get removed. Default: 200000
+
+        index:       Use the trigram index in this file: indexed files which can't
+                     contain a match of the pattern don't get read. Files which
+                     changed since the index was updated get checked. Create and
+                     update the index with:
+
+         %s index build|update --index file [--no-std-exclude]
+                     [--exclude glob] [--exclude-dir glob] [-v|--verbose] dirs
+
+        durability:  none: don't call fsync() (default). file: sync each changed
+                     file before it replaces the original. dir: sync the
+                     directories after the renames, too. The changed files get
+                     written by a background thread while the next ones get read.
+
+        journal:     Record the progress in this file. If the run gets killed, it
+                     can be continued with --resume.
+
+        resume:      Continue the run of this journal: the finished files and
+                     directories get skipped, the temp files of the killed run get
+                     removed. The command line gets read from the journal, so
+                     this needs to be the only option, except --no-daemon. The
+                     numbers printed at the end include the files of the killed
+                     run.
+
+        stats:       Print the time spent walking, reading, matching, checking
+                     --ignore and writing, the files and bytes per second, the
+                     number of matches and the slowest files. With --jobs the
+                     times of the workers get added up.
+
+        stats-json:  Write these numbers (and the other counters) as JSON to the
+                     file, or to stdout if '-'.
+
+        engine:      Regex engine. re: the re module (default). re2: google-re2,
+                     which needs linear time, but does not support backreferences,
+                     lookaround, empty matches, \\s and $ with --dotall. auto: re2
+                     if it is installed and supports the pattern, re otherwise.
+                     literal: like --no-regex.
+
+        timeout:     Skip files which take longer than this (matching, not
+                     writing). The file is left unchanged and reported. Not
+                     available in threads (with --jobs and --no-regex).
+
+        hardlinks:   A changed file gets replaced by a new one, so a file with
+                     several hard links gets split: the other names keep the old
+                     content. report: print these files (default). keep: each
+                     file (device and inode) gets checked once. The other names
+                     found below dirs become hard links of the changed file, the
+                     names elsewhere get reported. Needs a stat() call per file.
+
+        dedupe-content: Files with the same content as a file before reuse its
+                     result instead of matching again. Helps with trees which
+                     contain many copies of the same files. Not supported with
+                     --stream, --ask and --print-lines.
+
+        compressed:  Replace in the content of .gz, .bz2 and .xz files. They get
+                     decompressed while reading, a changed file gets compressed
+                     into the temp file which replaces it. Unchanged files don't
+                     get written. --index doesn't skip them.
+
+        no-daemon:   Don't use the daemon, even if one is running. The daemon
+                     keeps the directory listings in memory, inotify (Linux)
+                     reports the changes. The commands get sent to it via the
+                     Unix socket $REPREC_SOCKET (default: reprec.sock in
+                     $XDG_RUNTIME_DIR). Start it with:
+
+         %s serve [--socket path] [-v|--verbose] [dirs]
+
         Example:
          %s --pattern '(xml)' --insert '\\1\\1' .
          -->This will replace all 'xml' with 'xmlxml'
@@ -78,66 +268,512 @@ def usage():
         The Perl Compatible Regular Expresssions are explained here:
           http://docs.python.org/lib/re-syntax.html
 
-        The files are created by moving (os.rename()) FILE_RANDOMINTEGER
+        The files are created by moving (os.rename()) FILE_RANDOMSUFFIX
         to FILE. This way no half written files will be left, if the
-        process gets killed. If the process gets killed one FILE_RANDOMINTEGER
-        may be left in the filesystem.
+        process gets killed. Owner and mode of FILE are kept. On Linux the
+        temp file has no name until it is complete (O_TMPFILE), elsewhere
+        one FILE_RANDOMSUFFIX may be left in the filesystem if the process
+        gets killed.
         ''' % (
         os.path.basename(sys.argv[0]),
         os.path.basename(sys.argv[0]),
         os.path.basename(sys.argv[0]),
+        os.path.basename(sys.argv[0]),
+        os.path.basename(sys.argv[0]),
         os.path.basename(sys.argv[0])))
 
 
-def replace_recursive(dirname, pattern, text, filename_regex=None,
-                      no_regex=None, verbose=False,
-                      dotall=False, print_lines=False, no_std_exclude=False, ask=False,
-                      files_from=None, ignorecase=False, ignore_lines=None):
+def replace_recursive(dirname, pattern, text, *args, **kwargs):
+    '''
+    Replace pattern with text in all files below dirname. Returns the counter
+    dict. The arguments are the same as those of iter_replace(). If verbose
+    is True, the result of each file gets printed (see print_file_result()).
+    '''
+    # The position of verbose in the arguments of iter_replace()
+    verbose = kwargs.get('verbose', len(args) > 2 and args[2])
+    counter = {}
+    for result in iter_replace(dirname, pattern, text, *args, counter=counter, offsets=False, **kwargs):
+        if verbose:
+            print_file_result(result)
+    return counter
+
+
+def iter_replace(dirname, pattern, text, filename_regex=None,
+                 no_regex=None, verbose=False,
+                 dotall=False, print_lines=False, no_std_exclude=False, ask=False,
+                 files_from=None, ignorecase=False, ignore_lines=None, stats=None,
+                 jobs=1, stream=False, buffer_size=DEFAULT_BUFFER_SIZE,
+                 max_match_span=DEFAULT_MAX_MATCH_SPAN, rules=None, binary_detection=True,
+                 excludes=None, exclude_dirs=None, includes=None, gitignore=False,
+                 cache_file=None, cache_size=DEFAULT_MAX_ENTRIES, index_file=None,
+                 durability='none', journal=None, files_from0=False, timing=False,
+                 slowest_files=10, counter=None, offsets=True, engine='re', timeout=None,
+                 hardlinks='report', dedupe_content=False, compressed=False, tree=None,
+                 binary_by_ending=False):
+    '''
+    Replace pattern with text in all files below dirname. Yields a FileResult
+    for each file as soon as it is done (in the order of the walk, with
+    --jobs, too). Stopping the iteration stops the run: the changes of the
+    files done so far get written.
+
+    If counter is a dict, it gets updated with the counter of the run when
+    the iteration ends (see replace_recursive()). If offsets is False, the
+    offsets of FileResult are None.
+
+    rules is a list of (pattern, text) tuples which get applied after pattern
+    and text. pattern and text can be None if rules are given.
+
+    files_from is a file (names separated by newlines, or by NUL characters
+    if files_from0 is True) or an iterable of names.
+
+    If stats is a dict, it gets updated with additional numbers about the run
+    (for example 'stat-calls-saved', or 'rule-hits': the number of lines changed
+    by each rule).
+
+    If cache_file is given, files without a match get recorded there and
+    skipped by the next run (see ScanCache). The counter has the additional
+    key 'files-cached' then.
+
+    If index_file is given (see TrigramIndex), indexed files which can't
+    contain a match don't get read.
+
+    journal is a Journal instance. If it resumes an other run, the files done
+    by that run get skipped and its numbers get added to the counter.
+
+    If timing is True, stats gets the time of each phase, the bytes read and
+    the slowest_files slowest files, too (see ReplaceRecursive.new_stats()
+    and stats_summary()).
+
+    If binary_by_ending is True, the result of the binary detection gets
+    reused for all files with the same ending (see --binary-by-ending).
+
+    engine is one of reprec.engines.ENGINES. If timeout is given, files which
+    take longer than timeout seconds don't get changed, their FileResult has
+    the reason 'timeout' (see MatchBudget).
+
+    hardlinks is one of HARDLINK_MODES (see --hardlinks). With 'keep', the
+    other names of a file have the reason 'hardlink'. If dedupe_content is
+    True, files with the same content as a file before reuse its result.
+    If compressed is True, the content of compressed files gets replaced
+    (see reprec.compressed).
+
+    tree is the DirectoryTree of the daemon (see reprec.daemon), which
+    lists the directories instead of os.scandir().
+    '''
     if ignore_lines is None:
         ignore_lines = []
     if ask and files_from:
         raise Exception("You can't use --ask and --files-from together since reading y/n from stdin is not possible")
-    if dotall and ignore_lines:
-        raise Exception("You can't use --dotall and --ignore together")
+    if ask and jobs > 1:
+        raise Exception("You can't use --ask and --jobs together since the questions need to be asked one by one")
 
     if isinstance(pattern, str):
         pattern = pattern.encode('utf8')
     if isinstance(text, str):
         text = text.encode('utf8')
+    if rules:
+        rules = [tuple(value.encode('utf8') if isinstance(value, str) else value
+                       for value in rule) for rule in rules]
 
     rr = ReplaceRecursive(pattern, text, filename_regex,
                           no_regex, verbose, dotall,
-                          print_lines, no_std_exclude, ask, ignorecase, ignore_lines)
-
-    if files_from:
-        assert not dirname, dirname
-        for line in files_from:
-            file_name = line.rstrip()
-            if os.path.isdir(file_name):
-                if rr.verbose:
-                    print('Skipping', file_name)
-                continue
-            rr.do(file_name, follow_symlink_files=[file_name])
-        return rr.counter
+                          print_lines, no_std_exclude, ask, ignorecase, ignore_lines,
+                          jobs=jobs, stream=stream, buffer_size=buffer_size,
+                          max_match_span=max_match_span, rules=rules,
+                          binary_detection=binary_detection, excludes=excludes,
+                          exclude_dirs=exclude_dirs, includes=includes, gitignore=gitignore,
+                          cache_file=cache_file, cache_size=cache_size, index_file=index_file,
+                          durability=durability, journal=journal, timing=timing,
+                          slowest_files=slowest_files, engine=engine, timeout=timeout,
+                          hardlinks=hardlinks, dedupe_content=dedupe_content, compressed=compressed,
+                          binary_by_ending=binary_by_ending)
+    rr.collect_offsets = offsets
+    rr.tree = tree
 
-    return rr.do(dirname, follow_symlink_files=dirname)
+    try:
+        if journal is not None:
+            journal.start(rr.cache_fingerprint(), dirname or [])
+            rr.resume()
+        if files_from:
+            assert not dirname, dirname
+            names = files_from
+            if hasattr(files_from, 'read'):
+                names = read_file_names(getattr(files_from, 'buffer', files_from),
+                                        b'\0' if files_from0 else b'\n')
+            files = rr.walk_files_from(prefetch(names))
+        else:
+            files = rr.walk(dirname, follow_symlink_files=dirname)
+        yield from rr.iter_process(files)
+    finally:
+        if rr.cache is not None:
+            rr.cache.close()
+        if rr.index is not None:
+            rr.index.close()
+        if journal is not None:
+            journal.close()
+        if stats is not None:
+            stats.update(rr.stats)
+        if counter is not None:
+            counter.update(rr.counter)
+
+
+class FileResult:
+    '''
+    The result of one file, see iter_replace().
+
+    status:  'changed', 'unchanged' or 'skipped'.
+    reason:  why the file was skipped: 'binary', 'cache' (see ScanCache),
+             'index' (see TrigramIndex), 'resumed' (done by the resumed run
+             of the journal) or 'timeout' (see MatchBudget). With
+             --hardlinks keep, the other names of a file have the reason
+             'hardlink': skipped if the file was not changed, changed if
+             the name became a hard link of the changed file.
+    lines:   number of changed lines (of replaced matches with --dotall).
+    offsets: byte offsets of the changed lines (of the matches with --dotall)
+             in the original file. With --dotall and several rules, the
+             offsets of a rule refer to the result of the rules before it.
+    seconds: time spent on the file, None without timing.
+    '''
+
+    __slots__ = ('file_name', 'status', 'reason', 'lines', 'offsets', 'seconds')
+
+    def __init__(self, file_name, status, reason=None, lines=0, offsets=None, seconds=None):
+        self.file_name = file_name
+        self.status = status
+        self.reason = reason
+        self.lines = lines
+        self.offsets = offsets
+        self.seconds = seconds
+
+    @property
+    def changed(self):
+        return self.status == 'changed'
+
+    def __repr__(self):
+        return '<%s %s %s%s lines=%i>' % (self.__class__.__name__, self.file_name, self.status,
+                                          ' (%s)' % self.reason if self.reason else '', self.lines)
+
+
+class _Inode:
+    '''A file with several hard links, see ReplaceRecursive.hardlink_lookup()'''
+
+    __slots__ = ('file_name', 'links', 'seen', 'changed')
+
+    def __init__(self, file_name, links):
+        # The first name found by the walk, which gets checked.
+        self.file_name = file_name
+        self.links = links
+        # Names found by the walk.
+        self.seen = 1
+        # Result of file_name, None as long as it is not known.
+        self.changed = None
+
+
+class ContentMemo:
+    '''
+    Results of replacing in the content of files, by SHA-256 of the content
+    (--dedupe-content). The new content of changed files gets kept up to
+    max_size bytes, the results of unchanged files need no content.
+    '''
+
+    def __init__(self, max_size=DEFAULT_MEMO_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        # digest --> (new content or None if unchanged, lines, offsets, stats)
+        self.results = {}
+
+    def get(self, digest):
+        return self.results.get(digest)
+
+    def add(self, digest, new_content, lines, offsets, stats):
+        if new_content is not None:
+            if self.size + len(new_content) > self.max_size:
+                return
+            self.size += len(new_content)
+        self.results[digest] = (new_content, lines, offsets, stats)
+
+
+class _Node:
+    '''A directory (or a command line argument) visited by ReplaceRecursive.walk()'''
+
+    __slots__ = ('parent', 'changed', 'path', 'pending', 'walked', 'changed_dirs')
+
+    def __init__(self, parent=None, path=None):
+        self.parent = parent
+        self.changed = False
+        self.path = path
+        # Number of files and directories which were yielded but are not done.
+        self.pending = 0
+        self.walked = False
+        # Number of changed directories below (including this one). Only
+        # used for the journal.
+        self.changed_dirs = 0
+
+
+class MatchTimeout(Exception):
+    pass
+
+
+class MatchBudget:
+    '''
+    Raises MatchTimeout if the file takes longer than seconds (--timeout).
+    A SIGALRM timer interrupts the regex engine. Signals only reach the main
+    thread, in other threads (and without setitimer()) there is no limit.
+    The worker processes of --jobs run the files in their main thread.
+
+    While paused (see pause()) the time does not count and no MatchTimeout
+    gets raised.
+    '''
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.active = False
+        self.paused = False
+        self.expired = False
+        self.remaining = seconds
+        self.old_handler = None
+
+    def __enter__(self):
+        if hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+            self.active = True
+            self.old_handler = signal.signal(signal.SIGALRM, self.alarm)
+            signal.setitimer(signal.ITIMER_REAL, self.seconds)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.active:
+            self.paused = True
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.old_handler)
+            self.active = False
+
+    def alarm(self, signum, frame):
+        if self.paused:
+            # The handler was delayed until after pause().
+            self.expired = True
+            return
+        raise MatchTimeout()
+
+    def pause(self):
+        if self.active and not self.paused:
+            self.paused = True
+            self.remaining = signal.setitimer(signal.ITIMER_REAL, 0)[0]
+
+    def resume(self):
+        if self.active and self.paused:
+            self.paused = False
+            # An expired timer fires right away.
+            signal.setitimer(signal.ITIMER_REAL, 1e-6 if self.expired else max(self.remaining, 1e-6))
+
+
+class _TimedFile:
+    '''
+    A binary file which adds the time of read() to time-read and the size of
+    the file (or the part which was read) to bytes-read of stats (see
+    ReplaceRecursive.new_stats()). Bytes which get read again after seek()
+    count once.
+    '''
+
+    def __init__(self, fd, stats):
+        self.fd = fd
+        self.stats = stats
+        self.offset = 0
+        self.counted = 0
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.fd.read(size)
+        self.stats['time-read'] += time.perf_counter() - start
+        self.offset += len(data)
+        if self.offset > self.counted:
+            self.stats['bytes-read'] += self.offset - self.counted
+            self.counted = self.offset
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.offset = self.fd.seek(offset, whence)
+        return self.offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.fd.close()
+
+
+class RegexMatcher:
+    '''
+    Replaces the matches of one regular expression rule. See ReplaceRecursive.rules
+    '''
+
+    def __init__(self, index, pattern, text, flags, line_mode=True, engine='re'):
+        self.index = index
+        self.text = text
+        # See reprec.engines. The analysis below uses the parser of the re module.
+        self.regex = compile_regex(pattern, flags, engine, line_mode)
+        # Used by may_match() to reject files with one search over the whole file.
+        self.required_literal = b''
+        self.buffer_regex = None
+        if line_mode:
+            self.required_literal = regex_analysis.required_literal(pattern, flags)
+            if regex_analysis.line_local(pattern, flags):
+                self.buffer_regex = compile_regex(pattern, flags | re.MULTILINE, engine, line_mode)
+        # True if find() finds all lines with a match.
+        self.can_find = self.buffer_regex is not None
+
+    def find(self, content, pos):
+        match = self.buffer_regex.search(content, pos)
+        if match is None:
+            return -1
+        return match.start()
+
+    def may_match(self, content):
+        if self.required_literal and self.required_literal not in content:
+            return False
+        if self.buffer_regex is not None:
+            return self.buffer_regex.search(content) is not None
+        return True
+
+    def sub(self, line, hits):
+        '''
+        Return the line with the replacements. The rule index gets appended
+        to hits once for each match, if the line was changed.
+        '''
+        line_replaced, n = self.regex.subn(self.text, line)
+        if line_replaced != line:
+            hits.extend([self.index] * n)
+        return line_replaced
+
+    def subn(self, content, rule_hits, keep=None, offsets=None):
+        '''
+        Replace all matches in content. Matches for which keep(start, end)
+        returns True don't get replaced. If offsets is a list, the start of
+        each replaced match gets appended.
+        '''
+        if keep is None and offsets is None:
+            (content, n) = self.regex.subn(self.text, content)
+            rule_hits[self.index] += n
+            return content, n
+        n = 0
+
+        def replacement(match):
+            nonlocal n
+            if keep is not None and keep(*match.span()):
+                return match.group()
+            n += 1
+            if offsets is not None:
+                offsets.append(match.start())
+            return match.expand(self.text)
+
+        content = self.regex.sub(replacement, content)
+        rule_hits[self.index] += n
+        return content, n
+
+
+class LiteralMatcher:
+    '''
+    Replaces the strings of all --no-regex rules in one pass. If several strings
+    start at the same position, the longest one gets replaced.
+    '''
+
+    # A literal which contains a newline only gives false positives.
+    can_find = True
+
+    # From this number of strings on, the Aho-Corasick automaton is faster than
+    # the alternation: the time of the regex engine grows with each string.
+    automaton_threshold = 64
+
+    def __init__(self, rules):
+        self.texts = {}
+        for index, (pattern, text) in enumerate(rules):
+            self.texts.setdefault(pattern, (index, text))
+        if len(self.texts) == 1:
+            self.regex = None
+            (self.pattern, (self.index, self.text)), = self.texts.items()
+        elif len(self.texts) >= self.automaton_threshold and b'' not in self.texts:
+            self.regex = AhoCorasick(self.texts)
+        else:
+            self.regex = re.compile(b'|'.join(
+                re.escape(pattern) for pattern in sorted(self.texts, key=len, reverse=True)))
+
+    def find(self, content, pos):
+        if self.regex is None:
+            return content.find(self.pattern, pos)
+        match = self.regex.search(content, pos)
+        if match is None:
+            return -1
+        return match.start()
+
+    def may_match(self, content):
+        return self.find(content, 0) != -1
+
+    def sub(self, line, hits):
+        if self.regex is None:
+            line_replaced = line.replace(self.pattern, self.text)
+            if line_replaced != line:
+                hits.extend([self.index] * line.count(self.pattern))
+            return line_replaced
+
+        def replacement(match):
+            index, text = self.texts[match.group()]
+            if text != match.group():
+                hits.append(index)
+            return text
+
+        return self.regex.sub(replacement, line)
+
+    def subn(self, content, rule_hits, keep=None, offsets=None):
+        if self.regex is None and keep is None and offsets is None:
+            n = content.count(self.pattern)
+            rule_hits[self.index] += n
+            return content.replace(self.pattern, self.text), n
+        regex = self.regex
+        if regex is None:
+            regex = re.compile(re.escape(self.pattern))
+        n = 0
+
+        def replacement(match):
+            nonlocal n
+            if keep is not None and keep(*match.span()):
+                return match.group()
+            index, text = self.texts[match.group()]
+            rule_hits[index] += 1
+            n += 1
+            if offsets is not None:
+                offsets.append(match.start())
+            return text
+
+        return regex.sub(replacement, content), n
 
 
 class ReplaceRecursive:
     def __init__(self, pattern, text, filename_regex=None,
                  no_regex=None, verbose=False,
                  dotall=False, print_lines=False, no_std_exclude=False, ask=False,
-                 ignorecase=False, ignore_lines=None):
+                 ignorecase=False, ignore_lines=None, jobs=1, stream=False,
+                 buffer_size=DEFAULT_BUFFER_SIZE, max_match_span=DEFAULT_MAX_MATCH_SPAN,
+                 rules=None, binary_detection=True, excludes=None, exclude_dirs=None,
+                 includes=None, gitignore=False, cache_file=None, cache_size=DEFAULT_MAX_ENTRIES,
+                 index_file=None, durability='none', journal=None, timing=False, slowest_files=10,
+                 engine='re', timeout=None, hardlinks='report', dedupe_content=False,
+                 compressed=False, binary_by_ending=False):
         if ignore_lines is None:
             ignore_lines = []
 
-        if not isinstance(pattern, bytes):
-            raise ValueError('I need bytes. Unfortunately not nice high level unicode strings: %r' % pattern)
-        self.pattern = bytes(pattern)
-
-        if not isinstance(text, bytes):
-            raise ValueError('I need bytes. Unfortunately not nice high level unicode strings: %r' % text)
-        self.text = bytes(text)
+        # (pattern, text) tuples. pattern and text are the first rule.
+        self.rules = []
+        if pattern is not None or text is not None:
+            self.rules.append((pattern, text))
+        self.rules.extend(rules or [])
+        if not self.rules:
+            raise ValueError('No pattern given')
+        for rule_pattern, rule_text in self.rules:
+            if not isinstance(rule_pattern, bytes):
+                raise ValueError('I need bytes. Unfortunately not nice high level unicode strings: %r' % rule_pattern)
+            if not isinstance(rule_text, bytes):
+                raise ValueError('I need bytes. Unfortunately not nice high level unicode strings: %r' % rule_text)
+        self.rules = [(bytes(rule_pattern), bytes(rule_text)) for rule_pattern, rule_text in self.rules]
+        self.pattern, self.text = self.rules[0]
 
         self.filename_regex = filename_regex
         self.no_regex = no_regex
@@ -148,167 +784,1314 @@ class ReplaceRecursive:
         self.ask = ask
         self.ignorecase = ignorecase
         self.ignore_lines = ignore_lines
+        # All ignore_lines in one regex, which gets searched once per line.
+        self.ignore_regex = combine_regexes(ignore_lines)
+        # Finds the ignored lines of a whole buffer, if no match of
+        # ignore_regex can span several lines. See ignored_spans().
+        self.ignore_buffer_regex = None
+        if isinstance(self.ignore_regex, re.Pattern) and regex_analysis.line_local(
+                self.ignore_regex.pattern, self.ignore_regex.flags):
+            self.ignore_buffer_regex = re.compile(self.ignore_regex.pattern,
+                                                  self.ignore_regex.flags | re.MULTILINE)
+        self.jobs = jobs
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.max_match_span = max_match_span
+        self.binary_detection = binary_detection
+        self.binary_by_ending = binary_by_ending
+        # File ending --> result of is_binary(), if binary_by_ending is True
+        self.binary_endings = {}
+        self.gitignore = gitignore
+        self.compressed = compressed
+        if compressed:
+            self.file_endings_to_ignore = [ending for ending in self.file_endings_to_ignore
+                                           if ending not in FORMATS]
+        exclude_dirs = list(exclude_dirs or [])
+        if not no_std_exclude:
+            exclude_dirs.extend(STD_EXCLUDES)
+        self.path_filter = PathFilter(exclude_dirs, excludes or [], includes or [],
+                                      self.file_endings_to_ignore, filename_regex)
+        # Output of the file related methods. None means sys.stdout.
+        self.stdout = None
+        # DirectoryTree of the daemon, see list_dir().
+        self.tree = None
+        self.writer = FileWriter(durability)
+        self.journal = journal
+        # file_name --> (node, changed, lines, files-checked) of changed files which
+        # are not written yet.
+        self.unwritten = {}
+        if journal is not None:
+            self.writer.on_temp = journal.temp_file
+            self.writer.replaced = collections.deque()
 
         self.counter = {'dirs': 0, 'files': 0, 'lines': 0, 'files-checked': 0}
+        # Set by check_file() for each file.
+        self.skip_reason = None
+        # Offsets of the changes in the current file (see FileResult), if
+        # collect_offsets is True.
+        self.collect_offsets = False
+        self.offsets = None
+        # Measure the time of the phases, see new_stats().
+        self.timing = timing
+        self.slowest_files = slowest_files
+        self.stats = self.new_stats()
         self.exit_after_this_file = False
         self.always_yes = False
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine %r. Use one of %s' % (engine, ', '.join(ENGINES)))
+        if engine == 'literal':
+            no_regex = self.no_regex = True
+        self.engine = engine
+        # Seconds per file, see MatchBudget.
+        self.timeout = timeout
+        self.match_budget = None
+        if hardlinks not in HARDLINK_MODES:
+            raise ValueError('Unknown hardlinks mode %r. Use one of %s' % (hardlinks, ', '.join(HARDLINK_MODES)))
+        self.hardlinks = hardlinks
+        # (st_dev, st_ino) --> _Inode of the files with several links (--hardlinks keep).
+        self.inodes = {}
+        self.content_memo = None
+        if dedupe_content:
+            if stream or ask or print_lines:
+                raise ValueError('dedupe_content is not supported with stream, ask and print_lines')
+            self.content_memo = ContentMemo()
         flags = 0
         if not no_regex:
             if dotall:
                 flags |= re.DOTALL
             if ignorecase:
                 flags |= re.IGNORECASE
-            try:
-                self.regex = re.compile(pattern, flags)
-            except re.error as e:
-                print("regular expression has syntax error: '%s': %s (do you want --no-regex ?)" % (
-                    pattern, str(e)))
-                sys.exit(3)
+            self.matchers = []
+            for index, (rule_pattern, rule_text) in enumerate(self.rules):
+                try:
+                    self.matchers.append(RegexMatcher(index, rule_pattern, rule_text, flags, not dotall, engine))
+                except re.error as e:
+                    print("regular expression has syntax error: '%s': %s (do you want --no-regex ?)" % (
+                        rule_pattern, str(e)))
+                    sys.exit(3)
+                except ValueError as e:
+                    # The engine is not available.
+                    print(e)
+                    sys.exit(3)
+            self.regex = self.matchers[0].regex
         else:
+            self.matchers = [LiteralMatcher(self.rules)]
             self.regex = None
 
+        self.dot_all_stream = False
+        if stream and dotall:
+            limit = self.dot_all_stream_limit(flags, ignore_lines)
+            if limit:
+                print('Warning: --stream --dotall reads whole files into memory %s' % limit)
+            self.dot_all_stream = limit is None
+        # True if searching the whole buffer finds all lines with a match.
+        self.search_whole_buffer = all(matcher.can_find for matcher in self.matchers)
+
+        self.cache = None
+        if cache_file:
+            self.cache = ScanCache(cache_file, self.cache_fingerprint(), cache_size)
+            self.counter['files-cached'] = 0
+        self.index = None
+        # Paths of the indexed files which may contain a match. None: all files.
+        self.index_candidates = None
+        if index_file:
+            self.index = TrigramIndex(index_file)
+            self.index_candidates = self.index.candidates(self.index_literals(flags))
+
+    def __getstate__(self):
+        # The sqlite connections can't be sent to a worker process.
+        state = self.__dict__.copy()
+        state['cache'] = None
+        state['index'] = None
+        state['tree'] = None
+        return state
+
+    def index_literals(self, flags):
+        '''
+        Return literals: each match of a rule contains one of them.
+        '''
+        if self.no_regex:
+            return [pattern for pattern, text in self.rules]
+        return [regex_analysis.required_literal(pattern, flags) for pattern, text in self.rules]
+
+    def dot_all_stream_limit(self, flags, ignore_lines):
+        '''
+        Return why do_file__dot_all_stream() can't be used, or None.
+        '''
+        if self.regex is None:
+            return 'with --no-regex'
+        if len(self.rules) > 1:
+            return 'with several rules'
+        if ignore_lines:
+            return 'with --ignore'
+        # The windows can't handle empty matches.
+        if regex_analysis.min_width(self.pattern, flags) == 0:
+            return 'if the pattern can match the empty string'
+        return None
+
+    def cache_fingerprint(self):
+        '''
+        Everything which changes the result of checking a file.
+        '''
+        import hashlib
+        ignore_lines = [(regex.pattern, regex.flags) for regex in self.ignore_lines]
+        # The windows of --stream can miss long matches, and the engines can
+        # differ, too.
+        return hashlib.sha256(repr((self.rules, bool(self.no_regex), self.dotall, self.ignorecase,
+                                    ignore_lines, self.binary_detection, self.binary_by_ending,
+                                    self.compressed, bool(self.stream),
+                                    self.max_match_span, self.engine)).encode('utf8')).hexdigest()
+
+    def new_stats(self):
+        stats = {'stat-calls-saved': 0, 'prefilter-skipped': 0, 'binary-skipped': 0,
+                 'index-skipped': 0, 'timeout-skipped': 0, 'hardlinks-broken': 0,
+                 'hardlink-names': 0, 'content-memo-hits': 0, 'rule-hits': [0] * len(self.rules)}
+        if self.timing:
+            # Seconds. With --jobs the times of the workers get added up, except
+            # time-walk and time-total.
+            #  time-walk:       waiting for the next file of the walk (or --files-from).
+            #  time-read:       opening and reading the files.
+            #  time-match:      searching and replacing.
+            #  time-ignore:     checking the lines of --ignore.
+            #  time-write:      writing the changed files (background thread).
+            #  time-write-wait: waiting for the writer.
+            for key in ['time-total', 'time-walk', 'time-read', 'time-match', 'time-ignore',
+                        'time-write', 'time-write-wait']:
+                stats[key] = 0.0
+            stats['bytes-read'] = 0
+            # Like rule-hits, but each match counts, not each changed line.
+            stats['rule-matches'] = [0] * len(self.rules)
+            # Heap of (seconds, file_name) of the slowest files.
+            stats['slowest-files'] = []
+        return stats
+
+    def add_slow_file(self, seconds, file_name):
+        slowest = self.stats['slowest-files']
+        if len(slowest) < self.slowest_files:
+            heapq.heappush(slowest, (seconds, file_name))
+        elif slowest and seconds > slowest[0][0]:
+            heapq.heapreplace(slowest, (seconds, file_name))
+
+    def add_write_time(self):
+        if self.timing:
+            self.stats['time-write'] += self.writer.seconds
+            self.writer.seconds = 0.0
+
+    def timed_walk(self, files):
+        '''
+        Yield the items of files, adding the time waiting for them to time-walk.
+        '''
+        files = iter(files)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(files)
+            except StopIteration:
+                return
+            finally:
+                self.stats['time-walk'] += time.perf_counter() - start
+            yield item
+
     def do(self, dirname, follow_symlink_files=None):
+        self.process(self.walk(dirname, follow_symlink_files))
+        return self.counter
+
+    def process(self, files):
+        '''
+        Replace in all (file_name, node) tuples of files. See walk().
+        '''
+        for result in self.iter_process(files):
+            pass
+        return self.counter
+
+    def iter_process(self, files):
+        '''
+        Like process(), but yields a FileResult for each file.
+        '''
+        if self.timing:
+            start = time.perf_counter()
+            try:
+                yield from self.iter_process__untimed(self.timed_walk(files))
+            finally:
+                self.stats['time-total'] += time.perf_counter() - start
+            return
+        yield from self.iter_process__untimed(files)
+
+    def iter_process__untimed(self, files):
+        if self.jobs > 1:
+            yield from self.iter_process_parallel(files)
+            return
+        # The changed files get written while the next ones get read.
+        self.writer.start()
+        try:
+            for file_name, node in files:
+                if self.journal is not None and self.skip_finished_file(file_name, node):
+                    yield FileResult(file_name, 'skipped', 'resumed')
+                    continue
+                if self.is_binary_ending(file_name):
+                    self.file_done(file_name, node, False, self.counter)
+                    yield FileResult(file_name, 'skipped', 'binary')
+                    continue
+                inode = self.hardlink_lookup(file_name)
+                if inode is not None and inode.file_name != file_name:
+                    yield self.link_to_inode(file_name, node, inode)
+                    continue
+                counter_before = self.counter.copy() if self.journal is not None else None
+                reason, signature = self.cache_lookup(file_name)
+                if reason:
+                    self.file_done(file_name, node, False, counter_before)
+                    if inode is not None:
+                        inode.changed = False
+                    yield FileResult(file_name, 'skipped', reason)
+                    continue
+                result = self.check_file(file_name)
+                if inode is not None:
+                    inode.changed = result.changed
+                if result.changed:
+                    self.mark_changed(node)
+                elif result.reason != 'timeout':
+                    self.cache_add(file_name, signature)
+                self.file_done(file_name, node, result.changed, counter_before)
+                yield result
+                if self.exit_after_this_file:
+                    break
+            else:
+                self.report_hardlinks()
+        finally:
+            self.writer.close()
+            self.add_write_time()
+            self.journal_written_files()
+            if self.cache is not None:
+                self.cache.flush()
+
+    def check_file(self, file_name):
+        '''
+        Replace in file_name (see replace_in_file()). Returns a FileResult.
+        '''
+        self.offsets = [] if self.collect_offsets else None
+        self.skip_reason = None
+        lines_before = self.counter['lines']
+        start = time.perf_counter() if self.timing else None
+        changed = self.replace_in_file(file_name)
+        if changed:
+            status = 'changed'
+        elif self.skip_reason:
+            status = 'skipped'
+        else:
+            status = 'unchanged'
+        result = FileResult(file_name, status, self.skip_reason, self.counter['lines'] - lines_before,
+                            self.offsets, time.perf_counter() - start if start is not None else None)
+        self.offsets = None
+        return result
+
+    def iter_process_parallel(self, files):
+        # Imported here: it takes longer than the rest of the startup.
+        import concurrent.futures
+        # The regex engine holds the GIL, plain bytes.replace() is cheap enough
+        # for threads.
+        if self.no_regex:
+            executor_class = concurrent.futures.ThreadPoolExecutor
+        else:
+            executor_class = concurrent.futures.ProcessPoolExecutor
+        with executor_class(self.jobs, initializer=_init_worker, initargs=(self,)) as executor:
+            # Results get collected in the order of the walk. This keeps
+            # the output of the files in order and the queue small.
+            pending = collections.deque()
+            try:
+                for file_name, node in files:
+                    if self.journal is not None and self.skip_finished_file(file_name, node):
+                        pending.append((FileResult(file_name, 'skipped', 'resumed'), None))
+                        continue
+                    if self.is_binary_ending(file_name):
+                        self.file_done(file_name, node, False, self.counter)
+                        pending.append((FileResult(file_name, 'skipped', 'binary'), None))
+                        continue
+                    inode = self.hardlink_lookup(file_name)
+                    if inode is not None and inode.file_name != file_name:
+                        # Gets linked when the result of inode.file_name is collected.
+                        pending.append((inode, (node, file_name)))
+                        continue
+                    reason, signature = self.cache_lookup(file_name)
+                    if reason:
+                        self.file_done(file_name, node, False, self.counter)
+                        if inode is not None:
+                            inode.changed = False
+                        pending.append((FileResult(file_name, 'skipped', reason), None))
+                    else:
+                        pending.append((executor.submit(_replace_in_file_in_worker, file_name),
+                                        (node, file_name, signature, inode)))
+                    while len(pending) >= self.jobs * 4 or (pending and pending[0][1] is None):
+                        yield self.collect_worker_result(*pending.popleft())
+                while pending:
+                    yield self.collect_worker_result(*pending.popleft())
+                self.report_hardlinks()
+            finally:
+                # Stopped early: the files of the workers are done, but not counted.
+                for future, args in pending:
+                    if args is not None and not isinstance(future, _Inode):
+                        future.cancel()
+                self.writer.close()
+                if self.cache is not None:
+                    self.cache.flush()
+
+    def collect_worker_result(self, future, args):
+        '''
+        Return the FileResult of a file which was submitted to a worker. If
+        args is None, future is the FileResult of a skipped file. If future
+        is an _Inode, the file is an other name of it (see link_to_inode()).
+        '''
+        if args is None:
+            return future
+        if isinstance(future, _Inode):
+            node, file_name = args
+            return self.link_to_inode(file_name, node, future)
+        node, file_name, signature, inode = args
+        result, counter, stats, output, dirty_dirs = future.result()
+        changed = result.changed
+        if inode is not None:
+            inode.changed = changed
+        # The directories get synced once at the end.
+        self.writer.dirty_dirs.update(dirty_dirs)
+        if output:
+            (self.stdout or sys.stdout).write(output)
+        for key in ['files', 'lines', 'files-checked']:
+            self.counter[key] += counter[key]
+        for key, value in stats.items():
+            if key == 'slowest-files':
+                for seconds, slow_file in value:
+                    self.add_slow_file(seconds, slow_file)
+            elif isinstance(value, list):
+                self.stats[key] = [a + b for a, b in zip(self.stats[key], value)]
+            else:
+                self.stats[key] += value
+        if changed:
+            self.mark_changed(node)
+        elif result.reason != 'timeout':
+            self.cache_add(file_name, signature)
+        if self.journal is not None:
+            # The worker has written the file already.
+            self.journal.file_done(file_name, changed, counter['lines'], counter['files-checked'])
+            self.node_done(node)
+        return result
+
+    def hardlink_lookup(self, file_name):
+        '''
+        With --hardlinks keep: return the _Inode of file_name if it has
+        several links, None otherwise. If the file was found before under an
+        other name, inode.file_name is that name.
+        '''
+        if self.hardlinks != 'keep':
+            return None
+        try:
+            st = os.stat(file_name)
+        except OSError:
+            # The error gets reported when the file gets opened.
+            return None
+        key = (st.st_dev, st.st_ino)
+        inode = self.inodes.get(key)
+        if inode is None:
+            # Checked before the other names: after the first name was
+            # replaced, they have one link less.
+            if st.st_nlink < 2:
+                return None
+            inode = self.inodes[key] = _Inode(file_name, st.st_nlink)
+        elif inode.file_name != file_name:
+            inode.seen += 1
+            if inode.seen == inode.links:
+                # All names were found. The inode can get freed and its
+                # number reused.
+                del self.inodes[key]
+        return inode
+
+    def link_to_inode(self, file_name, node, inode):
+        '''
+        file_name is an other name of inode.file_name, which was checked
+        already. If that was changed, file_name becomes a hard link of the
+        new file. Returns the FileResult.
+        '''
+        self.stats['hardlink-names'] += 1
+        if not inode.changed:
+            self.file_done(file_name, node, False, self.counter)
+            return FileResult(file_name, 'skipped', 'hardlink')
+        if self.verbose:
+            print('Linking %s to %s' % (file_name, inode.file_name), file=self.stdout)
+        self.call_writer(self.writer.link, inode.file_name, file_name)
+        self.counter['files'] += 1
+        self.mark_changed(node)
+        self.file_done(file_name, node, True, self.counter)
+        return FileResult(file_name, 'changed', 'hardlink')
+
+    def report_hardlinks(self):
+        '''
+        Report the changed files with hard links outside of the walked
+        directories (--hardlinks keep). These keep the old content.
+        '''
+        for inode in self.inodes.values():
+            if inode.changed and inode.seen < inode.links:
+                self.stats['hardlinks-broken'] += 1
+                print('%s had %i hard links, %i of them were not found. They keep the old content' % (
+                    inode.file_name, inode.links, inode.links - inode.seen), file=self.stdout)
+
+    def check_hardlinks(self, file_name):
+        '''
+        Report a changed file with several hard links (--hardlinks report).
+        Called before the file gets replaced.
+        '''
+        if self.hardlinks != 'report':
+            return
+        try:
+            links = os.stat(file_name).st_nlink
+        except OSError:
+            return
+        if links > 1:
+            self.stats['hardlinks-broken'] += 1
+            print('%s has %i hard links. The other names keep the old content (see --hardlinks keep)' % (
+                file_name, links), file=self.stdout)
+
+    def resume(self):
+        '''
+        Prepare continuing the run of self.journal: remove its temp files and
+        add its numbers to the counter.
+        '''
+        if not self.journal.resume:
+            return
+        for path in self.journal.remove_temp_files():
+            if self.verbose:
+                print('Removed temp file %s of the killed run' % path)
+        for key, value in self.journal.totals().items():
+            self.counter[key] += value
+
+    def skip_finished_file(self, file_name, node):
+        finished = self.journal.finished_file(file_name)
+        if finished is None:
+            return False
+        if finished[0]:
+            self.mark_changed(node)
+        self.node_done(node)
+        return True
+
+    def skip_finished_dir(self, path, parent):
+        changed_dirs = self.journal.finished_dir(path)
+        if changed_dirs is None:
+            return False
+        if self.verbose:
+            print('Skipping %s (done by the resumed run)' % path)
+        self.counter['dirs'] += changed_dirs
+        node = parent
+        while node is not None:
+            node.changed_dirs += changed_dirs
+            node = node.parent
+        if changed_dirs:
+            self.mark_changed(parent)
+        return True
+
+    def file_done(self, file_name, node, changed, counter_before):
+        '''
+        Record a file in the journal. Changed files get recorded after
+        they were written.
+        '''
+        if self.journal is None:
+            return
+        lines = self.counter['lines'] - counter_before['lines']
+        checked = self.counter['files-checked'] - counter_before['files-checked']
+        if changed:
+            self.unwritten[file_name] = (node, lines, checked)
+        else:
+            self.journal.file_done(file_name, False, lines, checked)
+            self.node_done(node)
+        self.journal_written_files()
+
+    def journal_written_files(self):
+        if self.journal is None:
+            return
+        replaced = self.writer.replaced
+        while replaced:
+            file_name = replaced.popleft()
+            node, lines, checked = self.unwritten.pop(file_name)
+            self.journal.file_done(file_name, True, lines, checked)
+            self.node_done(node)
+
+    def node_done(self, node):
+        '''
+        A file or directory below node is done. Record the directories which
+        are done completely.
+        '''
+        node.pending -= 1
+        while node.walked and not node.pending:
+            if node.path is not None:
+                self.journal.dir_done(node.path, node.changed_dirs)
+            node.walked = False
+            node = node.parent
+            if node is None:
+                return
+            node.pending -= 1
+
+    def node_walked(self, node):
+        if self.journal is None:
+            return
+        node.walked = True
+        # Counts the walk itself, so the check in node_done() happens now.
+        node.pending += 1
+        self.node_done(node)
+
+    def cache_lookup(self, file_name):
+        '''
+        Return (reason, signature). reason is 'index' or 'cache' if the file
+        can be skipped because of the index or the cache, None otherwise.
+        '''
+        if self.cache is None and self.index_candidates is None:
+            return None, None
+        signature = stat_signature(file_name)
+        # The index contains the trigrams of the compressed content.
+        if (self.index is not None and not self.compression(file_name)
+                and self.index.can_skip(file_name, signature, self.index_candidates)):
+            self.stats['index-skipped'] += 1
+            return 'index', signature
+        if self.cache is not None and self.cache.lookup(file_name, signature):
+            self.counter['files-cached'] += 1
+            return 'cache', signature
+        return None, signature
+
+    def cache_add(self, file_name, signature):
+        # With --ask a file can be unchanged although it has a match.
+        if self.cache is None or self.ask:
+            return
+        self.cache.add(file_name, signature)
+
+    def copy_for_worker(self):
+        '''
+        Return a copy with its own counter and output buffer. Used to
+        process one file in a thread or process pool.
+        '''
+        worker = copy.copy(self)
+        worker.counter = dict.fromkeys(self.counter, 0)
+        worker.stats = self.new_stats()
+        worker.stdout = io.StringIO()
+        worker.writer = FileWriter(self.writer.durability)
+        worker.writer.on_temp = self.writer.on_temp
+        return worker
+
+    def walk_files_from(self, lines):
+        '''
+        Like walk(), but for file names given one per line (--files-from).
+        A trailing newline gets removed, other whitespace is part of the name.
+        '''
+        for file_name in lines:
+            if file_name.endswith('\n'):
+                file_name = file_name[:-1]
+            # One stat() call. Symbolic links get followed.
+            try:
+                mode = os.stat(file_name).st_mode
+            except OSError:
+                print('%s does not exist' % file_name)
+                continue
+            if stat.S_ISDIR(mode):
+                if self.verbose:
+                    print('Skipping', file_name)
+                continue
+            if not stat.S_ISREG(mode):
+                print('Ignoring %s: No directory and not a file_name' % file_name)
+                continue
+            if self.is_candidate(file_name):
+                node = _Node()
+                node.pending += 1
+                yield file_name, node
+
+    def mark_changed(self, node):
+        # A directory counts as changed if a file below it was changed.
+        marked = 0
+        while node is not None:
+            if not node.changed:
+                node.changed = True
+                self.counter['dirs'] += 1
+                marked += 1
+            elif self.journal is None:
+                break
+            node.changed_dirs += marked
+            node = node.parent
+
+    def walk(self, dirname, follow_symlink_files=None):
+        '''
+        Yield (file_name, node) for each file which should be checked.
+
+        The walk is iterative and depth first. The type information of the
+        os.DirEntry objects returned by os.scandir() gets reused, so on
+        most filesystems no stat() call is needed per entry. Directories
+        excluded by the path filter (or by .gitignore) don't get listed.
+        '''
         if follow_symlink_files is None:
             follow_symlink_files = []
         if isinstance(dirname, (tuple, list)):
             for dir_name in dirname:
-                self.do(dir_name)
-            return self.counter
+                yield from self.walk(dir_name)
+            return
         if (not dirname in follow_symlink_files) and os.path.islink(dirname):
             if self.verbose:
                 print('Skipping symbolic link %s' % dirname)
-            return self.counter
-        if os.path.isdir(dirname):
-            dir_list = os.listdir(dirname)
-            isdir = True
-        else:
-            dir_list = [dirname]
-            isdir = False
-        start_counter = self.counter['files']
-        for file_name in dir_list:
-            if self.exit_after_this_file:
-                break
-            if isdir:
-                file_name = os.path.join(dirname, file_name)
-            if (not file_name in follow_symlink_files) and os.path.islink(file_name):
-                if self.verbose:
-                    print('Skipping symbolic link %s' % file_name)
-                continue
-            if os.path.isdir(file_name):
-                if (not self.no_std_exclude) and os.path.basename(file_name) in STD_EXCLUDES:
-                    if self.verbose:
-                        print('Skipping', file_name)
-                    continue
-                self.do(file_name)
-            elif os.path.isfile(file_name):
-                self.do_file(file_name)
+            return
+        if not os.path.isdir(dirname):
+            root = _Node()
+            if os.path.isfile(dirname):
+                if self.is_candidate(dirname):
+                    root.pending += 1
+                    yield dirname, root
+            elif not os.path.exists(dirname):
+                print('%s does not exist' % dirname)
             else:
-                if not os.path.exists(file_name):
-                    print('%s does not exist' % file_name)
+                print('Ignoring %s: No directory and not a file_name' % dirname)
+            return
+        if self.journal is not None and self.skip_finished_dir(dirname, None):
+            return
+        root = _Node(path=dirname)
+        # Length of the prefix which gets removed to get the relative path.
+        root_length = len(os.path.join(dirname, ''))
+        entries = self.list_dir(dirname)
+        stack = [(iter(entries), root, follow_symlink_files, self.gitignores(entries, (), root_length))]
+        while stack:
+            entries, node, follow, gitignores = stack[-1]
+            for entry in entries:
+                # os.path.islink(), os.path.isdir() and os.path.isfile()
+                # would need up to three stat() calls for this entry.
+                if entry.is_symlink():
+                    if not entry.path in follow:
+                        self.stats['stat-calls-saved'] += 1
+                        if self.verbose:
+                            print('Skipping symbolic link %s' % entry.path)
+                        continue
+                    # Following the link needs one stat() call.
+                    self.stats['stat-calls-saved'] -= 1
+                rel_path = entry.path[root_length:]
+                if entry.is_dir():
+                    self.stats['stat-calls-saved'] += 2
+                    if self.path_filter.skip_dir(rel_path, entry.name) or (
+                            gitignores and self.is_git_ignored(gitignores, entry.path, True)):
+                        if self.verbose:
+                            print('Skipping', entry.path)
+                        continue
+                    if self.journal is not None and self.skip_finished_dir(entry.path, node):
+                        continue
+                    node.pending += 1
+                    sub_entries = self.list_dir(entry.path)
+                    stack.append((iter(sub_entries), _Node(node, entry.path), (),
+                                  self.gitignores(sub_entries, gitignores, len(os.path.join(entry.path, '')))))
+                    break
+                self.stats['stat-calls-saved'] += 3
+                if entry.is_file():
+                    if gitignores and self.is_git_ignored(gitignores, entry.path, False):
+                        continue
+                    if self.is_candidate(entry.path, rel_path, entry.name):
+                        node.pending += 1
+                        yield entry.path, node
+                elif not os.path.exists(entry.path):
+                    print('%s does not exist' % entry.path)
                 else:
-                    print('Ignoring %s: No directory and not a file_name' % file_name)
+                    print('Ignoring %s: No directory and not a file_name' % entry.path)
+            else:
+                stack.pop()
+                self.node_walked(node)
 
-        if self.counter['files'] != start_counter:
-            self.counter['dirs'] += 1
+    def list_dir(self, dirname):
+        if self.tree is not None:
+            return self.tree.scandir(dirname)
+        return self.scandir(dirname)
 
-        return self.counter
+    @classmethod
+    def scandir(cls, dirname):
+        # Read the whole directory at once: deep trees would need one
+        # open file descriptor per level otherwise.
+        with os.scandir(dirname) as entries:
+            return list(entries)
+
+    def gitignores(self, entries, parent_gitignores, base_length):
+        '''
+        Return the (GitIgnore, base_length) tuples which apply to entries. Each
+        .gitignore file is valid for its directory and all directories below.
+        '''
+        if not self.gitignore:
+            return parent_gitignores
+        for entry in entries:
+            if entry.name == '.gitignore' and entry.is_file():
+                return parent_gitignores + ((GitIgnore.from_file(entry.path), base_length),)
+        return parent_gitignores
+
+    @classmethod
+    def is_git_ignored(cls, gitignores, path, is_dir):
+        # Rules of deeper .gitignore files override the rules above.
+        for gitignore, base_length in reversed(gitignores):
+            ignored = gitignore.match(path[base_length:], is_dir)
+            if ignored is not None:
+                return ignored
+        return False
 
     def do_file(self, file_name):
-        if self.file_has_ending_to_ignore(file_name):
-            return
-        if self.filename_regex and not re.match(self.filename_regex,
-                                                file_name):
-            return
+        if not self.is_candidate(file_name) or self.is_binary_ending(file_name):
+            return False
+        return self.replace_in_file(file_name)
+
+    def is_candidate(self, file_name, rel_path=None, name=None):
+        if name is None:
+            name = os.path.basename(file_name)
+        if rel_path is None:
+            rel_path = file_name
+        reason = self.path_filter.skip_file(file_name, rel_path, name)
+        if reason is not None:
+            if self.verbose and reason != 'filename':
+                print('Skipping', file_name)
+            return False
+        return True
+
+    def is_binary_ending(self, file_name):
+        '''
+        True if the files with the ending of file_name are binary (see
+        is_binary()). They get skipped without opening them.
+        '''
+        if not self.binary_detection or not self.binary_by_ending:
+            return False
+        ending = self.binary_ending(file_name)
+        if self.binary_endings.get(ending):
+            self.skip_binary_file(file_name, ending)
+            return True
+        return False
+
+    def is_binary(self, file_name, fd):
+        '''
+        Check the first bytes of fd for NUL bytes and control characters.
+        With binary_by_ending, the result gets cached for the file ending of
+        file_name.
+        '''
+        ending = None
+        if self.binary_by_ending:
+            ending = self.binary_ending(file_name)
+            binary = self.binary_endings.get(ending)
+            if binary is not None:
+                return binary
+        head = fd.read(BINARY_SNIFF_SIZE)
+        fd.seek(0)
+        if b'\0' in head:
+            binary = True
+        else:
+            # More than 30% control characters
+            binary = len(head.translate(None, TEXT_BYTES)) * 10 > len(head) * 3
+        if ending:
+            self.binary_endings[ending] = binary
+        return binary
+
+    def binary_ending(self, file_name):
+        '''
+        The file ending for which the result of is_binary() gets cached.
+        '''
+        if self.compressed:
+            # foo.txt.gz: .txt
+            file_name = inner_name(file_name)
+        return file_ending(file_name)
+
+    def compression(self, file_name):
+        '''
+        The ending of the compressed format of file_name if its content gets
+        replaced (--compressed), None otherwise.
+        '''
+        if not self.compressed:
+            return None
+        return compression(file_name)
+
+    def skip_binary_file(self, file_name, ending=None):
+        self.skip_reason = 'binary'
+        self.stats['binary-skipped'] += 1
         if self.verbose:
-            print('Opening %s' % file_name)
-        self.counter['files-checked'] += 1
-        counter_start = self.counter['lines']
-        with io.open(file_name, 'rb') as fd:
-            if self.dotall:
+            if ending:
+                print('Skipping binary file %s (ending %s)' % (file_name, ending), file=self.stdout)
+            else:
+                print('Skipping binary file %s' % file_name, file=self.stdout)
+
+    def replace_in_file(self, file_name):
+        if not self.timing:
+            return self.replace_in_file__untimed(file_name)
+        stats = self.stats
+        start = time.perf_counter()
+        other_before = stats['time-read'] + stats['time-ignore'] + stats['time-write-wait']
+        try:
+            return self.replace_in_file__untimed(file_name)
+        finally:
+            seconds = time.perf_counter() - start
+            other = stats['time-read'] + stats['time-ignore'] + stats['time-write-wait'] - other_before
+            stats['time-match'] += seconds - other
+            self.add_slow_file(seconds, file_name)
+
+    def replace_in_file__untimed(self, file_name):
+        # --files-from can contain a file twice.
+        self.wait_for_writer(file_name)
+        if self.timeout is None:
+            return self.replace_in_file__unlimited(file_name)
+        counter_before = self.counter.copy()
+        try:
+            with MatchBudget(self.timeout) as self.match_budget:
+                return self.replace_in_file__unlimited(file_name)
+        except MatchTimeout:
+            # Partial changes were discarded.
+            self.counter['lines'] = counter_before['lines']
+            if self.offsets is not None:
+                del self.offsets[:]
+            self.skip_reason = 'timeout'
+            self.stats['timeout-skipped'] += 1
+            print('Skipping %s: matching took longer than %s seconds' % (file_name, self.timeout),
+                  file=self.stdout)
+            return False
+        finally:
+            self.match_budget = None
+
+    def replace_in_file__unlimited(self, file_name):
+        with self.open_file(file_name) as fd:
+            if self.binary_detection and self.is_binary(file_name, fd):
+                self.skip_binary_file(file_name)
+                return False
+            if self.verbose:
+                print('Opening %s' % file_name, file=self.stdout)
+            self.counter['files-checked'] += 1
+            counter_start = self.counter['lines']
+            if self.stream and not self.dotall:
+                return self.do_file__stream(fd, file_name, counter_start)
+            if self.dot_all_stream:
+                return self.do_file__dot_all_stream(fd, file_name, counter_start)
+            if self.content_memo is not None:
+                new_file_content = self.do_file__memo(fd, file_name, counter_start)
+            elif self.dotall:
                 new_file_content = self.do_file__dot_all(fd)
             else:
                 new_file_content = self.do_file__not_dot_all(fd, file_name)
 
         if self.counter['lines'] == counter_start:
             # no changes
-            return
+            return False
 
         self.update_file(file_name, new_file_content, counter_start)
+        return True
+
+    def may_match(self, content):
+        '''
+        False if there is no match in content for sure. Checking the
+        whole content at once is much faster than checking line by line.
+        '''
+        for matcher in self.matchers:
+            if matcher.may_match(content):
+                return True
+        return False
 
     def do_file__not_dot_all(self, fd, file_name):
+        content = fd.read()
+        new_file_content = self.replace_lines(content, file_name)
+        if new_file_content is None:
+            self.stats['prefilter-skipped'] += 1
+            return content
+        return new_file_content
+
+    def do_file__memo(self, fd, file_name, counter_start):
+        '''
+        Like do_file__not_dot_all() or do_file__dot_all(), but a content
+        which was seen before reuses its result (--dedupe-content).
+        '''
+        import hashlib
+        content = fd.read()
+        digest = hashlib.sha256(content).digest()
+        memo = self.content_memo.get(digest)
+        stat_keys = ['rule-hits', 'rule-matches'] if self.timing else ['rule-hits']
+        if memo is not None:
+            new_content, lines, offsets, stats = memo
+            self.stats['content-memo-hits'] += 1
+            self.counter['lines'] += lines
+            if self.offsets is not None:
+                self.offsets.extend(offsets)
+            for key, values in zip(stat_keys, stats):
+                self.stats[key] = [a + b for a, b in zip(self.stats[key], values)]
+            return content if new_content is None else new_content
+        stats_before = [list(self.stats[key]) for key in stat_keys]
+        offsets_before = len(self.offsets) if self.offsets is not None else 0
+        if self.dotall:
+            new_content = self.do_file__dot_all(io.BytesIO(content))
+        else:
+            new_content = self.do_file__not_dot_all(io.BytesIO(content), file_name)
+        lines = self.counter['lines'] - counter_start
+        stats = [[a - b for a, b in zip(self.stats[key], before)] for key, before in zip(stat_keys, stats_before)]
+        self.content_memo.add(digest, new_content if lines else None, lines,
+                              self.offsets[offsets_before:] if self.offsets is not None else [], stats)
+        return new_content
+
+    def do_file__stream(self, fd, file_name, counter_start):
+        '''
+        Like do_file__not_dot_all(), but reads blocks of self.buffer_size bytes and
+        writes the result to the temp file while reading. The temp file gets
+        created at the first change, unchanged files don't get written.
+
+        Returns True if the file was changed.
+        '''
+        out = None
+        candidate = False
+        offset = 0
+        pending = []
+        try:
+            while True:
+                block = fd.read(self.buffer_size)
+                if block:
+                    if b'\n' not in block:
+                        # The line is longer than the buffer.
+                        pending.append(block)
+                        continue
+                    cut = block.rfind(b'\n') + 1
+                    pending.append(block[:cut])
+                    rest = block[cut:]
+                else:
+                    rest = b''
+                content = b''.join(pending)
+                pending = [rest]
+                lines_before = self.counter['lines']
+                new_content = self.replace_lines(content, file_name, offset)
+                if new_content is not None:
+                    candidate = True
+                    if out is None and self.counter['lines'] != lines_before:
+                        out = self.open_temp_file(file_name)
+                        with self.open_content(file_name) as original:
+                            copy_bytes(original, out, offset)
+                if out is not None:
+                    out.write(content if new_content is None else new_content)
+                offset += len(content)
+                if not block:
+                    break
+        except BaseException:
+            if out is not None:
+                out.discard()
+            raise
+        if not candidate:
+            self.stats['prefilter-skipped'] += 1
+        if out is None:
+            return False
+        self.replace_with_temp_file(file_name, out)
+        self.file_updated(file_name, counter_start)
+        return True
+
+    def replace_lines(self, content, file_name, offset=0):
+        '''
+        Replace in content, which consists of complete lines. offset is the
+        position of content in the file.
+
+        Returns None if there was no match for sure.
+        '''
+        if self.search_whole_buffer:
+            return self.replace_lines__whole_buffer(content, file_name, offset)
+        if not self.may_match(content):
+            return None
+        return self.replace_lines__line_by_line(content, file_name, offset)
+
+    def replace_lines__whole_buffer(self, content, file_name, offset=0):
+        # The next match gets searched in the whole buffer, and only the line
+        # which contains it gets replaced. Lines without a match are not
+        # touched by Python code.
+        pieces = []
+        pos = 0
+        end = len(content)
+        # Start of the next match of each matcher. -1: no more matches
+        next_starts = [None] * len(self.matchers)
+        while pos < end:
+            start = -1
+            for i, matcher in enumerate(self.matchers):
+                next_start = next_starts[i]
+                if next_start is None or -1 < next_start < pos:
+                    next_start = next_starts[i] = matcher.find(content, pos)
+                if next_start != -1 and (start == -1 or next_start < start):
+                    start = next_start
+            if start == -1:
+                break
+            if start == end and content.endswith(b'\n'):
+                # Empty match behind the last line
+                break
+            line_start = content.rfind(b'\n', pos, start) + 1 or pos
+            line_end = content.find(b'\n', start) + 1 or end
+            line = content[line_start:line_end]
+            if self.ignore_regex is None or not self.is_ignored_line(line, file_name):
+                pieces.append(content[pos:line_start])
+                pieces.append(self.replace_one_line(line, file_name, offset + line_start))
+                pos = line_end
+            elif line_end == end:
+                break
+            else:
+                # The ignored line stays part of the next piece.
+                pieces.append(content[pos:line_end])
+                pos = line_end
+        if not pieces:
+            return None
+        pieces.append(content[pos:])
+        return b''.join(pieces)
+
+    def replace_lines__line_by_line(self, content, file_name, offset=0):
+        fd = io.BytesIO(content)
         new_file_content = []
+        pos = offset
         while True:
             try:
                 line = fd.readline()
             except UnicodeError as exc:
                 unicode_error_hint(exc)
-                print('File %s: %s <===========' % (file_name, exc))
-                print('Encoding: %s' % exc.encoding)
-                print('Hint: %r <==========' % unicode_error_hint(exc))
+                print('File %s: %s <===========' % (file_name, exc), file=self.stdout)
+                print('Encoding: %s' % exc.encoding, file=self.stdout)
+                print('Hint: %r <==========' % unicode_error_hint(exc), file=self.stdout)
                 raise
             if not line:
                 break
-            ignore_this_line = False
-            for ignore_line in self.ignore_lines:
-                if ignore_line.search(line):
-                    ignore_this_line = True
-                    break
-            if ignore_this_line:
-                if self.verbose:
-                    print('Ignoring %s line: %s' % (file_name, line.rstrip()))
+            line_start = pos
+            pos += len(line)
+            if self.ignore_regex is not None and self.is_ignored_line(line, file_name):
                 new_file_content.append(line)
                 continue
 
-            line_replaced = self.replace_one_line(line, file_name)
+            line_replaced = self.replace_one_line(line, file_name, line_start)
             new_file_content.append(line_replaced)
 
         return b''.join(new_file_content)
 
-    def replace_one_line(self, line, file_name):
-        if self.no_regex:
-            line_replaced = self.replace_one_line__no_regex(line)
+    def open_content(self, file_name):
+        '''
+        Open file_name for reading. Compressed files get decompressed (see
+        compression()).
+        '''
+        if self.compression(file_name):
+            return open_compressed(file_name)
+        return io.open(file_name, 'rb')
+
+    def open_file(self, file_name):
+        if not self.timing:
+            return self.open_content(file_name)
+        start = time.perf_counter()
+        fd = _TimedFile(self.open_content(file_name), self.stats)
+        self.stats['time-read'] += time.perf_counter() - start
+        return fd
+
+    def is_ignored_line(self, line, file_name):
+        if self.timing:
+            start = time.perf_counter()
+            found = self.ignore_regex.search(line)
+            self.stats['time-ignore'] += time.perf_counter() - start
         else:
-            line_replaced = self.replace_one_line__regex(line)
+            found = self.ignore_regex.search(line)
+        if not found:
+            return False
+        if self.verbose:
+            print('Ignoring %s line: %s' % (file_name, line.rstrip()), file=self.stdout)
+        return True
+
+    def ignored_spans(self, content):
+        '''
+        Return the sorted list of (start, end) of the lines in content which
+        match one of ignore_lines.
+        '''
+        if not self.timing:
+            return self.ignored_spans__untimed(content)
+        start = time.perf_counter()
+        try:
+            return self.ignored_spans__untimed(content)
+        finally:
+            self.stats['time-ignore'] += time.perf_counter() - start
+
+    def ignored_spans__untimed(self, content):
+        spans = []
+        end = len(content)
+        if self.ignore_buffer_regex is not None:
+            pos = 0
+            while pos < end:
+                match = self.ignore_buffer_regex.search(content, pos)
+                if match is None:
+                    break
+                line_start = content.rfind(b'\n', 0, match.start()) + 1
+                pos = content.find(b'\n', match.start()) + 1 or end
+                if line_start < pos:
+                    spans.append((line_start, pos))
+            return spans
+        pos = 0
+        while pos < end:
+            line_end = content.find(b'\n', pos) + 1 or end
+            if self.ignore_regex.search(content[pos:line_end]):
+                spans.append((pos, line_end))
+            pos = line_end
+        return spans
+
+    def replace_one_line(self, line, file_name, offset=0):
+        '''
+        Return the replaced line. offset is the position of the line in
+        the file.
+        '''
+        line_replaced = line
+        hits = []
+        for matcher in self.matchers:
+            line_replaced = matcher.sub(line_replaced, hits)
         assert line_replaced is not None
         if line == line_replaced:
             return line
         if self.ask and (not self.doask(file_name, line, line_replaced)):
             return line
         self.counter['lines'] += 1
+        if self.offsets is not None:
+            self.offsets.append(offset)
+        rule_hits = self.stats['rule-hits']
+        for index in set(hits):
+            rule_hits[index] += 1
+        if self.timing:
+            rule_matches = self.stats['rule-matches']
+            for index in hits:
+                rule_matches[index] += 1
         if self.print_lines:
-            sys.stdout.write('%s old: %s%s new: %s' % (
+            (self.stdout or sys.stdout).write('%s old: %s%s new: %s' % (
                 file_name, line, file_name, line_replaced))
         return line_replaced
 
-    def replace_one_line__no_regex(self, line):
-        return line.replace(self.pattern, self.text)
-
-    def replace_one_line__regex(self, line):
-        return self.regex.sub(self.text, line)
+    def do_file__dot_all_stream(self, fd, file_name, counter_start):
+        '''
+        Like do_file__dot_all(), but scans overlapping windows and writes the
+        result to the temp file while reading.
+
+        Only matches which start at least self.max_match_span bytes before the
+        end of the window get replaced. The following window starts behind
+        them, and keeps self.max_match_span bytes before that position for
+        lookbehind assertions.
+
+        Returns True if the file was changed.
+        '''
+        out = None
+        span = self.max_match_span
+        window = b''
+        pos = 0  # position in window up to which the result was written
+        offset = 0  # position of window[0] in the file
+        try:
+            while True:
+                block = fd.read(self.buffer_size)
+                window += block
+                limit = len(window) - span if block else len(window)
+                if block and limit <= pos:
+                    continue
+                pieces = []
+                copied = pos
+                for match in self.regex.finditer(window, pos):
+                    start, end = match.span()
+                    if start >= limit:
+                        break
+                    pieces.append(window[copied:start])
+                    pieces.append(match.expand(self.text))
+                    copied = end
+                    self.counter['lines'] += 1
+                    if self.offsets is not None:
+                        self.offsets.append(offset + start)
+                    self.stats['rule-hits'][0] += 1
+                    if self.timing:
+                        self.stats['rule-matches'][0] += 1
+                next_pos = max(copied, limit)
+                if pieces and out is None:
+                    out = self.open_temp_file(file_name)
+                    with self.open_content(file_name) as original:
+                        copy_bytes(original, out, offset + pos)
+                if out is not None:
+                    out.write(b''.join(pieces))
+                    out.write(window[copied:next_pos])
+                if not block:
+                    break
+                keep = max(0, next_pos - span)
+                window = window[keep:]
+                offset += keep
+                pos = next_pos - keep
+        except BaseException:
+            if out is not None:
+                out.discard()
+            raise
+        if out is None:
+            return False
+        self.replace_with_temp_file(file_name, out)
+        self.file_updated(file_name, counter_start)
+        return True
 
     def do_file__dot_all(self, fd):
         assert not self.ask
-        content = fd.read()
-        (new_file_content, n) = self.regex.subn(self.text, content)
-        if n:
-            self.counter['lines'] += n
+        new_file_content = fd.read()
+        # With --dotall each match counts as a hit.
+        rule_hits = [0] * len(self.rules)
+        for matcher in self.matchers:
+            keep = None
+            if self.ignore_regex is not None:
+                keep = self.touches_spans(self.ignored_spans(new_file_content))
+            (new_file_content, n) = matcher.subn(new_file_content, rule_hits, keep, self.offsets)
+            if n:
+                self.counter['lines'] += n
+        for key in (['rule-hits', 'rule-matches'] if self.timing else ['rule-hits']):
+            self.stats[key] = [a + b for a, b in zip(self.stats[key], rule_hits)]
         return new_file_content
 
+    @classmethod
+    def touches_spans(cls, spans):
+        '''
+        Return a function which returns True if the match from start to end
+        overlaps one of the sorted, disjoint spans. An empty match touches
+        the span it is in.
+        '''
+        starts = [span_start for span_start, span_end in spans]
+
+        def touches(start, end):
+            i = bisect.bisect_right(starts, max(end, start + 1) - 1) - 1
+            return i >= 0 and spans[i][1] > start
+
+        return touches
+
     def update_file(self, file_name, out, counter_start=0):
-        counter_now = self.counter['lines']
+        if self.compression(file_name):
+            temp = self.open_temp_file(file_name)
+            try:
+                # Compressing is part of writing, not of the match budget.
+                self.call_writer(temp.write, out)
+            except BaseException:
+                temp.discard()
+                raise
+            self.replace_with_temp_file(file_name, temp)
+        else:
+            self.check_hardlinks(file_name)
+            self.call_writer(self.writer.write, file_name, out, resume=False)
+        self.file_updated(file_name, counter_start)
+
+    def open_temp_file(self, file_name):
+        temp = self.call_writer(self.writer.open, file_name)
+        ending = self.compression(file_name)
+        if ending:
+            temp = CompressedTempFile(temp, ending)
+        return temp
+
+    def replace_with_temp_file(self, file_name, temp):
+        self.check_hardlinks(file_name)
+        if isinstance(temp, CompressedTempFile):
+            try:
+                temp = self.call_writer(temp.finish)
+            except BaseException:
+                temp.discard()
+                raise
+        self.call_writer(self.writer.commit, temp, file_name, resume=False)
+
+    def wait_for_writer(self, file_name):
+        self.call_writer(self.writer.wait_for, file_name)
+
+    def call_writer(self, method, *args, resume=True):
+        '''
+        Call a method of self.writer. Its time gets added to time-write-wait.
+        Writing is not part of the match budget (see MatchBudget). If resume
+        is False, the budget stays paused: the file is done.
+        '''
+        budget = self.match_budget
+        if budget is not None:
+            budget.pause()
+        try:
+            if not self.timing:
+                return method(*args)
+            start = time.perf_counter()
+            try:
+                return method(*args)
+            finally:
+                self.stats['time-write-wait'] += time.perf_counter() - start
+        finally:
+            if budget is not None and resume:
+                budget.resume()
+
+    def file_updated(self, file_name, counter_start):
         self.counter['files'] += 1
-        temp = '%s_%s' % (file_name, random.randint(100000, 999999))
-        with io.open(temp, 'wb') as fd:
-            fd.write(out)
-        # os.rename: single system call, so no
-        # half written files will exist if to process gets
-        # killed.
-        mode = os.stat(file_name).st_mode
-        os.chmod(temp, mode)
-        os.rename(temp, file_name)
-        if self.verbose:
-            print('Changed %s lines in %s' % (
-                counter_now - counter_start, file_name))
 
     file_endings_to_ignore = ['~', '.pyc', '.db', '.gz', '.tgz', '.tar']
 
@@ -329,6 +2112,15 @@ class ReplaceRecursive:
             return False
         if self.always_yes:
             return True
+        if self.match_budget is not None:
+            self.match_budget.pause()
+            try:
+                return self.doask__unlimited(file_name, line, line_replaced)
+            finally:
+                self.match_budget.resume()
+        return self.doask__unlimited(file_name, line, line_replaced)
+
+    def doask__unlimited(self, file_name, line, line_replaced):
         print('Replace in %s:' % file_name)
         print(line)
         print('with:')
@@ -381,17 +2173,76 @@ class ReplaceRecursive:
         print('%r is not a valid action.' % char)
 
 
-def main():
+# The ReplaceRecursive instance of a worker of ReplaceRecursive.iter_process_parallel()
+_worker_replace_recursive = None
+
+
+def _init_worker(replace_recursive):
+    global _worker_replace_recursive
+    _worker_replace_recursive = replace_recursive
+
+
+def _replace_in_file_in_worker(file_name):
+    worker = _worker_replace_recursive.copy_for_worker()
+    result = worker.check_file(file_name)
+    worker.add_write_time()
+    return result, worker.counter, worker.stats, worker.stdout.getvalue(), worker.writer.dirty_dirs
+
+
+def main(argv=None, tree=None):
+    '''
+    The command line interface. tree is the DirectoryTree of the daemon,
+    if the daemon runs the command (see reprec.daemon).
+    '''
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['index']:
+        return index_main(argv[1:])
+    if argv[:1] == ['serve']:
+        from reprec.daemon import serve_main
+        return serve_main(argv[1:])
+    if tree is None and '--no-daemon' not in argv:
+        from reprec.client import client
+        exit_code = client(argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+    resume = None
+    # --no-daemon was handled above, it can be given together with --resume.
+    resume_argv = [arg for arg in argv if arg != '--no-daemon']
+    if len(resume_argv) == 2 and resume_argv[0] == '--resume':
+        resume = resume_argv[1]
+    elif len(resume_argv) == 1 and resume_argv[0].startswith('--resume='):
+        resume = resume_argv[0][len('--resume='):]
+    if resume is not None:
+        resume = os.path.abspath(resume)
+        try:
+            start = Journal.read_start(resume)
+        except (OSError, JournalMismatch) as exc:
+            print(exc)
+            sys.exit(2)
+        os.chdir(start['cwd'])
+        if len(resume_argv) < len(argv) and '--no-daemon' not in start['command']:
+            argv = ['--no-daemon'] + start['command']
+        else:
+            argv = start['command']
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'p:i:f:vna',
+        opts, args = getopt.getopt(argv, 'p:i:f:vnaj:',
                                    ['pattern=', 'insert=', 'no-regex', 'noregex',
                                     'verbose', 'print-lines',
                                     'filename=',
                                     'dotall', 'ignorecase',
-                                    'ask', 'files-from=',
+                                    'ask', 'files-from=', 'files-from0=',
                                     'ignore=',
                                     'no-std-exclude',
                                     'print-std-exclude',
+                                    'jobs=',
+                                    'stream', 'buffer-size=', 'max-match-span=',
+                                    'rules=', 'no-binary-detection', 'binary-by-ending',
+                                    'exclude=', 'exclude-dir=', 'include=', 'gitignore',
+                                    'cache=', 'cache-size=', 'index=', 'durability=',
+                                    'journal=', 'resume=', 'stats', 'stats-json=',
+                                    'engine=', 'timeout=', 'hardlinks=', 'dedupe-content',
+                                    'compressed', 'no-daemon',
                                     ])
     except getopt.GetoptError as e:
         usage()
@@ -408,7 +2259,31 @@ def main():
     no_std_exclude = False
     ask = False
     files_from = None
+    files_from0 = False
     ignore_lines = []
+    jobs = 1
+    stream = False
+    buffer_size = DEFAULT_BUFFER_SIZE
+    max_match_span = DEFAULT_MAX_MATCH_SPAN
+    rules = None
+    binary_detection = True
+    binary_by_ending = False
+    excludes = []
+    exclude_dirs = []
+    includes = []
+    gitignore = False
+    cache_file = None
+    cache_size = DEFAULT_MAX_ENTRIES
+    index_file = None
+    durability = 'none'
+    journal_file = None
+    print_timing = False
+    stats_json = None
+    engine = 're'
+    timeout = None
+    hardlinks = 'report'
+    dedupe_content = False
+    compressed = False
     for opt, arg in opts:
         if opt in ['--pattern', '-p']:
             pattern = arg
@@ -433,17 +2308,125 @@ def main():
             no_std_exclude = True
         elif opt in ['--ask', '-a']:
             ask = True
-        elif opt == '--files-from':
+        elif opt in ['--files-from', '--files-from0']:
+            files_from0 = opt == '--files-from0'
             if arg == '-':
-                files_from = sys.stdin
+                if tree is not None:
+                    # The daemon has not got the stdin of the client.
+                    from reprec.daemon import RunInClient
+                    raise RunInClient()
+                files_from = sys.stdin.buffer
             else:
-                files_from = io.open(arg)
+                files_from = io.open(arg, 'rb')
         elif opt == '--ignore':
-            ignore_lines.append(re.compile(arg))
+            try:
+                ignore_lines.append(re.compile(arg.encode('utf8')))
+            except re.error as e:
+                print("regular expression has syntax error: '%s': %s" % (arg, e))
+                sys.exit(2)
+        elif opt in ['--jobs', '-j']:
+            try:
+                jobs = int(arg)
+            except ValueError:
+                jobs = 0
+            if jobs < 1:
+                print('--jobs needs a positive number: %s' % arg)
+                sys.exit(2)
+        elif opt == '--stream':
+            stream = True
+        elif opt == '--buffer-size':
+            try:
+                buffer_size = int(arg)
+            except ValueError:
+                buffer_size = 0
+            if buffer_size < 1:
+                print('--buffer-size needs a positive number: %s' % arg)
+                sys.exit(2)
+        elif opt == '--max-match-span':
+            try:
+                max_match_span = int(arg)
+            except ValueError:
+                max_match_span = 0
+            if max_match_span < 1:
+                print('--max-match-span needs a positive number: %s' % arg)
+                sys.exit(2)
+        elif opt == '--exclude':
+            excludes.append(arg)
+        elif opt == '--exclude-dir':
+            exclude_dirs.append(arg)
+        elif opt == '--include':
+            includes.append(arg)
+        elif opt == '--gitignore':
+            gitignore = True
+        elif opt == '--cache':
+            cache_file = arg
+        elif opt == '--cache-size':
+            try:
+                cache_size = int(arg)
+            except ValueError:
+                cache_size = 0
+            if cache_size < 1:
+                print('--cache-size needs a positive number: %s' % arg)
+                sys.exit(2)
+        elif opt == '--index':
+            if not os.path.exists(arg):
+                print('%s does not exist. Create it with: %s index build --index %s dirs' % (
+                    arg, os.path.basename(sys.argv[0]), arg))
+                sys.exit(2)
+            index_file = arg
+        elif opt == '--durability':
+            if arg not in DURABILITY_LEVELS:
+                print('--durability needs one of %s: %s' % (', '.join(DURABILITY_LEVELS), arg))
+                sys.exit(2)
+            durability = arg
+        elif opt == '--journal':
+            journal_file = arg
+        elif opt == '--resume':
+            print('--resume needs to be the only option (except --no-daemon): the others get read from the journal')
+            sys.exit(2)
+        elif opt == '--engine':
+            if arg not in ENGINES:
+                print('--engine needs one of %s: %s' % (', '.join(ENGINES), arg))
+                sys.exit(2)
+            engine = arg
+        elif opt == '--timeout':
+            try:
+                timeout = float(arg)
+            except ValueError:
+                timeout = 0
+            if timeout <= 0:
+                print('--timeout needs a positive number of seconds: %s' % arg)
+                sys.exit(2)
+        elif opt == '--hardlinks':
+            if arg not in HARDLINK_MODES:
+                print('--hardlinks needs one of %s: %s' % (', '.join(HARDLINK_MODES), arg))
+                sys.exit(2)
+            hardlinks = arg
+        elif opt == '--dedupe-content':
+            dedupe_content = True
+        elif opt == '--compressed':
+            compressed = True
+        elif opt == '--no-daemon':
+            # See the start of main().
+            pass
+        elif opt == '--stats':
+            print_timing = True
+        elif opt == '--stats-json':
+            stats_json = arg
+        elif opt == '--no-binary-detection':
+            binary_detection = False
+        elif opt == '--binary-by-ending':
+            binary_by_ending = True
+        elif opt == '--rules':
+            try:
+                rules = read_rules(arg)
+            except (OSError, ValueError) as exc:
+                print(exc)
+                sys.exit(2)
         else:
             raise Exception('There is a typo in this if ... elif ...: %s %s' % (opt, arg))
 
-    if (not pattern) and (not text) and len(args) > 1:
+    if (not pattern) and (not text) and len(args) > 1 and rules is None:
         pattern = args[0]
         text = args[1]
         args = args[2:]
@@ -456,22 +2439,312 @@ def main():
             print('%s does not exist' % arg)
             sys.exit(2)
 
-    if None in [pattern, text]:
+    if (pattern is None) != (text is None) or (pattern is None and rules is None):
         usage()
         sys.exit(2)
     if len(args) == 0 and not files_from:
         # reprec.py  .... $(find ...) --> don't use '.' if the find command returns nothing.
         print('Use "." as last argument, if you want to replace recursive in the current directory.')
         sys.exit(2)
-    counter = replace_recursive(args, pattern, text, filename_regex, no_regex,
-                                verbose=verbose, dotall=dotall,
-                                print_lines=print_lines, no_std_exclude=no_std_exclude, ask=ask,
-                                files_from=files_from, ignorecase=ignorecase, ignore_lines=ignore_lines)
+    if tree is not None and ask:
+        from reprec.daemon import RunInClient
+        raise RunInClient()
+    if dedupe_content and (stream or ask or print_lines):
+        print("You can't use --dedupe-content together with --stream, --ask or --print-lines")
+        sys.exit(2)
+    journal = None
+    if journal_file:
+        if files_from:
+            print("You can't use --journal and --files-from together")
+            sys.exit(2)
+        journal = Journal(resume or journal_file, command=argv, resume=resume is not None)
+    stats = {}
+    counter = {}
+    try:
+        for result in iter_replace(args, pattern, text, filename_regex, no_regex,
+                                   verbose=verbose, dotall=dotall,
+                                   print_lines=print_lines, no_std_exclude=no_std_exclude, ask=ask,
+                                   files_from=files_from, files_from0=files_from0,
+                                   ignorecase=ignorecase, ignore_lines=ignore_lines,
+                                   stats=stats, jobs=jobs, stream=stream, buffer_size=buffer_size,
+                                   max_match_span=max_match_span, rules=rules,
+                                   binary_detection=binary_detection, binary_by_ending=binary_by_ending,
+                                   excludes=excludes, exclude_dirs=exclude_dirs, includes=includes,
+                                   gitignore=gitignore,
+                                   cache_file=cache_file, cache_size=cache_size, index_file=index_file,
+                                   durability=durability, journal=journal,
+                                   timing=print_timing or stats_json is not None,
+                                   counter=counter, offsets=False, engine=engine, timeout=timeout,
+                                   hardlinks=hardlinks, dedupe_content=dedupe_content,
+                                   compressed=compressed):
+            if verbose:
+                print_file_result(result)
+    except JournalMismatch as exc:
+        print(exc)
+        sys.exit(2)
     dirs = counter['dirs']
     files = counter['files']
     lines = counter['lines']
     files_checked = counter['files-checked']
     print('Replaced %i directories %i files %i lines. %i files checked' % (dirs, files, lines, files_checked))
+    if cache_file:
+        print('Skipped %i unchanged files without a match (cache)' % counter['files-cached'])
+    if stats['timeout-skipped']:
+        print('Skipped %i files which took longer than %s seconds' % (stats['timeout-skipped'], timeout))
+    if verbose:
+        print('Saved %i stat() calls while walking the directories' % stats['stat-calls-saved'])
+        print('Skipped %i files without a match before splitting them into lines' % stats['prefilter-skipped'])
+        print('Skipped %i binary files' % stats['binary-skipped'])
+        if index_file:
+            print('Skipped %i files which cannot contain a match (index)' % stats['index-skipped'])
+        if hardlinks == 'keep':
+            print('Skipped %i other names of files with several hard links' % stats['hardlink-names'])
+        if dedupe_content:
+            print('Reused the result of %i files with the same content' % stats['content-memo-hits'])
+    if rules is not None:
+        all_rules = ([(pattern.encode('utf8'), text.encode('utf8'))] if pattern is not None else []) + rules
+        for (rule_pattern, rule_text), hits in zip(all_rules, stats['rule-hits']):
+            print('%8i %s -> %s' % (hits, rule_pattern.decode('utf8', 'replace'), rule_text.decode('utf8', 'replace')))
+    if print_timing or stats_json is not None:
+        import json
+        summary = stats_summary(counter, stats)
+        if print_timing:
+            print_stats(summary)
+        if stats_json == '-':
+            print(json.dumps(summary, indent=2, sort_keys=True))
+        elif stats_json is not None:
+            with open(stats_json, 'w') as fd:
+                json.dump(summary, fd, indent=2, sort_keys=True)
+                fd.write('\n')
+
+
+def index_main(argv):
+    '''
+    reprec index build|update: create or update the trigram index of --index.
+    '''
+    try:
+        opts, args = getopt.gnu_getopt(argv, 'v', ['index=', 'verbose', 'no-std-exclude',
+                                               'exclude=', 'exclude-dir='])
+    except getopt.GetoptError as e:
+        usage()
+        print(e)
+        sys.exit(2)
+    index_file = None
+    verbose = False
+    no_std_exclude = False
+    excludes = []
+    exclude_dirs = []
+    for opt, arg in opts:
+        if opt == '--index':
+            index_file = arg
+        elif opt in ['--verbose', '-v']:
+            verbose = True
+        elif opt == '--no-std-exclude':
+            no_std_exclude = True
+        elif opt == '--exclude':
+            excludes.append(arg)
+        elif opt == '--exclude-dir':
+            exclude_dirs.append(arg)
+        else:
+            raise Exception('There is a typo in this if ... elif ...: %s %s' % (opt, arg))
+    if not args or args[0] not in ['build', 'update'] or index_file is None or len(args) < 2:
+        usage()
+        sys.exit(2)
+    command, dirs = args[0], args[1:]
+    for arg in dirs:
+        if not os.path.exists(arg):
+            print('%s does not exist' % arg)
+            sys.exit(2)
+    counter = update_index(index_file, dirs, rebuild=(command == 'build'), verbose=verbose,
+                           no_std_exclude=no_std_exclude, excludes=excludes, exclude_dirs=exclude_dirs)
+    print('Indexed %i files, %i unchanged, %i removed' % (
+        counter['indexed'], counter['unchanged'], counter['removed']))
+
+
+def update_index(index_file, dirs, rebuild=False, verbose=False, no_std_exclude=False,
+                 excludes=None, exclude_dirs=None):
+    '''
+    Index the files below dirs (see TrigramIndex). Returns the counter dict.
+    '''
+    # Only the walker of this instance gets used.
+    walker = ReplaceRecursive(b'', b'', no_regex=True, verbose=verbose, no_std_exclude=no_std_exclude,
+                              binary_detection=False, excludes=excludes, exclude_dirs=exclude_dirs)
+    index = TrigramIndex(index_file)
+    try:
+        if rebuild:
+            index.clear()
+        return index.update((file_name for file_name, node in walker.walk(dirs, follow_symlink_files=dirs)),
+                            verbose=verbose)
+    finally:
+        index.close()
+
+
+def print_file_result(result):
+    '''
+    Print a FileResult of iter_replace() like --verbose.
+    '''
+    if result.reason == 'hardlink':
+        # Printed by ReplaceRecursive.link_to_inode().
+        return
+    if result.changed:
+        print('Changed %s lines in %s' % (result.lines, result.file_name))
+    elif result.reason == 'index':
+        print('Skipping %s (index)' % result.file_name)
+    elif result.reason == 'cache':
+        print('Skipping unchanged file %s (cache)' % result.file_name)
+
+
+def stats_summary(counter, stats):
+    '''
+    Return a dict (which can be written as JSON) of the counter and the
+    stats of a run with timing (see replace_recursive()), with the
+    throughput and the slowest files.
+    '''
+    summary = {key: value for key, value in stats.items() if key != 'slowest-files'}
+    summary['counter'] = dict(counter)
+    seconds = stats['time-total']
+    summary['files-per-second'] = counter['files-checked'] / seconds if seconds else 0.0
+    summary['bytes-per-second'] = stats['bytes-read'] / seconds if seconds else 0.0
+    summary['slowest-files'] = [[file_name, file_seconds] for file_seconds, file_name in
+                                sorted(stats['slowest-files'], reverse=True)]
+    return summary
+
+
+def print_stats(summary):
+    print('Time: %.3fs. Walk %.3fs, read %.3fs, match %.3fs, ignore %.3fs, write %.3fs, '
+          'waiting for the writer %.3fs' % tuple(summary[key] for key in [
+              'time-total', 'time-walk', 'time-read', 'time-match', 'time-ignore', 'time-write',
+              'time-write-wait']))
+    print('Throughput: %.1f files/s, %.1f MB/s (%i bytes read)' % (
+        summary['files-per-second'], summary['bytes-per-second'] / 10 ** 6, summary['bytes-read']))
+    print('Matches of each rule: %s' % ' '.join(str(matches) for matches in summary['rule-matches']))
+    if summary['slowest-files']:
+        print('Slowest files:')
+        for file_name, seconds in summary['slowest-files']:
+            print('%9.3fs %s' % (seconds, file_name))
+
+
+def read_file_names(fd, separator=b'\n', block_size=64 * 1024):
+    '''
+    Yield the names in the binary file fd, which are separated (or terminated)
+    by separator. Each name gets yielded as soon as it was read, even if
+    the writer of a pipe is not finished.
+    '''
+    # The raw file: a buffered reader holds its lock while a read waits for
+    # the pipe. Workers forked meanwhile (--jobs) would hang closing stdin.
+    raw = getattr(fd, 'raw', fd)
+    read = getattr(raw, 'read1', raw.read)
+    rest = b''
+    while True:
+        block = read(block_size)
+        if not block:
+            break
+        names = (rest + block).split(separator)
+        rest = names.pop()
+        for name in names:
+            if name:
+                yield os.fsdecode(name)
+    if rest:
+        yield os.fsdecode(rest)
+
+
+def prefetch(iterable, size=1024):
+    '''
+    Iterate iterable in a thread, up to size items ahead of the consumer.
+    Exceptions of the iterable get raised in the consumer. If the consumer
+    stops early, the thread ends after the next item of iterable.
+    '''
+    items = queue.Queue(size)
+    end = object()
+    stopped = threading.Event()
+
+    def put(item):
+        # False if the consumer stopped: nobody would take the item.
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as exc:
+            put((end, exc))
+            return
+        put((end, None))
+
+    threading.Thread(target=produce, name='reprec-prefetch', daemon=True).start()
+    try:
+        while True:
+            item, exc = items.get()
+            if item is end:
+                if exc is not None:
+                    raise exc
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+class _RegexList:
+    '''
+    Regexes which could not be combined (see combine_regexes()).
+    '''
+
+    def __init__(self, regexes):
+        self.regexes = regexes
+
+    def search(self, string):
+        for regex in self.regexes:
+            match = regex.search(string)
+            if match:
+                return match
+        return None
+
+
+# The flags which can be applied to a part of a pattern: (?i:...)
+_SCOPED_FLAGS = [(re.IGNORECASE, b'i'), (re.MULTILINE, b'm'), (re.DOTALL, b's'), (re.VERBOSE, b'x')]
+
+
+def combine_regexes(regexes):
+    '''
+    Return one bytes regex which matches where one of regexes matches, or
+    None if regexes is empty. The regexes can be compiled or not, str or bytes.
+
+    If the regexes can't be combined (backreferences, global inline flags,
+    other flags than i, m, s, x), an object with the same search() method
+    is returned, which tries one regex after the other.
+    '''
+    if not regexes:
+        return None
+    parts = []
+    compiled = []
+    combinable = True
+    for regex in regexes:
+        pattern, flags = getattr(regex, 'pattern', regex), getattr(regex, 'flags', 0)
+        if isinstance(pattern, str):
+            pattern = pattern.encode('utf8')
+        flags &= ~(re.UNICODE | re.ASCII)
+        compiled.append(re.compile(pattern, flags))
+        letters = b''.join(letter for flag, letter in _SCOPED_FLAGS if flags & flag)
+        if flags & ~sum(flag for flag, letter in _SCOPED_FLAGS) or regex_analysis.has_backreference(pattern, flags):
+            combinable = False
+        # The newline ends a comment of a verbose pattern.
+        parts.append(b'(?%s:%s%s)' % (letters, pattern, b'\n' if flags & re.VERBOSE else b''))
+    if len(compiled) == 1:
+        return compiled[0]
+    if combinable:
+        try:
+            return re.compile(b'|'.join(parts))
+        except re.error:
+            # For example global inline flags like (?i) which are not at the start.
+            pass
+    return _RegexList(compiled)
 
 
 def diffdir(tempdir, shoulddir):
@@ -500,6 +2773,43 @@ def diffdir(tempdir, shoulddir):
                 pass
 
 
+def file_ending(file_name):
+    '''
+    Return the lower case file ending including the dot, or '' if there is none.
+    '''
+    return os.path.splitext(os.path.basename(file_name))[1].lower()
+
+
+def read_rules(file_name):
+    '''
+    Read the (pattern, text) tuples of --rules. One rule per line, pattern
+    and text are separated by a tab character.
+    '''
+    rules = []
+    with io.open(file_name, 'rb') as fd:
+        for line_number, line in enumerate(fd, 1):
+            line = line.rstrip(b'\r\n')
+            if not line or line.startswith(b'#'):
+                continue
+            if b'\t' not in line:
+                raise ValueError('%s line %i: pattern and insert need to be separated by a tab: %r' % (
+                    file_name, line_number, line))
+            rules.append(tuple(line.split(b'\t', 1)))
+    return rules
+
+
+def copy_bytes(fd_in, fd_out, length, buffer_size=DEFAULT_BUFFER_SIZE):
+    '''
+    Copy length bytes from fd_in to fd_out.
+    '''
+    while length > 0:
+        data = fd_in.read(min(length, buffer_size))
+        if not data:
+            raise EOFError('%s is shorter than expected' % getattr(fd_in, 'name', fd_in))
+        fd_out.write(data)
+        length -= len(data)
+
+
 ### copy from: http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/134892
 class _Getch:
     '''Gets a single character from standard input.  Does not echo to the
@@ -538,7 +2848,15 @@ class _GetchWindows:
         return msvcrt.getch()
 
 
-getch = _Getch()
+# The _Getch instance of getch(), created at the first call.
+_getch = None
+
+
+def getch():
+    global _getch
+    if _getch is None:
+        _getch = _Getch()
+    return _getch()
 
 
 ### Ende copy
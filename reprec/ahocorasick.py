@@ -0,0 +1,141 @@
+'''
+Aho-Corasick automaton for finding many byte strings in one pass.
+
+The matches are leftmost-longest: of all strings which occur, the one
+starting first wins, and of the strings starting there, the longest one.
+This is the same result as an alternation of the escaped strings sorted
+by length, but the time does not depend on the number of strings.
+
+The interface is a small subset of re.Pattern, so LiteralMatcher can use
+both.
+'''
+
+
+class AhoCorasickMatch:
+    __slots__ = ('string', 'pos', 'endpos')
+
+    def __init__(self, string, pos, endpos):
+        self.string = string
+        self.pos = pos
+        self.endpos = endpos
+
+    def start(self):
+        return self.pos
+
+    def end(self):
+        return self.endpos
+
+    def span(self):
+        return self.pos, self.endpos
+
+    def group(self):
+        return self.string[self.pos:self.endpos]
+
+
+class AhoCorasick:
+    def __init__(self, patterns):
+        # State 0 is the root of the trie.
+        self.goto = [{}]
+        self.fail = [0]
+        self.depth = [0]
+        # Length of the longest pattern which is a suffix of the state (0: none).
+        self.match_length = [0]
+        for pattern in patterns:
+            if not pattern:
+                raise ValueError('Empty patterns are not supported')
+            self._add(pattern)
+        self._build_fail_links()
+
+    def _add(self, pattern):
+        state = 0
+        for byte in pattern:
+            next_state = self.goto[state].get(byte)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.depth.append(self.depth[state] + 1)
+                self.match_length.append(0)
+                self.goto[state][byte] = next_state
+            state = next_state
+        self.match_length[state] = len(pattern)
+
+    def _build_fail_links(self):
+        # Breadth first: the fail link of a state points to a state with
+        # a smaller depth, which is finished already.
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for byte, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and byte not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(byte, 0)
+                if fail == next_state:
+                    fail = 0
+                self.fail[next_state] = fail
+                if not self.match_length[next_state]:
+                    self.match_length[next_state] = self.match_length[fail]
+
+    def search(self, string, pos=0):
+        '''
+        Return the leftmost-longest match at or after pos, or None.
+        '''
+        goto = self.goto
+        fail = self.fail
+        depth = self.depth
+        match_length = self.match_length
+        best_start = best_end = -1
+        state = 0
+        i = pos
+        end = len(string)
+        while i < end:
+            byte = string[i]
+            i += 1
+            while True:
+                next_state = goto[state].get(byte)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            length = match_length[state]
+            if length:
+                start = i - length
+                if best_start == -1 or start < best_start or (start == best_start and i > best_end):
+                    best_start = start
+                    best_end = i
+            if best_start != -1 and i - depth[state] > best_start:
+                # No match starting at best_start or before can follow.
+                break
+        if best_start == -1:
+            return None
+        return AhoCorasickMatch(string, best_start, best_end)
+
+    def finditer(self, string, pos=0):
+        while True:
+            match = self.search(string, pos)
+            if match is None:
+                return
+            yield match
+            pos = match.end()
+
+    def subn(self, repl, string):
+        '''
+        Like re.Pattern.subn(). repl needs to be a callable which gets the match.
+        '''
+        pieces = []
+        copied = 0
+        for match in self.finditer(string):
+            pieces.append(string[copied:match.start()])
+            pieces.append(repl(match))
+            copied = match.end()
+        if not pieces:
+            return string, 0
+        n = len(pieces) // 2
+        pieces.append(string[copied:])
+        return string[:0].join(pieces), n
+
+    def sub(self, repl, string):
+        return self.subn(repl, string)[0]
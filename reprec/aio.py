@@ -0,0 +1,93 @@
+'''
+asyncio front-end of iter_replace().
+
+The run happens in a thread of an executor, so the event loop does not get
+blocked. The files get written like by replace_recursive(): to a temp file,
+which gets renamed. Use jobs to process several files at once (worker
+processes, or threads with no_regex).
+
+    async for result in aiter_replace(['src'], b'foo', b'bar', jobs=4):
+        print(result)
+
+    counter = await areplace_recursive(['src'], b'foo', b'bar')
+'''
+
+import asyncio
+import threading
+
+from reprec import iter_replace
+
+
+async def aiter_replace(dirname, pattern, text, *args, executor=None, queue_size=64, **kwargs):
+    '''
+    Like iter_replace(), but an async iterator. The arguments are the ones
+    of iter_replace(). At most queue_size results get produced ahead of the
+    consumer.
+
+    If the iteration stops (break, exception or cancellation of the task),
+    the run stops after the file which is processed right now. The files
+    done so far are written when the iteration has ended.
+
+    timeout is not supported: its timer (SIGALRM, see MatchBudget) only works
+    in the main thread. Raises ValueError if it is given.
+    '''
+    if kwargs.get('timeout') is not None:
+        raise ValueError('timeout is not supported by aiter_replace(): the run is not in the main thread')
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue()
+    # Free places in results. The thread waits for one before each result.
+    slots = threading.Semaphore(queue_size)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(results.put_nowait, item)
+        except RuntimeError:
+            # The loop was closed.
+            pass
+
+    def run():
+        iterator = iter_replace(dirname, pattern, text, *args, **kwargs)
+        try:
+            for result in iterator:
+                slots.acquire()
+                if stop.is_set():
+                    break
+                put(result)
+        finally:
+            try:
+                iterator.close()
+            finally:
+                put(end)
+
+    future = loop.run_in_executor(executor, run)
+    try:
+        while True:
+            result = await results.get()
+            if result is end:
+                break
+            slots.release()
+            yield result
+    finally:
+        stop.set()
+        # Wake up the thread if it waits for a free place.
+        slots.release()
+        if not future.done():
+            # Let the thread finish the current file and write the changes.
+            await asyncio.shield(future)
+    # Raises the exception of the run.
+    future.result()
+
+
+async def areplace_recursive(dirname, pattern, text, *args, progress=None, **kwargs):
+    '''
+    Like replace_recursive(), but a coroutine. Returns the counter dict.
+
+    progress gets called with each FileResult (see iter_replace()).
+    '''
+    counter = {}
+    async for result in aiter_replace(dirname, pattern, text, *args, counter=counter, offsets=False, **kwargs):
+        if progress is not None:
+            progress(result)
+    return counter
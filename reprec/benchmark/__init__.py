@@ -0,0 +1,270 @@
+'''
+Benchmarks of reprec and setops: python -m reprec.benchmark
+
+The trees and the input files of setops get created by treegen, with a
+fixed seed. The results get written as JSON, together with the commit and
+the parameters, so that the results of two commits can be compared:
+
+  python -m reprec.benchmark --output old.json
+  (checkout the other commit)
+  python -m reprec.benchmark --compare old.json
+'''
+
+import contextlib
+import getopt
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import reprec
+import setops
+from reprec.benchmark.treegen import TreeSpec, generate, generate_lines
+
+RESULT_FORMAT = 1
+
+DEFAULT_REPEAT = 3
+
+DEFAULT_SETOPS_LINES = 2000000
+
+# name --> keyword arguments of replace_recursive()
+REPLACE_BENCHMARKS = {
+    'replace-regex': dict(pattern=br'needle_(\d+)', text=br'NEEDLE_\1'),
+    'replace-no-regex': dict(pattern=b'needle', text=b'NEEDLE', no_regex=True),
+    'replace-dotall': dict(pattern=br'begin of block.*?end of block', text=b'block', dotall=True),
+}
+
+SETOPS_BENCHMARKS = ['setops-%s' % operator.name_of_set_operation for operator in setops.operators]
+
+# name --> code run by a new interpreter, the arguments follow (see bench_startup())
+STARTUP_BENCHMARKS = {
+    'startup-reprec': 'import reprec; reprec.main()',
+    'startup-setops': 'import setops; setops.main()',
+}
+
+BENCHMARKS = ['walk'] + list(REPLACE_BENCHMARKS) + SETOPS_BENCHMARKS + list(STARTUP_BENCHMARKS)
+
+
+def usage():
+    print('''Usage: %s [options]
+
+ Time reprec and setops on generated files and print the results as JSON.
+
+ Options:
+   --output file        Write the results to this file instead of stdout.
+   --compare file       Compare with the results of an other run.
+   --only name          Only run this benchmark. Can be given several times.
+                        Names: %s
+   --repeat n           Run each benchmark n times (default %i). The minimum
+                        gets compared.
+   --setops-lines n     Lines of the input files of setops (default %i).
+   --files n --dirs n --mean-size bytes --size-sigma f --binary-ratio f
+   --match-density f --symlinks n --nesting n --seed n
+                        Parameters of the generated tree (see TreeSpec).
+''' % (os.path.basename(sys.argv[0]), ' '.join(BENCHMARKS), DEFAULT_REPEAT, DEFAULT_SETOPS_LINES))
+
+
+def timed(function, *args, **kwargs):
+    '''
+    Return (seconds, result) of the call.
+    '''
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_walk(tempdir, spec):
+    tree = os.path.join(tempdir, 'tree')
+    if not os.path.exists(tree):
+        generate(tree, spec)
+    walker = reprec.ReplaceRecursive(b'', b'', no_regex=True)
+    seconds, files = timed(lambda: sum(1 for item in walker.walk([tree], follow_symlink_files=[tree])))
+    return seconds, {'files': files}
+
+
+def bench_replace(tempdir, spec, kwargs):
+    # Each run needs the original tree.
+    tree = os.path.join(tempdir, 'tree')
+    if os.path.exists(tree):
+        shutil.rmtree(tree)
+    generate(tree, spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds, counter = timed(reprec.replace_recursive, [tree], **kwargs)
+    shutil.rmtree(tree)
+    return seconds, counter
+
+
+def bench_setops(tempdir, lines, name):
+    set1 = os.path.join(tempdir, 'set1')
+    set2 = os.path.join(tempdir, 'set2')
+    if not os.path.exists(set1):
+        generate_lines(set1, lines, seed=0)
+        generate_lines(set2, lines, seed=1)
+    operator = setops.string_to_operator(name[len('setops-'):])
+
+    def run():
+        # Like setops.main(), without printing.
+        return sorted(operator.execute(setops.string_to_set(set1), setops.string_to_set(set2)))
+
+    seconds, result = timed(run)
+    return seconds, {'lines': len(result)}
+
+
+def bench_startup(tempdir, name):
+    '''
+    Time a command on two tiny files, in a new interpreter: mostly the time
+    of the imports.
+    '''
+    small1 = os.path.join(tempdir, 'small1')
+    small2 = os.path.join(tempdir, 'small2')
+    for file_name, content in [(small1, 'foo\nbar\n'), (small2, 'bar\n')]:
+        with open(file_name, 'w') as fd:
+            fd.write(content)
+    if name == 'startup-reprec':
+        args = ['--no-daemon', 'xyz', 'abc', small1]
+    else:
+        args = [small1, '-', small2]
+    seconds, process = timed(subprocess.run, [sys.executable, '-c', STARTUP_BENCHMARKS[name]] + args,
+                             stdout=subprocess.PIPE, check=True)
+    return seconds, {'output-lines': len(process.stdout.splitlines())}
+
+
+def run_benchmarks(names=None, spec=None, repeat=DEFAULT_REPEAT, setops_lines=DEFAULT_SETOPS_LINES,
+                   verbose=False):
+    '''
+    Run the benchmarks and return the result dict (see RESULT_FORMAT).
+    '''
+    if spec is None:
+        spec = TreeSpec()
+    if names is None:
+        names = BENCHMARKS
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError('Unknown benchmark %s. Use one of %s' % (', '.join(sorted(unknown)), ', '.join(BENCHMARKS)))
+    results = {}
+    tempdir = tempfile.mkdtemp(prefix='reprec_benchmark')
+    try:
+        for name in names:
+            times = []
+            for i in range(repeat):
+                if name == 'walk':
+                    seconds, counter = bench_walk(tempdir, spec)
+                elif name in REPLACE_BENCHMARKS:
+                    seconds, counter = bench_replace(tempdir, spec, REPLACE_BENCHMARKS[name])
+                elif name in STARTUP_BENCHMARKS:
+                    seconds, counter = bench_startup(tempdir, name)
+                else:
+                    seconds, counter = bench_setops(tempdir, setops_lines, name)
+                times.append(seconds)
+            if verbose:
+                print('%-28s %8.3fs' % (name, min(times)), file=sys.stderr)
+            results[name] = {'times': times, 'min': min(times), 'median': statistics.median(times),
+                             'counter': counter}
+    finally:
+        shutil.rmtree(tempdir)
+    return {
+        'format': RESULT_FORMAT,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': int(time.time()),
+        'repeat': repeat,
+        'spec': spec.as_dict(),
+        'setops-lines': setops_lines,
+        'results': results,
+    }
+
+
+def git_commit():
+    '''
+    Return the commit of the checkout of reprec, or None.
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(reprec.__file__),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True).stdout.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    '''
+    Return the lines of a table of the benchmarks of both result dicts.
+    '''
+    lines = ['%-28s %10s %10s %8s' % ('benchmark', 'old', 'new', 'change')]
+    for name in new['results']:
+        if name not in old['results']:
+            continue
+        old_min = old['results'][name]['min']
+        new_min = new['results'][name]['min']
+        lines.append('%-28s %9.3fs %9.3fs %+7.1f%%' % (
+            name, old_min, new_min, (new_min / old_min - 1) * 100 if old_min else 0))
+    for key in ['spec', 'setops-lines', 'python']:
+        if old.get(key) != new.get(key):
+            lines.append('Warning: %s differs: %r != %r' % (key, old.get(key), new.get(key)))
+    return lines
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    spec_options = {'files': int, 'dirs': int, 'mean-size': int, 'size-sigma': float,
+                    'binary-ratio': float, 'match-density': float, 'symlinks': int, 'nesting': int,
+                    'seed': int}
+    try:
+        opts, args = getopt.getopt(argv, 'h', ['help', 'output=', 'compare=', 'only=', 'repeat=',
+                                               'setops-lines='] + ['%s=' % key for key in spec_options])
+    except getopt.GetoptError as e:
+        usage()
+        print(e)
+        sys.exit(2)
+    if args:
+        usage()
+        sys.exit(2)
+    output = None
+    compare_file = None
+    names = []
+    repeat = DEFAULT_REPEAT
+    setops_lines = DEFAULT_SETOPS_LINES
+    spec = TreeSpec()
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            usage()
+            sys.exit()
+        elif opt == '--output':
+            output = arg
+        elif opt == '--compare':
+            compare_file = arg
+        elif opt == '--only':
+            if arg not in BENCHMARKS:
+                print('Unknown benchmark %s. Use one of %s' % (arg, ' '.join(BENCHMARKS)))
+                sys.exit(2)
+            names.append(arg)
+        elif opt == '--repeat':
+            repeat = int(arg)
+        elif opt == '--setops-lines':
+            setops_lines = int(arg)
+        elif opt[2:] in spec_options:
+            setattr(spec, opt[2:].replace('-', '_'), spec_options[opt[2:]](arg))
+        else:
+            raise Exception('There is a typo in this if ... elif ...: %s %s' % (opt, arg))
+    old = None
+    if compare_file:
+        with open(compare_file) as fd:
+            old = json.load(fd)
+    result = run_benchmarks(names or None, spec, repeat, setops_lines, verbose=True)
+    text = json.dumps(result, indent=2, sort_keys=True) + '\n'
+    if output:
+        with open(output, 'w') as fd:
+            fd.write(text)
+    elif old is None:
+        sys.stdout.write(text)
+    if old is not None:
+        print('\n'.join(compare(old, result)))
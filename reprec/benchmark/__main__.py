@@ -0,0 +1,3 @@
+from reprec.benchmark import main
+
+main()
@@ -0,0 +1,152 @@
+'''
+Deterministic synthetic source trees for the benchmarks.
+
+The same TreeSpec (including the seed) always creates the same tree: the
+same names, sizes, contents and symlinks. This keeps the timings of
+different commits comparable.
+'''
+
+import math
+import os
+import random
+
+# Replaced by the benchmarks. NEEDLE_LINE contains a match of all modes.
+NEEDLE = b'needle'
+NEEDLE_LINE = b'x = needle_%i  # begin of block\n'
+BLOCK_END_LINE = b'y = 0  # end of block\n'
+
+WORDS = [b'import', b'return', b'self', b'value', b'counter', b'file_name', b'def', b'class',
+         b'for', b'in', b'if', b'else', b'None', b'True', b'print', b'path', b'data', b'result']
+
+
+class TreeSpec:
+    '''
+    files:          number of regular files.
+    dirs:           number of directories (besides the nested ones).
+    mean_size:      mean size of the text files in bytes. The sizes are
+                    log-normal distributed, like the sizes of real source files.
+    size_sigma:     sigma of the log-normal distribution.
+    binary_ratio:   part of the files which are binary.
+    match_density:  part of the lines of text files which contain a match.
+    symlinks:       number of symlinks to files and directories.
+    nesting:        depth of an additional chain of nested directories.
+    '''
+
+    def __init__(self, files=1000, dirs=50, mean_size=4096, size_sigma=1.0, binary_ratio=0.05,
+                 match_density=0.001, symlinks=20, nesting=32, seed=0):
+        self.files = files
+        self.dirs = dirs
+        self.mean_size = mean_size
+        self.size_sigma = size_sigma
+        self.binary_ratio = binary_ratio
+        self.match_density = match_density
+        self.symlinks = symlinks
+        self.nesting = nesting
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % item for item in sorted(self.__dict__.items())))
+
+
+def text_content(rnd, size, match_density):
+    '''
+    Return about size bytes of source-like lines. Each line contains a match
+    with the probability match_density.
+    '''
+    lines = []
+    length = 0
+    while length < size:
+        if rnd.random() < match_density:
+            line = NEEDLE_LINE % rnd.randrange(1000)
+            lines.append(line)
+            line = BLOCK_END_LINE
+        else:
+            indent = b'    ' * rnd.randrange(4)
+            line = indent + b' '.join(rnd.choice(WORDS) for i in range(rnd.randrange(1, 10))) + b'\n'
+        lines.append(line)
+        length += len(line)
+    return b''.join(lines)
+
+
+def binary_content(rnd, size):
+    # NUL bytes at the start: detected as binary by the first block.
+    if not size:
+        return b'\0\1\2'
+    return b'\0\1\2' + rnd.getrandbits(8 * size).to_bytes(size, 'little')
+
+
+def generate(directory, spec=None):
+    '''
+    Create the tree of spec (a TreeSpec) below directory, which must not
+    exist yet. Returns a counter dict.
+    '''
+    if spec is None:
+        spec = TreeSpec()
+    rnd = random.Random(spec.seed)
+    os.makedirs(directory)
+    counter = {'files': 0, 'binary-files': 0, 'bytes': 0, 'matching-lines': 0, 'dirs': 0, 'symlinks': 0}
+    dirs = [directory]
+    for i in range(spec.dirs):
+        # Random parents give a mix of wide and deep trees.
+        dir_name = os.path.join(rnd.choice(dirs), 'dir%i' % i)
+        os.mkdir(dir_name)
+        dirs.append(dir_name)
+    parent = directory
+    for i in range(spec.nesting):
+        parent = os.path.join(parent, 'n%i' % i)
+        os.mkdir(parent)
+        dirs.append(parent)
+    counter['dirs'] = len(dirs) - 1
+    mu = _lognormal_mu(spec.mean_size, spec.size_sigma)
+    files = []
+    for i in range(spec.files):
+        size = int(rnd.lognormvariate(mu, spec.size_sigma))
+        if rnd.random() < spec.binary_ratio:
+            file_name = os.path.join(rnd.choice(dirs), 'file%i.bin' % i)
+            content = binary_content(rnd, size)
+            counter['binary-files'] += 1
+        else:
+            file_name = os.path.join(rnd.choice(dirs), 'file%i.py' % i)
+            content = text_content(rnd, size, spec.match_density)
+            counter['matching-lines'] += content.count(NEEDLE)
+        with open(file_name, 'wb') as fd:
+            fd.write(content)
+        files.append(file_name)
+        counter['files'] += 1
+        counter['bytes'] += len(content)
+    for i in range(spec.symlinks):
+        targets = files if (i % 2 or len(dirs) == 1) else dirs[1:]
+        if not targets:
+            continue
+        target = rnd.choice(targets)
+        link = os.path.join(rnd.choice(dirs), 'link%i' % i)
+        os.symlink(os.path.relpath(target, os.path.dirname(link)), link)
+        counter['symlinks'] += 1
+    return counter
+
+
+def _lognormal_mu(mean, sigma):
+    # The mean of a log-normal distribution is exp(mu + sigma**2 / 2).
+    return math.log(max(mean, 1)) - sigma ** 2 / 2
+
+
+def generate_lines(file_name, count, seed=0, overlap=0.5):
+    '''
+    Write count lines for the setops benchmarks. Files written with the same
+    count and seed share about the part overlap of their lines with the file
+    of seed 0.
+    '''
+    rnd = random.Random(seed)
+    with open(file_name, 'w') as fd:
+        for i in range(count):
+            if seed and rnd.random() >= overlap:
+                i = count + rnd.getrandbits(40)
+            fd.write('src/module%i/file%i.py\n' % (i % 1000, i))
@@ -0,0 +1,92 @@
+'''
+Client of the daemon (see reprec.daemon).
+
+A reprec command sends its arguments to the daemon if one is running on
+socket_path(), and runs itself otherwise (or with --no-daemon). Commands
+which read stdin (--ask, --files-from -) run in the client.
+
+This module gets imported by each reprec command. socket and json get
+imported when a socket exists.
+'''
+
+import os
+import sys
+
+PROTOCOL = 1
+
+
+def socket_path():
+    '''
+    The socket of the daemon: $REPREC_SOCKET, reprec.sock in
+    $XDG_RUNTIME_DIR, or in a directory of the user in the temp directory.
+    '''
+    path = os.environ.get('REPREC_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'reprec.sock')
+    return os.path.join(private_temp_dir(), 'reprec.sock')
+
+
+def private_temp_dir():
+    '''
+    The directory of the socket in the temp directory, if $XDG_RUNTIME_DIR
+    is not set. The daemon checks that it belongs to the user (see
+    reprec.daemon.Server.listen()).
+    '''
+    # Not tempfile.gettempdir(): importing tempfile would slow down each start.
+    temp_dir = os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(temp_dir, 'reprec-%i' % os.getuid())
+
+
+def send(fd, message):
+    import json
+    fd.write(json.dumps(message).encode('utf8') + b'\n')
+    fd.flush()
+
+
+def client_connect(path):
+    '''
+    Return a socket connected to the daemon, None if none is running.
+    '''
+    try:
+        if os.stat(path).st_uid != os.getuid():
+            # Not started by this user.
+            return None
+    except OSError:
+        return None
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def client(argv, path=None):
+    '''
+    Run the command in the daemon and print its output. Returns the exit
+    code, or None if no daemon is running or the command needs to run in
+    the client.
+    '''
+    sock = client_connect(path or socket_path())
+    if sock is None:
+        return None
+    import json
+    with sock, sock.makefile('rwb') as fd:
+        send(fd, {'protocol': PROTOCOL, 'argv': argv, 'cwd': os.getcwd()})
+        for line in fd:
+            message = json.loads(line)
+            if 'output' in message:
+                sys.stdout.write(message['output'])
+            elif 'exit' in message:
+                sys.stdout.flush()
+                return message['exit']
+            else:
+                return None
+    # The daemon was stopped.
+    print('The daemon on %s did not finish the command' % (path or socket_path()))
+    return 1
@@ -0,0 +1,85 @@
+'''
+Compressed files (--compressed).
+
+The content gets decompressed while it is read. A changed file gets
+compressed into the temp file which replaces it (see reprec.writer),
+unchanged files don't get written.
+
+  .gz:  gzip (level 6, like the gzip command)
+  .bz2: bz2
+  .xz:  lzma (the xz format)
+'''
+
+import importlib
+import os
+
+# File ending --> module which reads and writes the format.
+FORMATS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma'}
+
+
+def compression(file_name):
+    '''
+    Return the ending of the compressed format of file_name, or None.
+    '''
+    ending = os.path.splitext(file_name)[1].lower()
+    if ending in FORMATS:
+        return ending
+    return None
+
+
+def inner_name(file_name):
+    '''
+    Return file_name without the ending of the compressed format.
+    '''
+    if compression(file_name):
+        return os.path.splitext(file_name)[0]
+    return file_name
+
+
+def format_module(ending):
+    '''
+    Return the module of the format. Raises ValueError if it is not
+    available (Python can be built without bz2 and lzma).
+    '''
+    try:
+        return importlib.import_module(FORMATS[ending])
+    except ImportError:
+        raise ValueError('%s files need the module %s' % (ending, FORMATS[ending]))
+
+
+def open_compressed(file_name):
+    '''
+    Return a binary file which reads the decompressed content of file_name.
+    '''
+    return format_module(compression(file_name)).open(file_name, 'rb')
+
+
+class CompressedTempFile:
+    '''
+    Compresses the data written to temp, a TempFile of reprec.writer.
+    finish() returns temp, which can be committed then.
+    '''
+
+    def __init__(self, temp, ending):
+        self.temp = temp
+        module = format_module(ending)
+        if ending == '.gz':
+            self.fd = module.GzipFile(fileobj=temp, mode='wb', compresslevel=6)
+        else:
+            self.fd = module.open(temp, 'wb')
+
+    def write(self, data):
+        self.fd.write(data)
+
+    def finish(self):
+        # Writes the end of the compressed stream. temp stays open.
+        self.fd.close()
+        return self.temp
+
+    def discard(self):
+        try:
+            self.fd.close()
+        except Exception:
+            # The content gets thrown away anyway.
+            pass
+        self.temp.discard()
@@ -0,0 +1,393 @@
+'''
+Daemon mode: reprec serve
+
+The daemon keeps the listings of the walked directories in memory
+(DirectoryTree) and runs the commands of the clients which connect to its
+Unix socket. inotify (Linux) reports the directories which changed, their
+listings get read again at the next walk. The files get read by each
+command, like without the daemon.
+
+  reprec serve [--socket path] [-v|--verbose] [dirs]
+
+dirs get walked at the start. The commands get sent by reprec.client. A
+command gets finished if its client goes away, its output gets lost.
+'''
+
+import contextlib
+import ctypes
+import getopt
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+import traceback
+
+import reprec
+from reprec.client import PROTOCOL, client_connect, private_temp_dir, send, socket_path
+
+# Constants of inotify(7)
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+
+# Changes of the listing of a directory. Changed content does not matter,
+# the files get read by each command.
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# struct inotify_event without the name
+_EVENT = struct.Struct('iIII')
+
+
+class RunInClient(Exception):
+    '''The command needs the terminal or stdin of the client.'''
+
+
+class Inotify:
+    '''
+    inotify(7) via ctypes. Raises ValueError if it is not available.
+    '''
+
+    def __init__(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise ValueError('inotify is not available on this system')
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self.raise_errno()
+
+    def raise_errno(self, path=None):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path)
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self.raise_errno(path)
+        return wd
+
+    def remove_watch(self, wd):
+        # Fails if the directory is gone already.
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        '''
+        Return the pending events as (wd, mask, name) tuples.
+        '''
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                events.append((wd, mask, os.fsdecode(data[pos:pos + length].rstrip(b'\0'))))
+                pos += length
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Entry:
+    '''Like os.DirEntry, for the listings of DirectoryTree.'''
+
+    __slots__ = ('name', 'path', 'kind')
+
+    def __init__(self, name, path, kind):
+        self.name = name
+        self.path = path
+        self.kind = kind
+
+    def is_symlink(self):
+        return self.kind == 'link'
+
+    def is_dir(self):
+        # The target of a link can change without an event.
+        if self.kind == 'link':
+            return os.path.isdir(self.path)
+        return self.kind == 'dir'
+
+    def is_file(self):
+        if self.kind == 'link':
+            return os.path.isfile(self.path)
+        return self.kind == 'file'
+
+
+def entry_kind(entry):
+    if entry.is_symlink():
+        return 'link'
+    if entry.is_dir():
+        return 'dir'
+    if entry.is_file():
+        return 'file'
+    return 'other'
+
+
+class DirectoryTree:
+    '''
+    The listings of the directories, by absolute path. A listing gets
+    dropped when inotify reports a change of the directory (see update()).
+    ReplaceRecursive.walk() uses scandir() instead of os.scandir().
+    '''
+
+    def __init__(self, inotify):
+        self.inotify = inotify
+        # path --> [(name, kind)]
+        self.listings = {}
+        # wd --> set of paths (one directory can have several paths: bind mounts)
+        self.watches = {}
+        # path --> wd
+        self.watched = {}
+        self.hits = 0
+        self.misses = 0
+
+    def scandir(self, dirname):
+        path = os.path.abspath(dirname)
+        listing = self.listings.get(path)
+        if listing is None:
+            self.misses += 1
+            listing = self.list_dir(path)
+        else:
+            self.hits += 1
+        return [_Entry(name, os.path.join(dirname, name), kind) for name, kind in listing]
+
+    def list_dir(self, path):
+        if path not in self.watched:
+            # Before the listing gets read, so that no change gets lost.
+            try:
+                wd = self.inotify.add_watch(path)
+            except OSError:
+                # For example too many watches: the listing does not get kept.
+                wd = None
+            if wd is not None:
+                self.watches.setdefault(wd, set()).add(path)
+                self.watched[path] = wd
+        with os.scandir(path) as entries:
+            listing = [(entry.name, entry_kind(entry)) for entry in entries]
+        if path in self.watched:
+            self.listings[path] = listing
+        return listing
+
+    def update(self):
+        '''
+        Drop the listings of the directories which changed since the last
+        call.
+        '''
+        for wd, mask, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost.
+                self.listings.clear()
+                continue
+            paths = list(self.watches.get(wd, ()))
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                # The paths of the directories below are wrong now, too.
+                for path in paths:
+                    self.forget_tree(path)
+            else:
+                for path in paths:
+                    self.listings.pop(path, None)
+
+    def forget_tree(self, path):
+        prefix = os.path.join(path, '')
+        for watched in [watched for watched in self.watched if watched == path or watched.startswith(prefix)]:
+            wd = self.watched.pop(watched)
+            self.listings.pop(watched, None)
+            paths = self.watches[wd]
+            paths.discard(watched)
+            if not paths:
+                del self.watches[wd]
+                self.inotify.remove_watch(wd)
+
+    def close(self):
+        self.inotify.close()
+
+
+class _ClientOutput:
+    '''sys.stdout of a command run by the daemon: sends the text to the client.'''
+
+    def __init__(self, fd):
+        self.fd = fd
+        # True if the client went away (Ctrl-C). The command gets finished
+        # anyway: it may have changed files already.
+        self.disconnected = False
+
+    def write(self, text):
+        if text and not self.disconnected:
+            try:
+                send(self.fd, {'output': text})
+            except OSError:
+                self.disconnected = True
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class Server:
+    def __init__(self, path=None, verbose=False):
+        self.path = path or socket_path()
+        self.verbose = verbose
+        self.tree = DirectoryTree(Inotify())
+        self.sock = None
+
+    def warm(self, dirs):
+        '''
+        Read the listings of the directories below dirs.
+        '''
+        walker = reprec.ReplaceRecursive(b'', b'', no_regex=True)
+        walker.tree = self.tree
+        for item in walker.walk(dirs, follow_symlink_files=dirs):
+            pass
+
+    def listen(self):
+        running = client_connect(self.path)
+        if running is not None:
+            running.close()
+            raise ValueError('A daemon is running on %s' % self.path)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if directory == private_temp_dir():
+            self.check_private_dir(directory)
+        if os.path.exists(self.path):
+            # Left by a killed daemon.
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.sock.listen(16)
+
+    @classmethod
+    def check_private_dir(cls, directory):
+        '''
+        Raise ValueError if an other user could have created the directory,
+        or could create files in it.
+        '''
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+            raise ValueError('%s needs to be a directory of this user with mode 0700' % directory)
+
+    def serve_forever(self):
+        # One command after the other: commands with the same files must not
+        # run at the same time.
+        while True:
+            conn, address = self.sock.accept()
+            with conn, conn.makefile('rwb') as fd:
+                try:
+                    self.handle(fd)
+                except (OSError, ValueError) as exc:
+                    # The client is gone or sent garbage.
+                    if self.verbose:
+                        print('Error of client: %s' % exc)
+
+    def handle(self, fd):
+        request = json.loads(fd.readline())
+        if request.get('protocol') != PROTOCOL:
+            send(fd, {'local': True})
+            return
+        if self.verbose:
+            print('Running in %s: %s' % (request['cwd'], ' '.join(request['argv'])))
+        self.tree.update()
+        output = _ClientOutput(fd)
+        exit_code = self.run(request['argv'], request['cwd'], output)
+        if output.disconnected:
+            if self.verbose:
+                print('The client went away, the command was finished with exit code %s' % exit_code)
+            return
+        if exit_code is None:
+            send(fd, {'local': True})
+        else:
+            send(fd, {'exit': exit_code})
+
+    def run(self, argv, cwd, output):
+        '''
+        Run the command in cwd. Returns the exit code, or None if it needs
+        to run in the client.
+        '''
+        old_cwd = os.getcwd()
+        try:
+            os.chdir(cwd)
+            with contextlib.redirect_stdout(output):
+                try:
+                    reprec.main(argv, tree=self.tree)
+                except SystemExit as exc:
+                    if exc.code is None or isinstance(exc.code, int):
+                        return exc.code or 0
+                    print(exc.code)
+                    return 1
+                except RunInClient:
+                    return None
+                except Exception:
+                    print(traceback.format_exc(), end='')
+                    return 1
+            return 0
+        finally:
+            os.chdir(old_cwd)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            with contextlib.suppress(OSError):
+                os.unlink(self.path)
+        self.tree.close()
+
+
+def serve_main(argv):
+    '''
+    reprec serve: run the daemon until it gets killed.
+    '''
+    try:
+        opts, args = getopt.gnu_getopt(argv, 'v', ['socket=', 'verbose'])
+    except getopt.GetoptError as e:
+        reprec.usage()
+        print(e)
+        sys.exit(2)
+    path = None
+    verbose = False
+    for opt, arg in opts:
+        if opt == '--socket':
+            path = arg
+        elif opt in ['--verbose', '-v']:
+            verbose = True
+        else:
+            raise Exception('There is a typo in this if ... elif ...: %s %s' % (opt, arg))
+    for arg in args:
+        if not os.path.isdir(arg):
+            print('%s is not a directory' % arg)
+            sys.exit(2)
+    try:
+        server = Server(path, verbose)
+    except ValueError as exc:
+        print(exc)
+        sys.exit(2)
+    try:
+        server.listen()
+    except (OSError, ValueError) as exc:
+        server.close()
+        print(exc)
+        sys.exit(2)
+    # SIGTERM: remove the socket, too.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.warm(args)
+        print('Listening on %s, %i directories read' % (server.path, len(server.tree.listings)))
+        sys.stdout.flush()
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
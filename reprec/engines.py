@@ -0,0 +1,115 @@
+'''
+Regex engines of the matchers (--engine).
+
+  re:      the re module of the standard library (default).
+  re2:     google-re2 (pip install google-re2). The time of a search grows
+           linearly with the size of the content, a pattern can't
+           backtrack catastrophically. Backreferences and lookaround
+           assertions are not supported, and neither are the patterns
+           which would match other text than with re (see check_re2()).
+  auto:    re2 if it is installed and supports the pattern, re otherwise.
+  literal: no regex, like --no-regex.
+
+The compiled patterns of all engines have the methods of the patterns of
+the re module which are used by the matchers: search(), finditer(), sub()
+and subn().
+'''
+
+import re
+
+from reprec import regex_analysis
+
+ENGINES = ('re', 're2', 'auto', 'literal')
+
+# The flags of the re module which can be given to re2 as inline flags.
+_RE2_FLAGS = [(re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's')]
+
+# The categories of re which match other bytes in re2.
+_RE2_OTHER_CATEGORIES = {regex_analysis.sre_constants.CATEGORY_SPACE, regex_analysis.sre_constants.CATEGORY_NOT_SPACE}
+
+
+def compile_regex(pattern, flags=0, engine='re', line_mode=False):
+    '''
+    Compile the bytes pattern with the engine. Raises re.error if the pattern
+    is invalid (or not supported by re2), ValueError if the engine is not
+    available.
+
+    line_mode: the pattern gets used on single lines, which end with a
+    newline.
+    '''
+    if engine == 're':
+        return re.compile(pattern, flags)
+    if engine == 're2':
+        return compile_re2(pattern, flags, line_mode)
+    if engine == 'auto':
+        try:
+            return compile_re2(pattern, flags, line_mode)
+        except (ValueError, re.error):
+            return re.compile(pattern, flags)
+    raise ValueError('Unknown engine %r. Use one of %s' % (engine, ', '.join(ENGINES)))
+
+
+def check_re2(pattern, flags=0, line_mode=False):
+    '''
+    Raise re.error if re2 would replace other text than re. Returns the
+    flags for re2.
+
+    The $ of re matches before a newline at the end, the one of re2 at the
+    end only. A line contains no other newline, so (?m)$ of re2 matches
+    like $ of re there. Empty matches get replaced differently, re2 has no
+    \\Z, and its \\s does not match \\v.
+    '''
+    if regex_analysis.min_width(pattern, flags) == 0:
+        raise re.error('not supported by re2: the pattern can match the empty string')
+    if regex_analysis.categories(pattern, flags) & _RE2_OTHER_CATEGORIES:
+        raise re.error('not supported by re2: \\s and \\S (\\v is no space for re2)')
+    anchors = regex_analysis.single_line_anchors(pattern, flags)
+    if '\\Z' in anchors:
+        raise re.error('not supported by re2: \\Z')
+    if '$' in anchors:
+        # With re.MULTILINE, ^ would match behind the newline, too.
+        if not line_mode or ('^' in anchors and regex_analysis.can_match_newline(pattern, flags)):
+            raise re.error('not supported by re2: $ before a newline at the end')
+        flags |= re.MULTILINE
+    return flags
+
+
+def re2_options(re2):
+    '''
+    Latin-1: one byte is one character, like for the bytes patterns of re.
+    With UTF-8, a.b would match a, one multibyte character and b.
+    '''
+    options = re2.Options()
+    options.encoding = re2.Options.Encoding.LATIN1
+    # The errors get raised. auto would print one for each fallback to re.
+    options.log_errors = False
+    return options
+
+
+def compile_re2(pattern, flags=0, line_mode=False):
+    try:
+        import re2
+    except ImportError:
+        raise ValueError('The engine re2 needs the package google-re2')
+    flags = check_re2(pattern, flags, line_mode)
+    inline = ''
+    for flag, letter in _RE2_FLAGS:
+        if flags & flag:
+            inline += letter
+            flags &= ~flag
+    if flags:
+        raise re.error('flags %r are not supported by re2' % re.RegexFlag(flags))
+    if inline:
+        pattern = ('(?%s)' % inline).encode('ascii') + pattern
+    try:
+        return re2.compile(pattern, options=re2_options(re2))
+    except re2.error as exc:
+        raise re.error('not supported by re2: %s' % exc)
+
+
+def re2_available():
+    try:
+        import re2
+    except ImportError:
+        return False
+    return True
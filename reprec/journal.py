@@ -0,0 +1,158 @@
+'''
+Journal of a run, for resuming it after it was killed (--journal, --resume).
+
+The journal is a file with one JSON object per line. Each line gets written
+with a single os.write() call in append mode, so the worker processes of
+--jobs and the writer thread can add lines, too. A line which was cut by a
+crash gets ignored.
+
+Records:
+  start: fingerprint of patterns and options, the directories, the command
+         line and the working directory.
+  file:  a file was done (and written, if it was changed), with the numbers
+         it added to the counter.
+  dir:   all files below a directory were done, with the number of changed
+         directories below it (including itself).
+  temp:  the name of a temp file. If it still exists when resuming, the
+         file was not renamed, it gets removed.
+'''
+
+import json
+import os
+
+
+class JournalMismatch(Exception):
+    pass
+
+
+class Journal:
+    def __init__(self, file_name, command=None, resume=False):
+        self.file_name = file_name
+        self.command = command
+        self.resume = resume
+        self.fd = None
+        # Data of the journal which gets resumed.
+        self.start_record = None
+        # path --> (changed, lines, files-checked)
+        self.files = {}
+        # path --> number of changed directories
+        self.dirs = {}
+        self.temps = set()
+        if resume:
+            self.load()
+        else:
+            # Truncate an old journal.
+            os.close(os.open(file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
+
+    def __getstate__(self):
+        # Worker processes open the file themselves.
+        state = self.__dict__.copy()
+        state['fd'] = None
+        return state
+
+    @classmethod
+    def read_records(cls, file_name):
+        with open(file_name, 'rb') as fd:
+            for line in fd:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # The last line of a killed run.
+                    continue
+
+    @classmethod
+    def read_start(cls, file_name):
+        for record in cls.read_records(file_name):
+            if record['type'] == 'start':
+                return record
+        raise JournalMismatch('%s is no journal of reprec' % file_name)
+
+    def load(self):
+        for record in self.read_records(self.file_name):
+            kind = record['type']
+            if kind == 'file':
+                self.files[record['path']] = (record['changed'], record['lines'], record['checked'])
+            elif kind == 'dir':
+                self.dirs[record['path']] = record['changed_dirs']
+            elif kind == 'temp':
+                self.temps.add(record['path'])
+            elif kind == 'start':
+                self.start_record = record
+        if self.start_record is None:
+            raise JournalMismatch('%s is no journal of reprec' % self.file_name)
+
+    def start(self, fingerprint, dirs):
+        '''
+        Write the start record, or check that the resumed run was started
+        with the same fingerprint and directories.
+        '''
+        dirs = [self.key(dir_name) for dir_name in dirs]
+        if self.resume:
+            if self.start_record['fingerprint'] != fingerprint or self.start_record['dirs'] != dirs:
+                raise JournalMismatch('%s was written by a run with other patterns, options or directories' %
+                                      self.file_name)
+            return
+        self.record(type='start', fingerprint=fingerprint, dirs=dirs, command=self.command,
+                    cwd=os.getcwd())
+
+    @classmethod
+    def key(cls, path):
+        return os.fsdecode(os.path.abspath(path))
+
+    def record(self, **values):
+        if self.fd is None:
+            self.fd = os.open(self.file_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self.fd, json.dumps(values).encode('utf8') + b'\n')
+
+    def file_done(self, path, changed, lines, checked):
+        self.record(type='file', path=self.key(path), changed=changed, lines=lines, checked=checked)
+
+    def dir_done(self, path, changed_dirs):
+        self.record(type='dir', path=self.key(path), changed_dirs=changed_dirs)
+
+    def temp_file(self, path):
+        self.record(type='temp', path=self.key(path))
+
+    def finished_file(self, path):
+        '''
+        Return (changed, lines, checked) of a file done by the resumed run, or None.
+        '''
+        return self.files.get(self.key(path))
+
+    def finished_dir(self, path):
+        '''
+        Return the number of changed directories of a directory done by the
+        resumed run, or None.
+        '''
+        return self.dirs.get(self.key(path))
+
+    def totals(self):
+        '''
+        Return the counter of the files done by the resumed run. The
+        directories get counted while walking.
+        '''
+        counter = {'files': 0, 'lines': 0, 'files-checked': 0}
+        for changed, lines, checked in self.files.values():
+            counter['files'] += changed
+            counter['lines'] += lines
+            counter['files-checked'] += checked
+        return counter
+
+    def remove_temp_files(self):
+        '''
+        Remove the temp files of the resumed run which were not renamed.
+        Returns their names.
+        '''
+        removed = []
+        for path in sorted(self.temps):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            removed.append(path)
+        return removed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,163 @@
+'''
+Decide which directories get walked and which files get checked.
+
+Globs use the syntax of .gitignore: '*' and '?' don't match a slash, '**'
+matches any number of directories. A glob without a slash matches the
+name of the file or directory, a glob with a slash matches the path
+relative to the directory which gets walked.
+'''
+
+import os
+import re
+
+
+def glob_to_regex(glob):
+    '''
+    Translate a glob to a regular expression which must match the whole name.
+    '''
+    result = []
+    i = 0
+    end = len(glob)
+    while i < end:
+        char = glob[i]
+        if glob.startswith('**/', i) and (i == 0 or glob[i - 1] == '/'):
+            result.append('(?:.*/)?')
+            i += 3
+            continue
+        if glob.startswith('**', i) and i + 2 == end and (i == 0 or glob[i - 1] == '/'):
+            result.append('.*')
+            i += 2
+            continue
+        if char == '*':
+            result.append('[^/]*')
+        elif char == '?':
+            result.append('[^/]')
+        elif char == '[':
+            start = i + 1
+            if glob[start:start + 1] in ('!', '^'):
+                start += 1
+            # A ']' directly after the '[' is part of the set.
+            close = glob.find(']', start + 1)
+            if close == -1:
+                result.append(re.escape(char))
+            else:
+                negate = '^' if start > i + 1 else ''
+                content = ''.join(c if c == '-' else re.escape(c) for c in glob[start:close])
+                result.append('[%s%s]' % (negate, content))
+                i = close
+        elif char == '\\' and i + 1 < end:
+            i += 1
+            result.append(re.escape(glob[i]))
+        else:
+            result.append(re.escape(char))
+        i += 1
+    return '(?s:%s)\\Z' % ''.join(result)
+
+
+def compile_globs(globs):
+    '''
+    Compile the globs to one regular expression. Returns a pair: the regex for
+    the globs without a slash (matching the name), and the regex for the
+    globs with a slash (matching the relative path). Each of them can be None.
+    '''
+    name_globs = [glob for glob in globs if '/' not in glob.rstrip('/')]
+    path_globs = [glob.lstrip('/') for glob in globs if '/' in glob.rstrip('/')]
+    return _compile_alternation(name_globs), _compile_alternation(path_globs)
+
+
+def _compile_alternation(globs):
+    if not globs:
+        return None
+    return re.compile('|'.join(glob_to_regex(glob.rstrip('/')) for glob in globs))
+
+
+def _matches(regexes, rel_path, name):
+    name_regex, path_regex = regexes
+    if name_regex is not None and name_regex.match(name):
+        return True
+    if path_regex is not None and path_regex.match(rel_path.replace(os.sep, '/')):
+        return True
+    return False
+
+
+class PathFilter:
+    '''
+    The compiled include and exclude rules of a run.
+
+    exclude_dirs: globs of directories which don't get walked.
+    excludes: globs of files and directories which get skipped.
+    includes: if given, only files matching one of these globs get checked.
+    file_endings: files with one of these endings get skipped.
+    filename_regex: if given, only files whose path matches get checked (re.match()).
+    '''
+
+    def __init__(self, exclude_dirs=(), excludes=(), includes=(), file_endings=(), filename_regex=None):
+        self.exclude_dirs = compile_globs(list(exclude_dirs) + list(excludes))
+        self.excludes = compile_globs(excludes)
+        self.includes = compile_globs(includes) if includes else None
+        self.file_endings = tuple(str(ending) for ending in file_endings)
+        self.filename_regex = re.compile(filename_regex) if filename_regex else None
+
+    def skip_dir(self, rel_path, name):
+        return _matches(self.exclude_dirs, rel_path, name)
+
+    def skip_file(self, path, rel_path, name):
+        '''
+        Return the reason for skipping the file, or None.
+        '''
+        if self.file_endings and path.endswith(self.file_endings):
+            return 'ending'
+        if _matches(self.excludes, rel_path, name):
+            return 'excluded'
+        if self.includes is not None and not _matches(self.includes, rel_path, name):
+            return 'not-included'
+        if self.filename_regex is not None and not self.filename_regex.match(path):
+            return 'filename'
+        return None
+
+
+class GitIgnore:
+    '''
+    The rules of one .gitignore file. The last matching rule wins.
+    '''
+
+    def __init__(self, lines):
+        self.rules = []
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line.endswith('\\ '):
+                line = line.rstrip(' ')
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            elif line.startswith('\\#') or line.startswith('\\!'):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            if '/' not in line:
+                # Matches at any level below the .gitignore file
+                line = '**/' + line
+            self.rules.append((re.compile(glob_to_regex(line.lstrip('/'))), negate, dir_only))
+
+    @classmethod
+    def from_file(cls, file_name):
+        with open(file_name, encoding='utf8', errors='surrogateescape') as fd:
+            return cls(fd)
+
+    def match(self, rel_path, is_dir):
+        '''
+        Return True if rel_path (relative to the directory of the .gitignore
+        file) is ignored, False if it is explicitly not ignored (a rule
+        starting with '!'), and None if no rule matches.
+        '''
+        rel_path = rel_path.replace(os.sep, '/')
+        for regex, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negate
+        return None
@@ -0,0 +1,263 @@
+'''
+Static analysis of regular expressions, based on the parser of the re module.
+
+The results are used to skip work: a file which does not contain the
+required literal of a pattern does not need to be split into lines.
+'''
+
+import re
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+NEWLINE = ord('\n')
+
+# Categories (\d, \w, \S ...) which never match a newline.
+_CATEGORIES_WITHOUT_NEWLINE = {
+    sre_constants.CATEGORY_DIGIT,
+    sre_constants.CATEGORY_WORD,
+    sre_constants.CATEGORY_NOT_SPACE,
+    sre_constants.CATEGORY_NOT_LINEBREAK,
+    sre_constants.CATEGORY_LOC_WORD,
+    sre_constants.CATEGORY_UNI_DIGIT,
+    sre_constants.CATEGORY_UNI_WORD,
+    sre_constants.CATEGORY_UNI_NOT_SPACE,
+    sre_constants.CATEGORY_UNI_NOT_LINEBREAK,
+}
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, 'POSSESSIVE_REPEAT'):
+    _REPEATS.add(sre_constants.POSSESSIVE_REPEAT)
+
+
+def parse(pattern, flags=0):
+    return sre_parse.parse(pattern, flags)
+
+
+def required_literal(pattern, flags=0):
+    '''
+    Return the longest literal which is part of every match of pattern.
+
+    Returns an empty string (or empty bytes) if there is none, for example
+    if the pattern is case insensitive or starts with an alternation.
+    '''
+    empty = pattern[:0]
+    parsed = parse(pattern, flags)
+    if parsed.state.flags & (re.IGNORECASE | re.LOCALE):
+        return empty
+    runs = [[]]
+    _collect_literal_runs(parsed, runs)
+    longest = max(runs, key=len)
+    if isinstance(pattern, bytes):
+        return bytes(longest)
+    return ''.join(chr(char) for char in longest)
+
+
+def _collect_literal_runs(items, runs):
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            runs[-1].append(av)
+        elif op == sre_constants.SUBPATTERN and not av[1] and not av[2]:
+            # A group without inline flags: the content is part of the sequence.
+            _collect_literal_runs(av[3], runs)
+        elif op == sre_constants.AT:
+            # Anchors don't consume characters.
+            continue
+        else:
+            runs.append([])
+
+
+def min_width(pattern, flags=0):
+    '''
+    Return the length of the shortest possible match of pattern.
+    '''
+    return parse(pattern, flags).getwidth()[0]
+
+
+def line_local(pattern, flags=0):
+    '''
+    True if searching lines one by one finds the same matches as searching
+    the whole buffer with re.MULTILINE added to the flags.
+
+    This is the case if no match can contain a newline and there are no
+    assertions which look beyond the current line (\\A, \\Z, lookahead and
+    lookbehind).
+    '''
+    parsed = parse(pattern, flags)
+    return not _needs_context(parsed) and not _can_match_newline(parsed, parsed.state.flags)
+
+
+def can_match_newline(pattern, flags=0):
+    '''
+    True if a match of pattern can contain a newline.
+    '''
+    parsed = parse(pattern, flags)
+    return _can_match_newline(parsed, parsed.state.flags)
+
+
+def single_line_anchors(pattern, flags=0):
+    '''
+    Return the set of the anchors of pattern which are not affected by
+    re.MULTILINE: '^', '$' (outside of re.MULTILINE) and '\\Z'.
+    '''
+    parsed = parse(pattern, flags)
+    anchors = set()
+    _collect_anchors(parsed, parsed.state.flags, anchors)
+    return anchors
+
+
+def categories(pattern, flags=0):
+    '''
+    Return the set of the categories (\\s, \\d, \\w ...) used by pattern, as
+    constants of the parser of the re module.
+    '''
+    found = set()
+    _collect_categories(parse(pattern, flags), found)
+    return found
+
+
+def has_backreference(pattern, flags=0):
+    '''
+    True if the pattern refers to one of its groups (\\1, (?P=name), (?(1)...)).
+    Such a pattern can't be part of a combined pattern, the group numbers
+    would change.
+    '''
+    return _has_backreference(parse(pattern, flags))
+
+
+def _has_backreference(items):
+    for op, av in items:
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            return True
+        subpatterns = _subpatterns(op, av)
+        if subpatterns is None:
+            return True
+        if any(_has_backreference(sub) for sub in subpatterns):
+            return True
+    return False
+
+
+def _needs_context(items):
+    for op, av in items:
+        if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            return True
+        if op == sre_constants.AT and av in (sre_constants.AT_BEGINNING_STRING,
+                                             sre_constants.AT_END_STRING):
+            return True
+        subpatterns = _subpatterns(op, av)
+        if subpatterns is None:
+            # Unknown opcode: be conservative.
+            return True
+        if any(_needs_context(sub) for sub in subpatterns):
+            return True
+    return False
+
+
+def _collect_anchors(items, flags, anchors):
+    for op, av in items:
+        if op == sre_constants.AT:
+            if av == sre_constants.AT_BEGINNING and not flags & re.MULTILINE:
+                anchors.add('^')
+            elif av == sre_constants.AT_END and not flags & re.MULTILINE:
+                anchors.add('$')
+            elif av == sre_constants.AT_END_STRING:
+                anchors.add('\\Z')
+        elif op == sre_constants.SUBPATTERN:
+            group, add_flags, del_flags, sub = av
+            _collect_anchors(sub, (flags | add_flags) & ~del_flags, anchors)
+        else:
+            subpatterns = _subpatterns(op, av)
+            if subpatterns is None:
+                # Unknown opcode: be conservative.
+                anchors.update(['^', '$', '\\Z'])
+                continue
+            for sub in subpatterns:
+                _collect_anchors(sub, flags, anchors)
+
+
+def _collect_categories(items, found):
+    for op, av in items:
+        if op == sre_constants.IN:
+            found.update(member_av for member_op, member_av in av if member_op == sre_constants.CATEGORY)
+        elif op == sre_constants.CATEGORY:
+            found.add(av)
+        else:
+            for sub in _subpatterns(op, av) or []:
+                _collect_categories(sub, found)
+
+
+def _can_match_newline(items, flags):
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            if av == NEWLINE:
+                return True
+        elif op == sre_constants.NOT_LITERAL:
+            if av != NEWLINE:
+                return True
+        elif op == sre_constants.ANY:
+            if flags & re.DOTALL:
+                return True
+        elif op == sre_constants.IN:
+            if _set_contains_newline(av):
+                return True
+        elif op == sre_constants.SUBPATTERN:
+            group, add_flags, del_flags, sub = av
+            if _can_match_newline(sub, (flags | add_flags) & ~del_flags):
+                return True
+        elif op in (sre_constants.AT, sre_constants.GROUPREF,
+                    sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            # Zero width, or a reference to a group which gets checked itself.
+            continue
+        else:
+            subpatterns = _subpatterns(op, av)
+            if subpatterns is None:
+                # Unknown opcode: be conservative.
+                return True
+            if any(_can_match_newline(sub, flags) for sub in subpatterns):
+                return True
+    return False
+
+
+def _set_contains_newline(items):
+    negate = False
+    contains = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            contains = contains or av == NEWLINE
+        elif op == sre_constants.RANGE or op.name.startswith('RANGE'):
+            contains = contains or av[0] <= NEWLINE <= av[1]
+        elif op == sre_constants.CATEGORY:
+            contains = contains or av not in _CATEGORIES_WITHOUT_NEWLINE
+        else:
+            # Unknown set member: be conservative.
+            return True
+    return contains != negate
+
+
+def _subpatterns(op, av):
+    '''
+    Return the nested subpatterns of one parsed item. Returns an empty list
+    for items without nested patterns and None for unknown opcodes.
+    '''
+    if op == sre_constants.SUBPATTERN:
+        return [av[3]]
+    if op in _REPEATS:
+        return [av[2]]
+    if op == sre_constants.BRANCH:
+        return av[1]
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    if op == sre_constants.GROUPREF_EXISTS:
+        return [sub for sub in av[1:] if sub is not None]
+    if hasattr(sre_constants, 'ATOMIC_GROUP') and op == sre_constants.ATOMIC_GROUP:
+        return [av]
+    if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY,
+              sre_constants.IN, sre_constants.AT, sre_constants.GROUPREF):
+        return []
+    return None
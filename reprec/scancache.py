@@ -0,0 +1,99 @@
+'''
+On-disk cache of files which had no match (--cache).
+
+A file gets skipped if it was checked with the same patterns and flags
+(the fingerprint) and its stat() signature (size, mtime, inode) did not
+change since then. The cache is a sqlite database, the least recently
+used entries get removed if it holds more than max_entries files.
+'''
+
+import os
+import time
+
+DEFAULT_MAX_ENTRIES = 200000
+
+# Files modified less than this before the run started don't get recorded:
+# a second change within the resolution of the mtime would not be noticed.
+RACY_NS = 2 * 10 ** 9
+
+
+def stat_signature(file_name):
+    '''
+    Return (size, mtime_ns, inode) of the file, or None if it can't be read.
+    '''
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+class ScanCache:
+    def __init__(self, file_name, fingerprint, max_entries=DEFAULT_MAX_ENTRIES):
+        self.file_name = file_name
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.start_ns = time.time_ns()
+        self.now = int(time.time())
+        # Imported here: most runs don't need it.
+        import sqlite3
+        self.connection = sqlite3.connect(file_name, timeout=60)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS files (
+            fingerprint TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            last_used INTEGER NOT NULL,
+            PRIMARY KEY (fingerprint, path))''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)')
+        # path --> (size, mtime_ns, inode) of the files without a match.
+        self.signatures = {
+            path: (size, mtime_ns, inode) for path, size, mtime_ns, inode in self.connection.execute(
+                'SELECT path, size, mtime_ns, inode FROM files WHERE fingerprint = ?', (fingerprint,))}
+        self.used = []
+        self.added = []
+
+    @classmethod
+    def key(cls, file_name):
+        return os.fsdecode(os.path.abspath(file_name))
+
+    def lookup(self, file_name, signature):
+        '''
+        Return True if the file had no match the last time and its signature
+        (see stat_signature()) is the same.
+        '''
+        if signature is None:
+            return False
+        path = self.key(file_name)
+        if self.signatures.get(path) == signature:
+            self.used.append(path)
+            return True
+        return False
+
+    def add(self, file_name, signature):
+        '''
+        Record that the file with the signature (see stat_signature()) had no match.
+        '''
+        if signature is None or signature[1] > self.start_ns - RACY_NS:
+            return
+        path = self.key(file_name)
+        self.signatures[path] = signature
+        self.added.append((self.fingerprint, path) + signature + (self.now,))
+
+    def flush(self):
+        with self.connection:
+            self.connection.executemany('REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', self.added)
+            self.connection.executemany('UPDATE files SET last_used = ? WHERE fingerprint = ? AND path = ?',
+                                        [(self.now, self.fingerprint, path) for path in self.used])
+            count, = self.connection.execute('SELECT COUNT(*) FROM files').fetchone()
+            if count > self.max_entries:
+                self.connection.execute(
+                    'DELETE FROM files WHERE rowid IN (SELECT rowid FROM files ORDER BY last_used LIMIT ?)',
+                    (count - self.max_entries,))
+        self.added = []
+        self.used = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,29 @@
+import random
+import re
+import unittest
+
+from reprec.ahocorasick import AhoCorasick
+
+
+class AhoCorasickTestCase(unittest.TestCase):
+
+    def test_leftmost_longest(self):
+        automaton = AhoCorasick([b'ab', b'abcde', b'cd', b'bcd'])
+        self.assertEqual([(0, 5)], [match.span() for match in automaton.finditer(b'abcde')])
+        self.assertEqual([(0, 2), (2, 4)], [match.span() for match in automaton.finditer(b'abcdx')])
+        self.assertEqual([(1, 4)], [match.span() for match in automaton.finditer(b'xbcdx')])
+        self.assertIsNone(automaton.search(b'xxx'))
+
+    def test_same_result_as_alternation(self):
+        rand = random.Random(42)
+        for i in range(50):
+            patterns = set(bytes(rand.choice(b'abc') for j in range(rand.randint(1, 5)))
+                           for k in range(rand.randint(1, 20)))
+            data = bytes(rand.choice(b'abcd') for j in range(200))
+            regex = re.compile(b'|'.join(re.escape(pattern) for pattern in sorted(patterns, key=len, reverse=True)))
+            automaton = AhoCorasick(patterns)
+            self.assertEqual(regex.subn(lambda match: b'<%s>' % match.group(), data),
+                             automaton.subn(lambda match: b'<%s>' % match.group(), data), patterns)
+
+    def test_empty_pattern(self):
+        self.assertRaises(ValueError, AhoCorasick, [b'a', b''])
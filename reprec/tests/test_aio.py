@@ -0,0 +1,87 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from reprec.aio import aiter_replace, areplace_recursive
+
+
+class AioTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='reprec_unittest_aio')
+        for i in range(20):
+            with open(os.path.join(self.tempdir, '%02i' % i), 'wb') as fd:
+                fd.write(b'foo\nbar\n' * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def contents(self):
+        contents = {}
+        for name in sorted(os.listdir(self.tempdir)):
+            with open(os.path.join(self.tempdir, name), 'rb') as fd:
+                contents[name] = fd.read()
+        return contents
+
+    def test_areplace_recursive(self):
+        results = []
+        for kwargs in [{}, {'jobs': 3, 'no_regex': True}]:
+            counter = asyncio.run(areplace_recursive([self.tempdir], b'foo', b'xyz', progress=results.append,
+                                                     **kwargs))
+            self.assertEqual({'dirs': 1, 'files': 20, 'lines': 2000, 'files-checked': 20}, counter)
+            self.assertEqual(20, len(results))
+            self.assertEqual({b'xyz\nbar\n' * 100}, set(self.contents().values()))
+            asyncio.run(areplace_recursive([self.tempdir], b'xyz', b'foo', **kwargs))
+            del results[:]
+
+    def test_timeout(self):
+        self.assertRaises(ValueError, asyncio.run, areplace_recursive([self.tempdir], b'foo', b'xyz', timeout=1))
+        self.assertEqual({b'foo\nbar\n' * 100}, set(self.contents().values()))
+
+    def test_stop(self):
+        async def first_two():
+            results = []
+            async for result in aiter_replace([self.tempdir], b'foo', b'xyz', queue_size=1):
+                results.append(result)
+                if len(results) == 2:
+                    break
+            return results
+
+        results = asyncio.run(first_two())
+        contents = self.contents()
+        # No temp files, each file is old or new.
+        self.assertEqual(20, len(contents))
+        self.assertEqual({b'foo\nbar\n' * 100, b'xyz\nbar\n' * 100}, set(contents.values()))
+        changed = [name for name, content in contents.items() if content.startswith(b'xyz')]
+        # The run stops after the file it is processing when the iteration stops.
+        self.assertLess(len(changed), 20)
+        for result in results:
+            self.assertIn(os.path.basename(result.file_name), changed)
+
+    def test_cancel(self):
+        async def cancel():
+            started = asyncio.Event()
+
+            async def consume():
+                async for result in aiter_replace([self.tempdir], b'foo', b'xyz', queue_size=1):
+                    started.set()
+                    await asyncio.sleep(10)
+
+            task = asyncio.ensure_future(consume())
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel())
+        contents = self.contents()
+        self.assertEqual(20, len(contents))
+        self.assertLess(len([content for content in contents.values() if content.startswith(b'xyz')]), 20)
+
+    def test_error(self):
+        async def run():
+            return await areplace_recursive([self.tempdir], b'foo', b'xyz', ask=True, jobs=2)
+
+        self.assertRaises(Exception, asyncio.run, run())
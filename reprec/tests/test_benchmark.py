@@ -0,0 +1,63 @@
+import filecmp
+import os
+import shutil
+import tempfile
+import unittest
+
+from reprec.benchmark import BENCHMARKS, compare, run_benchmarks
+from reprec.benchmark.treegen import TreeSpec, generate, generate_lines
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='reprec_unittest_benchmark')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_generate_is_deterministic(self):
+        spec = TreeSpec(files=40, dirs=5, symlinks=4, nesting=6, binary_ratio=0.2, match_density=0.05)
+        a = os.path.join(self.tempdir, 'a')
+        b = os.path.join(self.tempdir, 'b')
+        counter = generate(a, spec)
+        self.assertEqual(counter, generate(b, spec))
+        self.assertEqual(40, counter['files'])
+        self.assertEqual(4, counter['symlinks'])
+        self.assertEqual(11, counter['dirs'])
+        self.assertTrue(counter['binary-files'])
+        self.assertTrue(counter['matching-lines'])
+        self.assertTrue(os.path.isdir(os.path.join(a, *['n%i' % i for i in range(6)])))
+        comparison = filecmp.dircmp(a, b)
+        self.assertEqual([], comparison.diff_files + comparison.left_only + comparison.right_only)
+        c = os.path.join(self.tempdir, 'c')
+        spec.seed = 1
+        self.assertNotEqual(counter, generate(c, spec))
+
+    def test_generate_lines(self):
+        a = os.path.join(self.tempdir, 'a')
+        b = os.path.join(self.tempdir, 'b')
+        generate_lines(a, 1000)
+        generate_lines(b, 1000, seed=1)
+        with open(a) as fd:
+            lines_a = set(fd.read().splitlines())
+        with open(b) as fd:
+            lines_b = set(fd.read().splitlines())
+        self.assertEqual(1000, len(lines_a))
+        self.assertTrue(300 < len(lines_a & lines_b) < 700, len(lines_a & lines_b))
+
+    def test_run_benchmarks(self):
+        result = run_benchmarks(BENCHMARKS, TreeSpec(files=20, dirs=3, nesting=3, match_density=0.1),
+                                repeat=1, setops_lines=100)
+        self.assertEqual(BENCHMARKS, list(result['results']))
+        self.assertEqual(20, result['spec']['files'])
+        replaced = result['results']['replace-regex']['counter']
+        self.assertTrue(replaced['lines'])
+        self.assertEqual(replaced['lines'], result['results']['replace-no-regex']['counter']['lines'])
+        setops_lines = {name: result['results'][name]['counter']['lines'] for name in BENCHMARKS
+                        if name.startswith('setops-')}
+        self.assertEqual(setops_lines['setops-union'],
+                         setops_lines['setops-intersection'] + setops_lines['setops-symmetric_difference'])
+        lines = compare(result, result)
+        self.assertEqual(len(BENCHMARKS) + 1, len(lines))
+        self.assertIn('+0.0%', lines[1])
@@ -0,0 +1,129 @@
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from reprec import daemon
+from reprec.client import client
+
+
+def inotify_available():
+    try:
+        daemon.Inotify().close()
+    except (ValueError, OSError):
+        return False
+    return True
+
+
+@unittest.skipUnless(inotify_available(), 'inotify is not available')
+class DaemonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='reprec_unittest_daemon')
+        self.tree_dir = os.path.join(self.tempdir, 'tree')
+        os.makedirs(os.path.join(self.tree_dir, 'sub'))
+        for name in ['a', 'sub/b']:
+            with open(os.path.join(self.tree_dir, name), 'wb') as fd:
+                fd.write(b'foo\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def names(self, tree, dirname):
+        return sorted(entry.name for entry in tree.scandir(dirname))
+
+    def test_directory_tree(self):
+        tree = daemon.DirectoryTree(daemon.Inotify())
+        try:
+            self.assertEqual(['a', 'sub'], self.names(tree, self.tree_dir))
+            self.assertEqual(['b'], self.names(tree, os.path.join(self.tree_dir, 'sub')))
+            self.assertEqual((0, 2), (tree.hits, tree.misses))
+            self.assertEqual(['a', 'sub'], self.names(tree, self.tree_dir))
+            self.assertEqual(1, tree.hits)
+            entries = {entry.name: entry for entry in tree.scandir(self.tree_dir)}
+            self.assertTrue(entries['sub'].is_dir())
+            self.assertTrue(entries['a'].is_file())
+            self.assertEqual(os.path.join(self.tree_dir, 'a'), entries['a'].path)
+
+            # Changed content does not change the listing.
+            with open(os.path.join(self.tree_dir, 'a'), 'ab') as fd:
+                fd.write(b'bar\n')
+            tree.update()
+            self.assertIn(os.path.abspath(self.tree_dir), tree.listings)
+
+            with open(os.path.join(self.tree_dir, 'c'), 'wb') as fd:
+                fd.write(b'foo\n')
+            tree.update()
+            self.assertEqual(['a', 'c', 'sub'], self.names(tree, self.tree_dir))
+
+            # The listings of a moved directory get dropped, and the ones below.
+            os.rename(os.path.join(self.tree_dir, 'sub'), os.path.join(self.tree_dir, 'moved'))
+            os.mkdir(os.path.join(self.tree_dir, 'sub'))
+            tree.update()
+            self.assertEqual([], self.names(tree, os.path.join(self.tree_dir, 'sub')))
+            self.assertEqual(['b'], self.names(tree, os.path.join(self.tree_dir, 'moved')))
+        finally:
+            tree.close()
+
+    def test_client_went_away(self):
+        class Disconnected:
+            def write(self, data):
+                raise BrokenPipeError()
+
+        output = daemon._ClientOutput(Disconnected())
+        server = daemon.Server(os.path.join(self.tempdir, 'reprec.sock'))
+        try:
+            # -v: the first output comes before the files are done.
+            exit_code = server.run(['-v', 'foo', 'bar', self.tree_dir], os.getcwd(), output)
+        finally:
+            server.close()
+        self.assertEqual((0, True), (exit_code, output.disconnected))
+        for name in ['a', 'sub/b']:
+            self.assertEqual(b'bar\n', open(os.path.join(self.tree_dir, name), 'rb').read())
+
+    def test_check_private_dir(self):
+        directory = os.path.join(self.tempdir, 'private')
+        os.mkdir(directory, 0o700)
+        os.chmod(directory, 0o700)
+        daemon.Server.check_private_dir(directory)
+        os.chmod(directory, 0o755)
+        self.assertRaises(ValueError, daemon.Server.check_private_dir, directory)
+        link = os.path.join(self.tempdir, 'link')
+        os.symlink(self.tempdir, link)
+        self.assertRaises(ValueError, daemon.Server.check_private_dir, link)
+
+    def test_client(self):
+        socket_path = os.path.join(self.tempdir, 'reprec.sock')
+        self.assertIsNone(client(['foo', 'bar', self.tree_dir], socket_path))
+        server = subprocess.Popen([sys.executable, '-c', 'import reprec; reprec.main()', 'serve',
+                                   '--socket', socket_path, self.tree_dir],
+                                  stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(daemon.__file__)))
+        try:
+            self.assertIn(b'Listening on', server.stdout.readline())
+
+            def run(*argv):
+                stdout = io.StringIO()
+                with contextlib.redirect_stdout(stdout):
+                    exit_code = client(list(argv), socket_path)
+                return exit_code, stdout.getvalue()
+
+            exit_code, output = run('foo', 'bar', self.tree_dir)
+            self.assertEqual((0, 'Replaced 2 directories 2 files 2 lines. 2 files checked\n'), (exit_code, output))
+            self.assertEqual(b'bar\n', open(os.path.join(self.tree_dir, 'sub', 'b'), 'rb').read())
+            os.mkdir(os.path.join(self.tree_dir, 'new'))
+            with open(os.path.join(self.tree_dir, 'new', 'c'), 'wb') as fd:
+                fd.write(b'bar\n')
+            exit_code, output = run('bar', 'xyz', self.tree_dir)
+            self.assertEqual((0, 'Replaced 3 directories 3 files 3 lines. 3 files checked\n'), (exit_code, output))
+            self.assertEqual(2, run('bar', 'xyz', os.path.join(self.tempdir, 'nonexistent'))[0])
+            # Commands which read stdin run in the client.
+            self.assertEqual((None, ''), run('--files-from', '-', 'bar', 'xyz'))
+        finally:
+            server.terminate()
+            server.wait()
+            server.stdout.close()
+        self.assertFalse(os.path.exists(socket_path))
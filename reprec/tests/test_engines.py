@@ -0,0 +1,71 @@
+import re
+import subprocess
+import sys
+import unittest
+
+from reprec import ReplaceRecursive
+from reprec.engines import compile_regex, re2_available
+
+
+class EnginesTestCase(unittest.TestCase):
+
+    def test_re(self):
+        regex = compile_regex(b'fo+', re.IGNORECASE)
+        self.assertEqual(b'x x', regex.sub(b'x', b'FOO foo'))
+
+    def test_auto(self):
+        # Backreferences need the re module.
+        regex = compile_regex(b'(o)\\1', 0, 'auto')
+        self.assertEqual(b'fx', regex.sub(b'x', b'foo'))
+        self.assertEqual(b'fx', compile_regex(b'o+', re.DOTALL, 'auto').sub(b'x', b'foo'))
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, compile_regex, b'foo', 0, 'pcre')
+        self.assertRaises(ValueError, ReplaceRecursive, b'foo', b'bar', engine='pcre')
+
+    def test_literal(self):
+        reprec = ReplaceRecursive(b'a.c', b'x', engine='literal')
+        self.assertEqual(b'abc x\n', reprec.replace_lines(b'abc a.c\n', 'dummy'))
+
+    @unittest.skipIf(re2_available(), 'google-re2 is installed')
+    def test_re2_missing(self):
+        self.assertRaises(ValueError, compile_regex, b'foo', 0, 're2')
+
+    @unittest.skipUnless(re2_available(), 'google-re2 is not installed')
+    def test_re2(self):
+        regex = compile_regex(b'(a+)+$', re.MULTILINE, 're2')
+        self.assertEqual(b'x\nb', regex.sub(b'x', b'aaaa\nb'))
+        self.assertEqual(b'fOO', compile_regex(b'o', re.IGNORECASE, 're2').sub(b'O', b'fOo'))
+        self.assertRaises(re.error, compile_regex, b'(o)\\1', 0, 're2')
+        reprec = ReplaceRecursive(b'(a+)+$', b'x', engine='re2')
+        self.assertEqual(b'x\nab\n', reprec.replace_lines(b'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\nab\n', 'dummy'))
+
+    @unittest.skipUnless(re2_available(), 'google-re2 is not installed')
+    def test_re2_same_matches_as_re(self):
+        # One byte is one character, like for re: \xc3\xbc is not one ü.
+        content = b'foo\nfoo bar\nbar foo\na\xc3\xbcb a\xfcb \xc9\xe9\n'
+        for pattern, ignorecase in [(b'foo$', False), (b'^foo$', False), (b'(?:foo|bar)$', False), (b'o\n?$', False),
+                                    (b'a.b', False), (b'a[^a]b', False), (b'\xe9', True), (b'\\w+', False)]:
+            expected = ReplaceRecursive(pattern, b'x', ignorecase=ignorecase).replace_lines(content, 'dummy')
+            for engine in ['re2', 'auto']:
+                reprec = ReplaceRecursive(pattern, b'x', ignorecase=ignorecase, engine=engine)
+                self.assertEqual(expected, reprec.replace_lines(content, 'dummy'), (pattern, engine))
+        # \s of re2 does not match \v.
+        self.assertRaises(re.error, compile_regex, b'a\\sb', 0, 're2', True)
+        # Outside of lines, $ of re2 does not match before the newline at the end.
+        self.assertRaises(re.error, compile_regex, b'foo$', re.DOTALL, 're2')
+        self.assertRaises(re.error, compile_regex, b'foo\\Z', 0, 're2', True)
+        # Empty matches get replaced differently.
+        self.assertRaises(re.error, compile_regex, b'(?m)$', 0, 're2', True)
+        self.assertRaises(re.error, compile_regex, b'a*', re.DOTALL, 're2')
+        for pattern, flags in [(b'foo$', re.DOTALL), (b'a*', re.DOTALL), (b'foo\\Z', 0)]:
+            regex = compile_regex(pattern, flags, 'auto')
+            self.assertIsInstance(regex, re.Pattern)
+        self.assertNotIsInstance(compile_regex(b'foo$', 0, 'auto', True), re.Pattern)
+
+    @unittest.skipUnless(re2_available(), 'google-re2 is not installed')
+    def test_re2_errors_not_logged(self):
+        # The fallback of auto to re does not print the error of re2.
+        process = subprocess.run([sys.executable, '-c', 'from reprec.engines import compile_regex; '
+                                  'compile_regex(b"(o)\\\\1", 0, "auto")'], stderr=subprocess.PIPE)
+        self.assertEqual((0, b''), (process.returncode, process.stderr))
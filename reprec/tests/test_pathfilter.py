@@ -0,0 +1,48 @@
+import re
+import unittest
+
+from reprec.pathfilter import GitIgnore, PathFilter, glob_to_regex
+
+
+class PathFilterTestCase(unittest.TestCase):
+
+    def assertGlob(self, glob, matching, not_matching):
+        regex = re.compile(glob_to_regex(glob))
+        for path in matching:
+            self.assertTrue(regex.match(path), (glob, path))
+        for path in not_matching:
+            self.assertFalse(regex.match(path), (glob, path))
+
+    def test_glob_to_regex(self):
+        self.assertGlob('*.py', ['a.py', '.py'], ['a.pyc', 'a/b.py'])
+        self.assertGlob('a?c', ['abc'], ['ac', 'a/c'])
+        self.assertGlob('[!a-c]x', ['dx'], ['ax', 'cx'])
+        self.assertGlob('**/x', ['x', 'a/x', 'a/b/x'], ['ax'])
+        self.assertGlob('a/**', ['a/b', 'a/b/c'], ['a', 'ab'])
+        self.assertGlob('a/**/b', ['a/b', 'a/x/y/b'], ['a/xb'])
+        self.assertGlob('a.b', ['a.b'], ['axb'])
+
+    def test_path_filter(self):
+        path_filter = PathFilter(exclude_dirs=['.git'], excludes=['*.min.js', 'docs/build'],
+                                 includes=['*.js', '*.py'], file_endings=['.pyc'],
+                                 filename_regex='.*/src/')
+        self.assertTrue(path_filter.skip_dir('.git', '.git'))
+        self.assertTrue(path_filter.skip_dir('docs/build', 'build'))
+        self.assertFalse(path_filter.skip_dir('build', 'build'))
+        self.assertEqual('ending', path_filter.skip_file('x/src/a.pyc', 'a.pyc', 'a.pyc'))
+        self.assertEqual('excluded', path_filter.skip_file('x/src/a.min.js', 'a.min.js', 'a.min.js'))
+        self.assertEqual('not-included', path_filter.skip_file('x/src/a.txt', 'a.txt', 'a.txt'))
+        self.assertEqual('filename', path_filter.skip_file('x/a.py', 'a.py', 'a.py'))
+        self.assertEqual(None, path_filter.skip_file('x/src/a.py', 'a.py', 'a.py'))
+
+    def test_gitignore(self):
+        gitignore = GitIgnore(['# comment', '*.log', '!important.log', '/tmp/', 'docs/*.html', ''])
+        self.assertEqual(True, gitignore.match('a.log', False))
+        self.assertEqual(True, gitignore.match('x/y/a.log', False))
+        self.assertEqual(False, gitignore.match('x/important.log', False))
+        self.assertEqual(True, gitignore.match('tmp', True))
+        self.assertEqual(None, gitignore.match('tmp', False))
+        self.assertEqual(None, gitignore.match('x/tmp', True))
+        self.assertEqual(True, gitignore.match('docs/a.html', False))
+        self.assertEqual(None, gitignore.match('x/docs/a.html', False))
+        self.assertEqual(None, gitignore.match('comment', False))
@@ -0,0 +1,31 @@
+import re
+import unittest
+
+from reprec.regex_analysis import line_local, required_literal, single_line_anchors
+
+
+class RegexAnalysisTestCase(unittest.TestCase):
+
+    def test_required_literal(self):
+        self.assertEqual(b'foo', required_literal(rb'foo'))
+        self.assertEqual(b'_bar_', required_literal(rb'\d+_bar_\w'))
+        self.assertEqual(b'abcd', required_literal(rb'^x?ab(cd)[0-9]$'))
+        self.assertEqual('a.b', required_literal(r'a\.b'))
+        self.assertEqual(b'', required_literal(rb'foo|bar'))
+        self.assertEqual(b'', required_literal(rb'foo', re.IGNORECASE))
+        self.assertEqual(b'', required_literal(rb'(?i)foo'))
+
+    def test_single_line_anchors(self):
+        self.assertEqual({'^', '$'}, single_line_anchors(rb'^foo$'))
+        self.assertEqual(set(), single_line_anchors(rb'(?m)^foo$'))
+        self.assertEqual(set(), single_line_anchors(rb'^foo$', re.MULTILINE))
+        self.assertEqual({'\\Z'}, single_line_anchors(rb'x(?m:$)|y\Z'))
+        self.assertEqual({'$'}, single_line_anchors(rb'(?:a|b$)+'))
+
+    def test_line_local(self):
+        for pattern in [rb'foo', rb'^foo$', rb'[cd]+', rb'\bfoo\w*', rb'[^\n]+', rb'a.b', rb'(x)\1']:
+            self.assertTrue(line_local(pattern), pattern)
+        for pattern in [rb'foo\n', rb'\s', rb'[^x]', rb'\Afoo', rb'foo\Z', rb'foo(?=bar)',
+                        rb'(?<!x)foo', rb'(?s)a.b', rb'\W']:
+            self.assertFalse(line_local(pattern), pattern)
+        self.assertFalse(line_local(rb'a.b', re.DOTALL))
@@ -1,12 +1,23 @@
+import bz2
 import codecs
+import contextlib
+import gzip
 import io
+import itertools
+import lzma
 import os
+import re
 import shutil
+import sqlite3
 import tempfile
+import threading
 import unittest
 import subprocess
 
-from reprec import ReplaceRecursive, diffdir, replace_recursive, unicode_error_hint
+from reprec import (LiteralMatcher, ReplaceRecursive, combine_regexes, diffdir, iter_replace, main, prefetch,
+                    read_file_names, replace_recursive, stats_summary, unicode_error_hint, update_index)
+from reprec.ahocorasick import AhoCorasick
+from reprec.journal import Journal, JournalMismatch
 
 
 class MyTestCase(unittest.TestCase):
@@ -53,6 +64,596 @@ class MyTestCase(unittest.TestCase):
         shutil.rmtree(tempdir)
         shutil.rmtree(shoulddir)
 
+    def test_walk_tree(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_walk')
+        for dir_name in ['sub/deep', 'sub2', '.git']:
+            os.makedirs(os.path.join(tempdir, dir_name))
+        for file_name, data in [('a', 'foo\n'), ('sub/b', 'foo\n'), ('sub/deep/c', 'bar\n'),
+                                ('sub2/e', 'bar\n'), ('.git/d', 'foo\n')]:
+            with open(os.path.join(tempdir, file_name), 'wt') as fd:
+                fd.write(data)
+        os.symlink(os.path.join(tempdir, 'sub'), os.path.join(tempdir, 'link'))
+        stats = {}
+        counter = replace_recursive([tempdir], b'foo', b'xyz', stats=stats)
+        self.assertEqual({'dirs': 2, 'files': 2, 'lines': 2, 'files-checked': 4}, counter)
+        self.assertEqual('foo\n', open(os.path.join(tempdir, '.git', 'd')).read())
+        self.assertEqual('xyz\n', open(os.path.join(tempdir, 'sub', 'b')).read())
+        self.assertGreater(stats['stat-calls-saved'], 0)
+        shutil.rmtree(tempdir)
+
+    def test_jobs(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_jobs')
+        for i in range(20):
+            dir_name = os.path.join(tempdir, str(i % 3))
+            if not os.path.exists(dir_name):
+                os.mkdir(dir_name)
+            with open(os.path.join(dir_name, str(i)), 'wt') as fd:
+                fd.write('foo\nbar\nfoo\n' if i % 2 else 'bar\n')
+        for no_regex in [False, True]:
+            counter = replace_recursive([tempdir], b'foo', b'xyz', no_regex=no_regex, jobs=3)
+            self.assertEqual({'dirs': 4, 'files': 10, 'lines': 20, 'files-checked': 20}, counter)
+            counter = replace_recursive([tempdir], b'xyz', b'foo', no_regex=no_regex, jobs=3)
+            self.assertEqual({'dirs': 4, 'files': 10, 'lines': 20, 'files-checked': 20}, counter)
+        self.assertEqual('foo\nbar\nfoo\n', open(os.path.join(tempdir, '1', '1')).read())
+        self.assertRaises(Exception, replace_recursive, [tempdir], b'foo', b'xyz', ask=True, jobs=2)
+        shutil.rmtree(tempdir)
+
+    def test_prefilter(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_prefilter')
+        for file_name, data in [('a', 'foo\nbar\n'), ('b', 'bar\nfoo\n'), ('c', 'bar\n')]:
+            with open(os.path.join(tempdir, file_name), 'wt') as fd:
+                fd.write(data)
+        for pattern, skipped in [(b'^foo$', 1), (b'^fo(?=o)', 1), (b'(?<!\n)foo', 1), (b'(?i)FOO', 1), (b'(?=f)(fo|xfo)', 0)]:
+            stats = {}
+            counter = replace_recursive([tempdir], pattern, b'\\g<0>', stats=stats)
+            self.assertEqual({'dirs': 0, 'files': 0, 'lines': 0, 'files-checked': 3}, counter)
+            self.assertEqual(skipped, stats['prefilter-skipped'], pattern)
+        counter = replace_recursive([tempdir], b'^foo$', b'xyz')
+        self.assertEqual({'dirs': 1, 'files': 2, 'lines': 2, 'files-checked': 3}, counter)
+        self.assertEqual('bar\nxyz\n', open(os.path.join(tempdir, 'b')).read())
+        shutil.rmtree(tempdir)
+
+    def test_replace_lines__whole_buffer(self):
+        contents = [b'', b'\n', b'foo', b'foo\n', b'a foo\n\nbar foo\nfoo', b'x\nfoofoo\n\n', b'\nab\r\nfo\no\n']
+        for pattern, text, no_regex in [(b'foo', b'bar', False), (b'o+', b'\\g<0>-', False), (b'^', b'>', False),
+                                        (b'$', b'<', False), (b'x*', b'-', False), (b'\\bf', b'F', False),
+                                        (b'(o)(o)', b'\\2\\1', False), (b'o', b'o', False),
+                                        (b'foo', b'bar', True), (b'o\no', b'_', True), (b'', b'_', True)]:
+            reprec = ReplaceRecursive(pattern, text, no_regex=no_regex)
+            self.assertTrue(reprec.search_whole_buffer, pattern)
+            for content in contents:
+                reprec.counter['lines'] = 0
+                expected = reprec.replace_lines__line_by_line(content, 'dummy')
+                lines = reprec.counter['lines']
+                reprec.counter['lines'] = 0
+                result = reprec.replace_lines__whole_buffer(content, 'dummy')
+                if result is None:
+                    result = content
+                self.assertEqual((expected, lines), (result, reprec.counter['lines']), (pattern, content))
+
+    def test_stream(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_stream')
+        data = ''.join('line %s %s\n' % (i, 'foo' * (i % 7)) for i in range(1000)) + 'foo'
+        for file_name in ['a', 'b']:
+            with open(os.path.join(tempdir, file_name), 'wt') as fd:
+                fd.write(data)
+        with open(os.path.join(tempdir, 'c'), 'wt') as fd:
+            fd.write('bar\n' * 100)
+        inode = os.stat(os.path.join(tempdir, 'c')).st_ino
+        counter = replace_recursive([os.path.join(tempdir, 'a')], b'(fo)o', b'\\1x')
+        stats = {}
+        counter_stream = replace_recursive([os.path.join(tempdir, 'b'), os.path.join(tempdir, 'c')], b'(fo)o', b'\\1x',
+                                           stream=True, buffer_size=10, stats=stats)
+        self.assertEqual(dict(counter, **{'files-checked': 2}), counter_stream)
+        self.assertEqual(1, stats['prefilter-skipped'])
+        self.assertEqual(open(os.path.join(tempdir, 'a')).read(), open(os.path.join(tempdir, 'b')).read())
+        self.assertEqual(inode, os.stat(os.path.join(tempdir, 'c')).st_ino)
+        self.assertEqual(['a', 'b', 'c'], sorted(os.listdir(tempdir)))
+        shutil.rmtree(tempdir)
+
+    def test_dot_all_stream(self):
+        temp = tempfile.mktemp(prefix=self.id())
+        data = b''.join(b'<a>\n%s\n</a> (?<=x)\n' % (b'x' * (i % 50)) for i in range(300))
+        for pattern, text in [(b'<a>(.*?)</a>', b'[\\1]'), (b'(?<=x)\n<', b'_'), (b'^<a>', b'B'), (b'.{10}', b'')]:
+            for buffer_size in [1, 7, 100, 100000]:
+                with open(temp, 'wb') as fd:
+                    fd.write(data)
+                reprec = ReplaceRecursive(pattern, text, dotall=True, stream=True, buffer_size=buffer_size,
+                                          max_match_span=64)
+                self.assertTrue(reprec.dot_all_stream)
+                reprec.do_file(temp)
+                expected, count = re.subn(pattern, text, data, flags=re.DOTALL)
+                self.assertEqual((expected, count), (open(temp, 'rb').read(), reprec.counter['lines']))
+        for args, kwargs, limit in [((b'x*', b''), {}, 'if the pattern can match the empty string'),
+                                    ((b'x', b''), {'ignore_lines': [re.compile(b'#')]}, 'with --ignore'),
+                                    ((None, None), {'rules': [(b'a', b'b'), (b'c', b'd')]}, 'with several rules'),
+                                    ((b'x', b''), {'no_regex': True}, 'with --no-regex')]:
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                reprec = ReplaceRecursive(*args, dotall=True, stream=True, **kwargs)
+            self.assertFalse(reprec.dot_all_stream)
+            self.assertEqual('Warning: --stream --dotall reads whole files into memory %s\n' % limit,
+                             stdout.getvalue())
+        os.unlink(temp)
+
+    def test_rules(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_rules')
+        file_name = os.path.join(tempdir, 'a')
+        for no_regex, dotall, rules, result, hits in [
+            (False, False, [(b'foo', b'bar'), (b'bar', b'baz'), (b'^x', b'y')], 'baz baz\nyx\nbaz\n', [2, 2, 1]),
+            (False, True, [(b'foo', b'bar'), (b'bar\nx', b'_')], 'bar _x\nbar\n', [2, 1]),
+            (True, False, [(b'foo', b'1'), (b'foo bar', b'2'), (b'x', b'x')], '2\nxx\n1\n', [1, 1, 0]),
+        ]:
+            with open(file_name, 'wt') as fd:
+                fd.write('foo bar\nxx\nfoo\n')
+            stats = {}
+            replace_recursive([file_name], None, None, no_regex=no_regex, dotall=dotall, rules=rules, stats=stats)
+            self.assertEqual(result, open(file_name).read())
+            self.assertEqual(hits, stats['rule-hits'])
+        rules_file = os.path.join(tempdir, 'rules')
+        with open(rules_file, 'wt') as fd:
+            fd.write('# comment\n\nbar\tfoo\nfo+\t<\\g<0>>\n')
+        with open(file_name, 'wt') as fd:
+            fd.write('bar\n')
+        output = subprocess.check_output(['reprec', '--rules', rules_file, file_name])
+        self.assertEqual('<foo>\n', open(file_name).read())
+        self.assertIn(b'       1 fo+ -> <\\g<0>>', output)
+        shutil.rmtree(tempdir)
+
+    def test_many_literals(self):
+        rules = [(b'name%i' % i, b'N%i' % (i * 2)) for i in range(200)]
+        data = b''.join(b'x name%i name%i_\n' % (i, i * 3) for i in range(300))
+        results = []
+        default_threshold = LiteralMatcher.automaton_threshold
+        try:
+            for automaton_threshold in [2, 1000]:
+                LiteralMatcher.automaton_threshold = automaton_threshold
+                reprec = ReplaceRecursive(None, None, no_regex=True, rules=rules)
+                self.assertEqual(automaton_threshold == 2, isinstance(reprec.matchers[0].regex, AhoCorasick))
+                results.append((reprec.replace_lines(data, 'dummy'), reprec.counter, reprec.stats['rule-hits']))
+        finally:
+            LiteralMatcher.automaton_threshold = default_threshold
+        self.assertEqual(results[0], results[1])
+        self.assertIn(b'x N200 N600_\n', results[0][0])
+
+    def test_binary_detection(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_binary')
+        for file_name, data in [('a.png', b'\x89PNG\0foo'), ('b.png', b'foo'), ('c.txt', b'foo\n'),
+                                ('d', b'\x01\x02\x03foo')]:
+            with open(os.path.join(tempdir, file_name), 'wb') as fd:
+                fd.write(data)
+        # With binary_by_ending, b.png gets skipped like a.png, without reading it.
+        for binary_by_ending, b_png in [(True, b'foo'), (False, b'bar')]:
+            reprec = ReplaceRecursive(b'foo', b'bar', verbose=True, binary_by_ending=binary_by_ending)
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                for name in ['a.png', 'b.png', 'c.txt', 'd']:
+                    reprec.do_file(os.path.join(tempdir, name))
+            self.assertEqual(b'\x89PNG\0foo', open(os.path.join(tempdir, 'a.png'), 'rb').read())
+            self.assertEqual(b_png, open(os.path.join(tempdir, 'b.png'), 'rb').read())
+            self.assertEqual(b'bar\n', open(os.path.join(tempdir, 'c.txt'), 'rb').read())
+            self.assertEqual(b'\x01\x02\x03foo', open(os.path.join(tempdir, 'd'), 'rb').read())
+            self.assertEqual(3 if binary_by_ending else 2, reprec.stats['binary-skipped'])
+            self.assertEqual(binary_by_ending, '%s (ending .png)' % os.path.join(tempdir, 'b.png') in stdout.getvalue())
+            replace_recursive([tempdir], b'bar', b'foo')
+        counter = replace_recursive([tempdir], b'foo', b'bar', binary_detection=False)
+        self.assertEqual({'dirs': 1, 'files': 4, 'lines': 4, 'files-checked': 4}, counter)
+        shutil.rmtree(tempdir)
+
+    def test_path_filter(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_path_filter')
+        for file_name in ['a.py', 'a.min.js', 'node_modules/x/b.py', 'src/c.py', 'src/gen/d.py',
+                          'build/e.py', 'build/keep.py', 'src/.gitignore', 'src/f.log']:
+            file_name = os.path.join(tempdir, file_name)
+            if not os.path.exists(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            with open(file_name, 'wb') as fd:
+                fd.write(b'foo\n')
+        with open(os.path.join(tempdir, '.gitignore'), 'wb') as fd:
+            fd.write(b'build/*\n!keep.py\n*.log\n')
+        with open(os.path.join(tempdir, 'src', '.gitignore'), 'wb') as fd:
+            fd.write(b'# generated\n/gen/\n')
+        reprec = ReplaceRecursive(b'foo', b'bar', exclude_dirs=['node_modules'],
+                                  excludes=['*.min.js'], gitignore=True)
+        found = sorted(os.path.relpath(file_name, tempdir) for file_name, node in reprec.walk(tempdir))
+        self.assertEqual(['.gitignore', 'a.py', os.path.join('build', 'keep.py'),
+                          os.path.join('src', '.gitignore'), os.path.join('src', 'c.py')], found)
+        reprec = ReplaceRecursive(b'foo', b'bar', includes=['src/**/*.py'])
+        found = sorted(os.path.relpath(file_name, tempdir) for file_name, node in reprec.walk(tempdir))
+        self.assertEqual([os.path.join('src', 'c.py'), os.path.join('src', 'gen', 'd.py')], found)
+        shutil.rmtree(tempdir)
+
+    def test_cache(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_cache')
+        cache_file = os.path.join(tempdir, 'cache.sqlite')
+        os.mkdir(os.path.join(tempdir, 'src'))
+        for i in range(4):
+            file_name = os.path.join(tempdir, 'src', '%s.txt' % i)
+            with open(file_name, 'wb') as fd:
+                fd.write(b'foo %i\n' % i)
+            os.utime(file_name, (1000000000, 1000000000))
+        src = os.path.join(tempdir, 'src')
+        counter = replace_recursive([src], b'3', b'x', cache_file=cache_file)
+        self.assertEqual({'dirs': 1, 'files': 1, 'lines': 1, 'files-checked': 4, 'files-cached': 0}, counter)
+        counter = replace_recursive([src], b'3', b'x', cache_file=cache_file, jobs=2)
+        self.assertEqual({'dirs': 0, 'files': 0, 'lines': 0, 'files-checked': 1, 'files-cached': 3}, counter)
+        # An other pattern does not use the entries of the first one.
+        counter = replace_recursive([src], b'bar', b'x', cache_file=cache_file)
+        self.assertEqual(4, counter['files-checked'])
+        # Nor do runs with other options of the matching.
+        for kwargs in [dict(stream=True, dotall=True), dict(max_match_span=10), dict(engine='auto')]:
+            counter = replace_recursive([src], b'3', b'x', cache_file=cache_file, **kwargs)
+            self.assertEqual(4, counter['files-checked'], kwargs)
+        file_name = os.path.join(src, '0.txt')
+        with open(file_name, 'wb') as fd:
+            fd.write(b'foo 3\n')
+        os.utime(file_name, (1000000001, 1000000001))
+        counter = replace_recursive([src], b'3', b'x', cache_file=cache_file)
+        self.assertEqual({'dirs': 1, 'files': 1, 'lines': 1, 'files-checked': 2, 'files-cached': 2}, counter)
+        # Files modified just now don't get recorded.
+        counter = replace_recursive([src], b'3', b'x', cache_file=cache_file)
+        self.assertEqual(2, counter['files-checked'])
+        counter = replace_recursive([src], b'1', b'y', cache_file=cache_file, cache_size=2)
+        connection = sqlite3.connect(cache_file)
+        self.assertEqual((2,), connection.execute('SELECT COUNT(*) FROM files').fetchone())
+        connection.close()
+        shutil.rmtree(tempdir)
+
+    def test_index(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_index')
+        src = os.path.join(tempdir, 'src')
+        os.mkdir(src)
+        for i in range(4):
+            file_name = os.path.join(src, '%s.txt' % i)
+            with open(file_name, 'wb') as fd:
+                fd.write(b'foo %i\n' % i)
+            os.utime(file_name, (1000000000, 1000000000))
+        index_file = os.path.join(tempdir, 'index')
+        self.assertEqual({'indexed': 4, 'unchanged': 0, 'removed': 0}, update_index(index_file, [src]))
+        # Not indexed yet: gets checked.
+        with open(os.path.join(src, 'new.txt'), 'wb') as fd:
+            fd.write(b'foo 3\n')
+        stats = {}
+        counter = replace_recursive([src], b'o 3', b'x', index_file=index_file, stats=stats)
+        self.assertEqual({'dirs': 1, 'files': 2, 'lines': 2, 'files-checked': 2}, counter)
+        self.assertEqual(3, stats['index-skipped'])
+        # Too short for the index.
+        counter = replace_recursive([src], b'fo', b'x', index_file=index_file, no_regex=True)
+        self.assertEqual(5, counter['files-checked'])
+        shutil.rmtree(tempdir)
+
+    def test_journal(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_journal')
+        for name in ['a/1', 'a/2', 'a/3', 'b/1', 'b/2', 'c/x/1', 'c/x/2', 'c/y/1', 'd']:
+            file_name = os.path.join(tempdir, 'tree', name)
+            if not os.path.exists(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            with open(file_name, 'wb') as fd:
+                fd.write(b'foo\nbar\n' if name.endswith('1') else b'bar\n')
+        shutil.copytree(os.path.join(tempdir, 'tree'), os.path.join(tempdir, 'expected'))
+        expected = replace_recursive([os.path.join(tempdir, 'expected')], b'foo', b'foofoo')
+        tree = os.path.join(tempdir, 'tree')
+        journal_file = os.path.join(tempdir, 'journal')
+        calls = []
+        orig = ReplaceRecursive.replace_in_file
+
+        def replace_in_file(reprec, file_name):
+            # Killed while checking the sixth file.
+            if len(calls) == 5:
+                raise KeyboardInterrupt()
+            calls.append(file_name)
+            return orig(reprec, file_name)
+
+        ReplaceRecursive.replace_in_file = replace_in_file
+        try:
+            self.assertRaises(KeyboardInterrupt, replace_recursive, [tree], b'foo', b'foofoo',
+                              journal=Journal(journal_file))
+        finally:
+            ReplaceRecursive.replace_in_file = orig
+        # A temp file of the killed run.
+        temp = os.path.join(tree, 'a', '1_tmp')
+        with open(temp, 'wb') as fd:
+            fd.write(b'half')
+        Journal(journal_file, resume=True).temp_file(temp)
+        self.assertRaises(JournalMismatch, replace_recursive, [tree], b'foo', b'bar',
+                          journal=Journal(journal_file, resume=True))
+        journal = Journal(journal_file, resume=True)
+        self.assertEqual(5, len(journal.files))
+        counter = replace_recursive([tree], b'foo', b'foofoo', journal=journal)
+        self.assertEqual(expected, counter)
+        self.assertFalse(os.path.exists(temp))
+        diffdir(tree, os.path.join(tempdir, 'expected'))
+        # Resuming a finished run skips everything.
+        counter = replace_recursive([tree], b'foo', b'foofoo', journal=Journal(journal_file, resume=True))
+        self.assertEqual(expected, counter)
+        diffdir(tree, os.path.join(tempdir, 'expected'))
+        shutil.rmtree(tempdir)
+
+    def test_main_resume_no_daemon(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_resume')
+        tree = os.path.join(tempdir, 'tree')
+        os.mkdir(tree)
+        with open(os.path.join(tree, 'a'), 'wb') as fd:
+            fd.write(b'foo\n')
+        journal_file = os.path.join(tempdir, 'journal')
+        cwd = os.getcwd()
+        try:
+            for argv in [['--no-daemon', '--journal', journal_file, 'foo', 'bar', tree],
+                         ['--no-daemon', '--resume', journal_file],
+                         ['--resume=%s' % journal_file, '--no-daemon']]:
+                stdout = io.StringIO()
+                with contextlib.redirect_stdout(stdout):
+                    main(argv)
+                self.assertIn('1 files checked', stdout.getvalue(), argv)
+        finally:
+            os.chdir(cwd)
+        with open(os.path.join(tree, 'a'), 'rb') as fd:
+            self.assertEqual(b'bar\n', fd.read())
+        shutil.rmtree(tempdir)
+
+    def test_ignore_lines(self):
+        content = b'foo 1\n# foo 2\nfoo 3 # x\nfoo\n4\n'
+        for pattern, dotall, result in [
+                (b'foo', False, b'bar 1\n# foo 2\nfoo 3 # x\nbar\n4\n'),
+                # Not line local: line by line
+                (b'(?<=f)oo', False, b'fbar 1\n# foo 2\nfoo 3 # x\nfbar\n4\n'),
+                (b'foo', True, b'bar 1\n# foo 2\nfoo 3 # x\nbar\n4\n'),
+                (b'o\n4', True, b'foo 1\n# foo 2\nfoo 3 # x\nfobar\n'),
+                # Touches an ignored line
+                (b'1\n#', True, b'foo 1\n# foo 2\nfoo 3 # x\nfoo\n4\n'),
+        ]:
+            for ignore_lines in [[re.compile(b'^#'), re.compile(b'# x$')],
+                                 [re.compile('^#'), re.compile(b'(?i)# X$')]]:
+                reprec = ReplaceRecursive(pattern, b'bar', dotall=dotall, ignore_lines=ignore_lines)
+                if dotall:
+                    result_is = reprec.do_file__dot_all(io.BytesIO(content))
+                else:
+                    result_is = reprec.replace_lines(content, 'test')
+                self.assertEqual(result, result_is, (pattern, dotall, ignore_lines))
+
+    def test_combine_regexes(self):
+        self.assertIsNone(combine_regexes([]))
+        regex = combine_regexes([re.compile(b'a$'), re.compile('(?i:B)'), b'c', re.compile(b'd # comment', re.X)])
+        self.assertIsInstance(regex, re.Pattern)
+        self.assertEqual([b'xa', b'xb', b'c', b'd'], [line for line in [b'xa', b'xb', b'c', b'd', b'a x']
+                                                       if regex.search(line)])
+        regex = combine_regexes([re.compile(b'(a)\\1'), b'b'])
+        self.assertNotIsInstance(regex, re.Pattern)
+        self.assertEqual([b'aa', b'b'], [line for line in [b'aa', b'b', b'a'] if regex.search(line)])
+
+    def test_files_from(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_files_from')
+        names = ['a ', 'b\nc', 'd']
+        for name in names:
+            with open(os.path.join(tempdir, name), 'wb') as fd:
+                fd.write(b'foo\n')
+        listing = os.path.join(tempdir, 'listing')
+        with open(listing, 'wb') as fd:
+            fd.write(b'\0'.join(os.path.join(tempdir, name).encode('utf8') for name in names + ['']) + b'\0')
+        with open(listing, 'rb') as fd:
+            counter = replace_recursive(None, b'foo', b'bar', files_from=fd, files_from0=True)
+        self.assertEqual({'dirs': 3, 'files': 3, 'lines': 3, 'files-checked': 3}, counter)
+        with open(listing, 'wb') as fd:
+            fd.write(os.path.join(tempdir, 'a ').encode('utf8') + b'\n' + tempdir.encode('utf8'))
+        with open(listing, 'rb') as fd:
+            counter = replace_recursive(None, b'bar', b'baz', files_from=fd)
+        self.assertEqual({'dirs': 1, 'files': 1, 'lines': 1, 'files-checked': 1}, counter)
+        self.assertEqual(b'baz\n', open(os.path.join(tempdir, 'a '), 'rb').read())
+        shutil.rmtree(tempdir)
+
+    def test_read_file_names(self):
+        self.assertEqual(['a', 'b c ', 'd'], list(read_file_names(io.BytesIO(b'a\nb c \n\nd'), block_size=2)))
+        self.assertEqual(['a\n', 'b'], list(read_file_names(io.BytesIO(b'a\n\0b\0'), b'\0')))
+        read, write = os.pipe()
+        names = prefetch(read_file_names(io.open(read, 'rb')), size=2)
+        os.write(write, b'first\nsec')
+        # The first name is available before the writer is finished.
+        self.assertEqual('first', next(names))
+        os.write(write, b'ond\n')
+        os.close(write)
+        self.assertEqual(['second'], list(names))
+
+    def test_prefetch_stopped_early(self):
+        names = prefetch(itertools.count(), size=2)
+        self.assertEqual(0, next(names))
+        names.close()
+        # The thread does not wait forever for a free place in the queue.
+        for thread in threading.enumerate():
+            if thread.name == 'reprec-prefetch':
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+
+    def test_stats_timing(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_stats')
+        for i in range(5):
+            with open(os.path.join(tempdir, 'f%i' % i), 'wb') as fd:
+                fd.write(b'foo foo\n# foo\nbar\n' * (i + 1))
+        for jobs, dotall in [(1, False), (2, False), (1, True)]:
+            stats = {}
+            counter = replace_recursive([tempdir], b'fo(o)', b'F\\1', stats=stats, jobs=jobs, dotall=dotall,
+                                        ignore_lines=[re.compile(b'#')], timing=True, slowest_files=3)
+            self.assertEqual(5, counter['files'])
+            lines = 15 if not dotall else 30
+            self.assertEqual([lines], stats['rule-hits'], (jobs, dotall))
+            self.assertEqual([30], stats['rule-matches'], (jobs, dotall))
+            self.assertEqual(sum(len(b'foo foo\n# foo\nbar\n') * (i + 1) for i in range(5)), stats['bytes-read'])
+            for key in ['time-total', 'time-read', 'time-match', 'time-ignore', 'time-write']:
+                self.assertGreater(stats[key], 0, (key, jobs, dotall))
+            summary = stats_summary(counter, stats)
+            self.assertEqual(3, len(summary['slowest-files']))
+            self.assertGreater(summary['files-per-second'], 0)
+            self.assertEqual(5, summary['counter']['files-checked'])
+            # Back to the original content.
+            replace_recursive([tempdir], b'F(o)', b'fo\\1')
+        stats = {}
+        replace_recursive([tempdir], b'foo', b'bar', stats=stats)
+        self.assertNotIn('time-total', stats)
+        shutil.rmtree(tempdir)
+
+    def test_iter_replace(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_iter')
+        content = b'a\nfoo foo\nb\nfoo\n'
+        for name in ['1', '2', '3']:
+            with open(os.path.join(tempdir, name), 'wb') as fd:
+                fd.write(content)
+        # With binary_by_ending, 6.bin gets skipped because of the ending.
+        for name in ['4.bin', '6.bin']:
+            with open(os.path.join(tempdir, name), 'wb') as fd:
+                fd.write(b'\0foo')
+        with open(os.path.join(tempdir, '5'), 'wb') as fd:
+            fd.write(b'bar\n')
+        for kwargs, offsets, lines in [({}, [2, 12], 2), ({'no_regex': True}, [2, 12], 2),
+                                       ({'stream': True, 'buffer_size': 4}, [2, 12], 2),
+                                       ({'ignore_lines': [re.compile(b'b')]}, [2, 12], 2),
+                                       ({'dotall': True}, [2, 6, 12], 3),
+                                       ({'dotall': True, 'stream': True, 'buffer_size': 4}, [2, 6, 12], 3),
+                                       ({'jobs': 2}, [2, 12], 2), ({'binary_by_ending': True}, [2, 12], 2)]:
+            counter = {}
+            results = {os.path.basename(result.file_name): result for result in
+                       iter_replace([tempdir], b'foo', b'xyz', counter=counter, **kwargs)}
+            self.assertEqual(['1', '2', '3', '4.bin', '5', '6.bin'], sorted(results), kwargs)
+            self.assertEqual(('changed', None, lines, offsets),
+                             (results['1'].status, results['1'].reason, results['1'].lines, results['1'].offsets), kwargs)
+            for name in ['4.bin', '6.bin']:
+                self.assertEqual(('skipped', 'binary'), (results[name].status, results[name].reason), kwargs)
+            self.assertEqual(('unchanged', 0), (results['5'].status, results['5'].lines))
+            self.assertEqual(3, counter['files'])
+            replace_recursive([tempdir], b'xyz', b'foo')
+        # replace_recursive() prints the results if verbose is True.
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            replace_recursive([tempdir], b'foo', b'xyz', verbose=True)
+        self.assertIn('Changed 2 lines in %s' % os.path.join(tempdir, '1'), stdout.getvalue())
+        replace_recursive([tempdir], b'xyz', b'foo')
+        # Stopping early.
+        results = iter_replace([tempdir], b'foo', b'xyz')
+        first = next(result for result in results if result.changed)
+        results.close()
+        changed = [name for name in ['1', '2', '3'] if b'xyz' in open(os.path.join(tempdir, name), 'rb').read()]
+        self.assertEqual([os.path.basename(first.file_name)], changed)
+        shutil.rmtree(tempdir)
+
+    def test_timeout(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_timeout')
+        with open(os.path.join(tempdir, 'slow'), 'wb') as fd:
+            fd.write(b'a' * 40 + b'b\n')
+        with open(os.path.join(tempdir, 'fast'), 'wb') as fd:
+            fd.write(b'aaa\n' * 10)
+        for kwargs in [{}, {'stream': True, 'buffer_size': 8}, {'jobs': 2}]:
+            stats = {}
+            results = {os.path.basename(result.file_name): result for result in
+                       iter_replace([tempdir], b'(a+)+$', b'x', timeout=0.2, stats=stats, **kwargs)}
+            self.assertEqual(('skipped', 'timeout', 0), (results['slow'].status, results['slow'].reason,
+                                                       results['slow'].lines), kwargs)
+            self.assertEqual(('changed', 10), (results['fast'].status, results['fast'].lines), kwargs)
+            self.assertEqual(1, stats['timeout-skipped'])
+            self.assertEqual(['fast', 'slow'], sorted(os.listdir(tempdir)))
+            self.assertEqual(b'a' * 40 + b'b\n', open(os.path.join(tempdir, 'slow'), 'rb').read())
+            self.assertEqual(b'x\n' * 10, open(os.path.join(tempdir, 'fast'), 'rb').read())
+            with open(os.path.join(tempdir, 'fast'), 'wb') as fd:
+                fd.write(b'aaa\n' * 10)
+        shutil.rmtree(tempdir)
+
+    def test_hardlinks(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_hardlinks')
+        outside = tempfile.mkdtemp(prefix='reprec_unittest_hardlinks_outside')
+        for kwargs in [{}, {'jobs': 2}, {'jobs': 2, 'no_regex': True}]:
+            os.mkdir(os.path.join(tempdir, 'sub'))
+            with open(os.path.join(tempdir, 'a'), 'wb') as fd:
+                fd.write(b'foo\n')
+            os.link(os.path.join(tempdir, 'a'), os.path.join(tempdir, 'sub', 'b'))
+            os.link(os.path.join(tempdir, 'a'), os.path.join(outside, 'c'))
+            # All names below tempdir: the other name has one link after the first got replaced.
+            with open(os.path.join(tempdir, 'd'), 'wb') as fd:
+                fd.write(b'foo\n')
+            os.link(os.path.join(tempdir, 'd'), os.path.join(tempdir, 'sub', 'e'))
+            with open(os.path.join(tempdir, 'unchanged'), 'wb') as fd:
+                fd.write(b'bar\n')
+            os.link(os.path.join(tempdir, 'unchanged'), os.path.join(tempdir, 'sub', 'unchanged'))
+            stats = {}
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                results = list(iter_replace([tempdir], b'foo', b'xyz', hardlinks='keep', stats=stats, **kwargs))
+            reasons = sorted((os.path.relpath(result.file_name, tempdir), result.status, result.reason)
+                             for result in results)
+            # The walk finds one of the names first.
+            self.assertEqual(['a', 'd', 'sub/b', 'sub/e', 'sub/unchanged', 'unchanged'],
+                             [reason[0] for reason in reasons])
+            self.assertEqual(3, len([reason for reason in reasons if reason[2] == 'hardlink']), reasons)
+            self.assertEqual(3, stats['hardlink-names'])
+            a = os.stat(os.path.join(tempdir, 'a'))
+            b = os.stat(os.path.join(tempdir, 'sub', 'b'))
+            self.assertEqual((a.st_dev, a.st_ino, 2), (b.st_dev, b.st_ino, b.st_nlink))
+            self.assertEqual(b'xyz\n', open(os.path.join(tempdir, 'sub', 'b'), 'rb').read())
+            self.assertEqual(os.stat(os.path.join(tempdir, 'd')).st_ino, os.stat(os.path.join(tempdir, 'sub', 'e')).st_ino)
+            self.assertEqual(b'xyz\n', open(os.path.join(tempdir, 'sub', 'e'), 'rb').read())
+            # The name outside of the tree keeps the old content, and gets reported.
+            self.assertEqual(b'foo\n', open(os.path.join(outside, 'c'), 'rb').read())
+            self.assertEqual(1, stats['hardlinks-broken'])
+            self.assertIn('1 of them were not found', stdout.getvalue())
+            self.assertEqual(2, os.stat(os.path.join(tempdir, 'unchanged')).st_nlink)
+            self.assertEqual(['a', 'd', 'sub', 'unchanged'], sorted(os.listdir(tempdir)))
+            shutil.rmtree(tempdir)
+            os.mkdir(tempdir)
+            os.unlink(os.path.join(outside, 'c'))
+
+        # Default: the changed files with several links get reported.
+        with open(os.path.join(tempdir, 'a'), 'wb') as fd:
+            fd.write(b'foo\n')
+        os.link(os.path.join(tempdir, 'a'), os.path.join(outside, 'c'))
+        stats = {}
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            counter = replace_recursive([tempdir], b'foo', b'xyz', stats=stats)
+        self.assertEqual(1, counter['files'])
+        self.assertEqual(1, stats['hardlinks-broken'])
+        self.assertIn('has 2 hard links', stdout.getvalue())
+        shutil.rmtree(tempdir)
+        shutil.rmtree(outside)
+
+    def test_dedupe_content(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_dedupe')
+        contents = [b'foo\nbar\nfoo\n', b'bar\n', b'foo\nbar\nfoo\n', b'bar\n', b'foo foo\n']
+        for kwargs in [{}, {'dotall': True}, {'no_regex': True, 'jobs': 2}]:
+            for i, content in enumerate(contents):
+                with open(os.path.join(tempdir, str(i)), 'wb') as fd:
+                    fd.write(content)
+            stats = {}
+            results = {os.path.basename(result.file_name): result for result in
+                       iter_replace([tempdir], b'foo', b'xyz', dedupe_content=True, stats=stats, **kwargs)}
+            self.assertEqual(2, stats['content-memo-hits'], kwargs)
+            self.assertEqual(sum(stats['rule-hits']), sum(result.lines for result in results.values()))
+            self.assertEqual((2, [0, 8]), (results['2'].lines, results['2'].offsets), kwargs)
+            self.assertEqual(('unchanged', 0), (results['3'].status, results['3'].lines))
+            for i, content in enumerate(contents):
+                self.assertEqual(content.replace(b'foo', b'xyz'), open(os.path.join(tempdir, str(i)), 'rb').read())
+        shutil.rmtree(tempdir)
+        self.assertRaises(ValueError, ReplaceRecursive, b'foo', b'xyz', stream=True, dedupe_content=True)
+
+    def test_compressed(self):
+        tempdir = tempfile.mkdtemp(prefix='reprec_unittest_compressed')
+        data = b''.join(b'line %i %s\n' % (i, b'foo' * (i % 3)) for i in range(1000))
+        for kwargs in [{}, {'dotall': True}, {'stream': True, 'buffer_size': 100},
+                       {'stream': True, 'dotall': True, 'buffer_size': 100, 'max_match_span': 10},
+                       {'jobs': 2}]:
+            for module, ending in [(gzip, '.gz'), (bz2, '.bz2'), (lzma, '.xz')]:
+                with module.open(os.path.join(tempdir, 'log' + ending), 'wb') as fd:
+                    fd.write(data)
+            with gzip.open(os.path.join(tempdir, 'unchanged.gz'), 'wb') as fd:
+                fd.write(b'bar\n')
+            inode = os.stat(os.path.join(tempdir, 'unchanged.gz')).st_ino
+            # Without --compressed, .gz files get skipped and the others are binary.
+            counter = replace_recursive([tempdir], b'foo', b'xyz', **kwargs)
+            self.assertEqual(0, counter['files'])
+            counter = replace_recursive([tempdir], b'foo', b'xyz', compressed=True, **kwargs)
+            self.assertEqual((3, 4), (counter['files'], counter['files-checked']), kwargs)
+            for module, ending in [(gzip, '.gz'), (bz2, '.bz2'), (lzma, '.xz')]:
+                with module.open(os.path.join(tempdir, 'log' + ending), 'rb') as fd:
+                    self.assertEqual(data.replace(b'foo', b'xyz'), fd.read(), (ending, kwargs))
+            self.assertEqual(inode, os.stat(os.path.join(tempdir, 'unchanged.gz')).st_ino)
+            self.assertEqual(['log.bz2', 'log.gz', 'log.xz', 'unchanged.gz'], sorted(os.listdir(tempdir)))
+        shutil.rmtree(tempdir)
+
     def test_file_has_ending_to_ignore(self):
         reprec = ReplaceRecursive(b'pattern', b'insert')
         assert not reprec.file_has_ending_to_ignore('foo.py')
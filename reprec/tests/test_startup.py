@@ -0,0 +1,76 @@
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import reprec
+import setops
+
+# Modules which a simple run must not import: they are only needed by some
+# options (or by the help) and make each start slower.
+DEFERRED_MODULES = ['concurrent.futures', 'ctypes', 'hashlib', 'msvcrt', 'shutil', 'socket', 'sqlite3',
+                    'tempfile', 'termios', 'tty', 'reprec.daemon']
+
+# Prints the deferred modules which got imported, after the command.
+CHECK = '''
+import atexit, sys
+atexit.register(lambda: sys.stderr.write(' '.join(name for name in %r if name in sys.modules)))
+%s
+'''
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='reprec_unittest_startup')
+        self.file_name = os.path.join(self.tempdir, 'a')
+        with open(self.file_name, 'w') as fd:
+            fd.write('foo\nbar\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def imported(self, code, *args, env=None):
+        process = subprocess.run([sys.executable, '-c', CHECK % (DEFERRED_MODULES, code)] + list(args),
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                                 cwd=os.path.dirname(os.path.dirname(reprec.__file__)))
+        return process.stdout.decode('utf8'), process.stderr.decode('utf8').split()
+
+    def test_reprec(self):
+        output, imported = self.imported('import reprec; reprec.main()', '--no-daemon', 'xyz', 'abc',
+                                         self.file_name)
+        self.assertIn('1 files checked', output)
+        self.assertEqual([], imported)
+
+    def test_reprec_daemon_lookup(self):
+        # Without --no-daemon, the socket of the daemon gets looked up first.
+        env = {key: value for key, value in os.environ.items() if key not in ['REPREC_SOCKET', 'XDG_RUNTIME_DIR']}
+        env['TMPDIR'] = self.tempdir
+        output, imported = self.imported('import reprec; reprec.main()', 'xyz', 'abc', self.file_name, env=env)
+        self.assertIn('1 files checked', output)
+        self.assertEqual([], imported)
+
+    def test_setops(self):
+        other = os.path.join(self.tempdir, 'b')
+        with open(other, 'w') as fd:
+            fd.write('bar\n')
+        output, imported = self.imported('import setops; setops.main()', self.file_name, '-', other)
+        self.assertEqual('foo\n', output)
+        # argparse needs shutil.get_terminal_size() for each argument.
+        self.assertEqual([], [name for name in imported if name != 'shutil'])
+        # description() gets called for the help only.
+        with mock.patch.object(setops, 'description', return_value='Operators') as description:
+            for argv, help_printed in [([self.file_name, '-', other], False), (['--help'], True)]:
+                stdout = io.StringIO()
+                with mock.patch.object(sys, 'argv', ['setops'] + argv), contextlib.redirect_stdout(stdout):
+                    try:
+                        setops.main()
+                    except SystemExit:
+                        pass
+                self.assertEqual(help_printed, description.called, argv)
+                self.assertEqual(help_printed, 'Operators' in stdout.getvalue(), argv)
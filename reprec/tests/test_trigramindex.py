@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from reprec.trigramindex import TrigramIndex, trigrams
+
+
+class TrigramIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='reprec_unittest_trigramindex')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, content, mtime=1000000000):
+        file_name = os.path.join(self.tempdir, name)
+        with open(file_name, 'wb') as fd:
+            fd.write(content)
+        os.utime(file_name, (mtime, mtime))
+        return file_name
+
+    def test_trigrams(self):
+        self.assertEqual({0x616263, 0x626364}, trigrams(b'abcd'))
+        self.assertEqual(set(), trigrams(b'ab'))
+
+    def test_candidates(self):
+        a = self.write('a', b'foo bar\n')
+        b = self.write('b', b'foo baz\n')
+        index = TrigramIndex(os.path.join(self.tempdir, 'index'))
+        self.assertEqual({'indexed': 2, 'unchanged': 0, 'removed': 0}, index.update([a, b]))
+        self.assertEqual({index.key(a), index.key(b)}, index.candidates([b'foo']))
+        self.assertEqual({index.key(b)}, index.candidates([b'baz']))
+        self.assertEqual({index.key(a), index.key(b)}, index.candidates([b'bar', b'baz']))
+        self.assertEqual(set(), index.candidates([b'qux']))
+        self.assertEqual(None, index.candidates([b'ba']))
+        candidates = index.candidates([b'baz'])
+        self.assertTrue(index.can_skip(a, (8, 1000000000 * 10 ** 9, os.stat(a).st_ino), candidates))
+        self.assertFalse(index.can_skip(a, (8, 1000000001 * 10 ** 9, os.stat(a).st_ino), candidates))
+        self.write('a', b'baz\n', mtime=1000000001)
+        os.unlink(b)
+        self.assertEqual({'indexed': 1, 'unchanged': 0, 'removed': 1}, index.update([a]))
+        self.assertEqual({index.key(a)}, index.candidates([b'baz']))
+        index.close()
+        index = TrigramIndex(os.path.join(self.tempdir, 'index'))
+        self.assertEqual({'indexed': 0, 'unchanged': 1, 'removed': 0}, index.update([a]))
+        index.close()
@@ -0,0 +1,58 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from reprec.writer import FileWriter
+
+
+class FileWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='reprec_unittest_writer')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def create(self, name, content=b'old', mode=0o640):
+        file_name = os.path.join(self.tempdir, name)
+        with open(file_name, 'wb') as fd:
+            fd.write(content)
+        os.chmod(file_name, mode)
+        return file_name
+
+    def test_background(self):
+        file_names = [self.create('%s.txt' % i, mode=0o600 + i) for i in range(20)]
+        writer = FileWriter('dir', queue_size=2)
+        writer.start()
+        for i, file_name in enumerate(file_names):
+            writer.write(file_name, b'new %i' % i)
+        writer.close()
+        for i, file_name in enumerate(file_names):
+            self.assertEqual(b'new %i' % i, open(file_name, 'rb').read())
+            self.assertEqual(0o600 + i, stat.S_IMODE(os.stat(file_name).st_mode))
+        self.assertEqual(sorted(os.path.basename(file_name) for file_name in file_names),
+                         sorted(os.listdir(self.tempdir)))
+
+    def test_commit_and_discard(self):
+        file_name = self.create('a.txt')
+        writer = FileWriter('file')
+        temp = writer.open(file_name)
+        temp.write(b'discarded')
+        temp.discard()
+        temp = writer.open(file_name)
+        temp.write(b'new')
+        writer.commit(temp, file_name)
+        writer.close()
+        self.assertEqual(b'new', open(file_name, 'rb').read())
+        self.assertEqual(['a.txt'], os.listdir(self.tempdir))
+
+    def test_error(self):
+        writer = FileWriter()
+        writer.start()
+        writer.write(os.path.join(self.tempdir, 'does-not-exist', 'a.txt'), b'new')
+        self.assertRaises(OSError, writer.close)
+
+    def test_unknown_durability(self):
+        self.assertRaises(ValueError, FileWriter, 'always')
@@ -0,0 +1,139 @@
+'''
+Trigram index of file contents (reprec index build/update, --index).
+
+For each file the index stores the set of the three byte sequences it
+contains. A file can only contain a literal if it contains all trigrams of
+the literal, so files outside of the intersection of the posting lists
+don't need to be read. Files which changed since they were indexed (size,
+mtime or inode differ) always get checked.
+'''
+
+import os
+import time
+
+from reprec.scancache import RACY_NS, stat_signature
+
+# Larger files don't get indexed, they always get checked.
+DEFAULT_MAX_FILE_SIZE = 16 * 1024 * 1024
+
+
+def trigrams(content):
+    return {int.from_bytes(content[i:i + 3], 'big') for i in range(len(content) - 2)}
+
+
+class TrigramIndex:
+    def __init__(self, file_name, max_file_size=DEFAULT_MAX_FILE_SIZE):
+        self.file_name = file_name
+        self.max_file_size = max_file_size
+        # Imported here: most runs don't need it.
+        import sqlite3
+        self.connection = sqlite3.connect(file_name, timeout=60)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL)''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS postings (
+            trigram INTEGER NOT NULL,
+            file_id INTEGER NOT NULL,
+            PRIMARY KEY (trigram, file_id)) WITHOUT ROWID''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS postings_file_id ON postings (file_id)')
+        # path --> (id, (size, mtime_ns, inode))
+        self.files = {
+            path: (file_id, (size, mtime_ns, inode)) for file_id, path, size, mtime_ns, inode in
+            self.connection.execute('SELECT id, path, size, mtime_ns, inode FROM files')}
+
+    @classmethod
+    def key(cls, file_name):
+        return os.fsdecode(os.path.abspath(file_name))
+
+    def close(self):
+        self.connection.close()
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM postings')
+            self.connection.execute('DELETE FROM files')
+        self.files = {}
+
+    def update(self, file_names, verbose=False):
+        '''
+        Index the files which are new or changed. Files which don't exist
+        anymore get removed. Returns the counter dict.
+        '''
+        counter = {'indexed': 0, 'unchanged': 0, 'removed': 0}
+        start_ns = time.time_ns()
+        with self.connection:
+            for file_name in file_names:
+                path = self.key(file_name)
+                if path == self.key(self.file_name):
+                    continue
+                signature = stat_signature(file_name)
+                indexed = self.files.get(path)
+                if indexed is not None and indexed[1] == signature:
+                    counter['unchanged'] += 1
+                    continue
+                if signature is None or signature[0] > self.max_file_size:
+                    continue
+                try:
+                    with open(file_name, 'rb') as fd:
+                        content = fd.read()
+                except OSError as exc:
+                    print('Not indexing %s: %s' % (file_name, exc))
+                    continue
+                if verbose:
+                    print('Indexing %s' % file_name)
+                if signature[1] > start_ns - RACY_NS:
+                    # Modified just now: a second change could keep the mtime. The
+                    # file gets checked (and indexed by the next update) anyway.
+                    signature = (signature[0], 0, signature[2])
+                self.remove(path)
+                file_id = self.connection.execute('INSERT INTO files (path, size, mtime_ns, inode) VALUES (?, ?, ?, ?)',
+                                                  (path,) + signature).lastrowid
+                self.connection.executemany('INSERT INTO postings VALUES (?, ?)',
+                                            ((trigram, file_id) for trigram in trigrams(content)))
+                self.files[path] = (file_id, signature)
+                counter['indexed'] += 1
+            for path in list(self.files):
+                if not os.path.exists(path):
+                    self.remove(path)
+                    counter['removed'] += 1
+        return counter
+
+    def remove(self, path):
+        indexed = self.files.pop(path, None)
+        if indexed is None:
+            return
+        self.connection.execute('DELETE FROM postings WHERE file_id = ?', (indexed[0],))
+        self.connection.execute('DELETE FROM files WHERE id = ?', (indexed[0],))
+
+    def candidates(self, literals):
+        '''
+        Return the paths of the indexed files which may contain one of the
+        literals, or None if a literal is too short to use the index.
+        '''
+        if not literals or any(len(literal) < 3 for literal in literals):
+            return None
+        file_ids = set()
+        for literal in literals:
+            found = None
+            for trigram in trigrams(literal):
+                posting = {file_id for file_id, in self.connection.execute(
+                    'SELECT file_id FROM postings WHERE trigram = ?', (trigram,))}
+                found = posting if found is None else found & posting
+                if not found:
+                    break
+            file_ids |= found
+        return {path for path, (file_id, signature) in self.files.items() if file_id in file_ids}
+
+    def can_skip(self, file_name, signature, candidates):
+        '''
+        True if the file is indexed with this signature and is not one of the
+        candidates (see candidates()).
+        '''
+        if candidates is None or signature is None:
+            return False
+        path = self.key(file_name)
+        indexed = self.files.get(path)
+        return indexed is not None and indexed[1] == signature and path not in candidates
@@ -0,0 +1,316 @@
+'''
+Writing the changed files: temp file, owner and mode of the original,
+fsync, rename.
+
+FileWriter can do the work in a background thread, so that the next files
+get read while the changed ones get written. The fsync() calls of the
+directories get grouped: each directory gets synced once per batch, not
+once per file.
+'''
+
+import io
+import os
+import queue
+import stat
+import threading
+import time
+
+DURABILITY_LEVELS = ('none', 'file', 'dir')
+
+# Linux: a file without a name, which gets a name by linkat() when it is complete.
+# Set to False if linkat() fails (for example in containers).
+use_o_tmpfile = hasattr(os, 'O_TMPFILE') and os.path.isdir('/proc/self/fd')
+
+
+class TempFile:
+    '''
+    The new content of file_name. Created in the same directory, so that
+    it can replace the original with os.rename().
+    '''
+
+    def __init__(self, file_name, on_named=None):
+        self.file_name = file_name
+        self.directory = os.path.dirname(file_name) or '.'
+        # Called with the name of the temp file, before it exists with this name.
+        self.on_named = on_named
+        # None as long as the file has no name (O_TMPFILE).
+        self.path = None
+        fd = None
+        if use_o_tmpfile:
+            try:
+                fd = os.open(self.directory, os.O_TMPFILE | os.O_RDWR, 0o600)
+            except OSError:
+                # Not supported by this filesystem.
+                fd = None
+        if fd is None:
+            fd, self.path = self.mkstemp()
+        self.fd = io.open(fd, 'wb')
+
+    def mkstemp(self):
+        # Imported here: runs which change nothing don't need it.
+        import tempfile
+        fd, path = tempfile.mkstemp(prefix=os.path.basename(self.file_name) + '_', dir=self.directory)
+        if self.on_named is not None:
+            self.on_named(path)
+        return fd, path
+
+    def write(self, data):
+        self.fd.write(data)
+
+    def replace(self, fsync=False):
+        '''
+        Give the temp file owner and mode of the original and move it to
+        file_name.
+        '''
+        original = os.stat(self.file_name)
+        self.fd.flush()
+        if self.path is None:
+            self.link()
+        fileno = self.fd.fileno()
+        if os.chmod in os.supports_fd:
+            os.chmod(fileno, stat.S_IMODE(original.st_mode))
+        else:
+            os.chmod(self.path, stat.S_IMODE(original.st_mode))
+        own = os.fstat(fileno)
+        if (own.st_uid, own.st_gid) != (original.st_uid, original.st_gid) and hasattr(os, 'fchown'):
+            try:
+                os.fchown(fileno, original.st_uid, original.st_gid)
+            except PermissionError:
+                # Only root can give files away.
+                pass
+        if fsync:
+            os.fsync(fileno)
+        self.fd.close()
+        # os.rename: single system call, so no half written files will
+        # exist if the process gets killed.
+        os.rename(self.path, self.file_name)
+
+    def link(self):
+        global use_o_tmpfile
+        import tempfile
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            while True:
+                path = tempfile.mktemp(prefix=os.path.basename(self.file_name) + '_', dir=self.directory)
+                if self.on_named is not None:
+                    self.on_named(path)
+                try:
+                    # dir_fd makes os.link() use linkat(..., AT_SYMLINK_FOLLOW).
+                    os.link('/proc/self/fd/%d' % self.fd.fileno(), os.path.basename(path),
+                            dst_dir_fd=dir_fd, follow_symlinks=True)
+                except FileExistsError:
+                    continue
+                except OSError:
+                    use_o_tmpfile = False
+                    self.copy_to_named_file()
+                    return
+                self.path = path
+                return
+        finally:
+            os.close(dir_fd)
+
+    def copy_to_named_file(self):
+        import shutil
+        fd, path = self.mkstemp()
+        os.lseek(self.fd.fileno(), 0, os.SEEK_SET)
+        with io.open(self.fd.fileno(), 'rb', closefd=False) as unnamed:
+            named = io.open(fd, 'wb')
+            shutil.copyfileobj(unnamed, named)
+        self.fd.close()
+        self.fd = named
+        self.path = path
+        self.fd.flush()
+
+    def discard(self):
+        self.fd.close()
+        if self.path is not None:
+            os.unlink(self.path)
+
+
+class HardLink:
+    '''
+    Replaces file_name with a hard link of source. Used by FileWriter like
+    a TempFile.
+    '''
+
+    def __init__(self, source, file_name, on_named=None):
+        self.source = source
+        self.file_name = file_name
+        self.directory = os.path.dirname(file_name) or '.'
+        self.on_named = on_named
+
+    def replace(self, fsync=False):
+        # The content of source was synced when it was written.
+        import tempfile
+        while True:
+            path = tempfile.mktemp(prefix=os.path.basename(self.file_name) + '_', dir=self.directory)
+            if self.on_named is not None:
+                self.on_named(path)
+            try:
+                os.link(self.source, path)
+            except FileExistsError:
+                continue
+            break
+        try:
+            os.rename(path, self.file_name)
+        except BaseException:
+            os.unlink(path)
+            raise
+
+    def discard(self):
+        pass
+
+
+class FileWriter:
+    '''
+    durability:
+      'none': the changes reach the disk whenever the OS writes them.
+      'file': each file gets synced before the rename. After a crash a file
+              has the old or the new content, but the rename can be lost.
+      'dir':  the directories get synced after the renames, too.
+
+    Without start() all methods work synchronously.
+    '''
+
+    def __init__(self, durability='none', queue_size=16):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError('Unknown durability %r. Use one of %s' % (durability, ', '.join(DURABILITY_LEVELS)))
+        self.durability = durability
+        self.queue_size = queue_size
+        # Directories with renames which were not synced yet.
+        self.dirty_dirs = set()
+        self.queue = None
+        self.thread = None
+        # Files which are in the queue.
+        self.pending = set()
+        self.error = None
+        # Called with the name of each temp file (see TempFile).
+        self.on_temp = None
+        # If it is a list (or deque), the names of the replaced files get appended.
+        self.replaced = None
+        # Time spent in replace(), in the background thread or not.
+        self.seconds = 0.0
+
+    def start(self):
+        self.queue = queue.Queue(self.queue_size)
+        self.thread = threading.Thread(target=self.run, name='reprec-writer', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                file_name, content, temp = item
+                if self.error is not None:
+                    if temp is not None:
+                        temp.discard()
+                    continue
+                try:
+                    self.replace(file_name, content, temp)
+                except BaseException as exc:
+                    self.error = exc
+                if self.queue.empty():
+                    self.flush()
+            finally:
+                if item is not None:
+                    self.pending.discard(item[0])
+                self.queue.task_done()
+
+    def open(self, file_name):
+        return TempFile(file_name, self.on_temp)
+
+    def write(self, file_name, content):
+        '''
+        Replace the content of file_name.
+        '''
+        self.put(file_name, content, None)
+
+    def commit(self, temp, file_name):
+        '''
+        Replace file_name with the TempFile temp (see open()).
+        '''
+        self.put(file_name, None, temp)
+
+    def link(self, source, file_name):
+        '''
+        Replace file_name with a hard link of source, after the pending
+        write of source.
+        '''
+        self.put(file_name, None, HardLink(source, file_name, self.on_temp))
+
+    def put(self, file_name, content, temp):
+        self.check()
+        if self.thread is None:
+            return self.replace(file_name, content, temp)
+        self.pending.add(file_name)
+        self.queue.put((file_name, content, temp))
+
+    def replace(self, file_name, content, temp):
+        start = time.perf_counter()
+        try:
+            self.replace__untimed(file_name, content, temp)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def replace__untimed(self, file_name, content, temp):
+        if temp is None:
+            temp = self.open(file_name)
+            try:
+                temp.write(content)
+            except BaseException:
+                temp.discard()
+                raise
+        try:
+            temp.replace(fsync=self.durability != 'none')
+        except BaseException:
+            temp.discard()
+            raise
+        if self.durability == 'dir':
+            self.dirty_dirs.add(temp.directory)
+        if self.replaced is not None:
+            self.replaced.append(file_name)
+
+    def wait_for(self, file_name):
+        '''
+        Wait until a pending write of file_name is done.
+        '''
+        if file_name in self.pending:
+            self.queue.join()
+            self.check()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def flush(self):
+        dirty_dirs, self.dirty_dirs = self.dirty_dirs, set()
+        for directory in sorted(dirty_dirs):
+            sync_directory(directory)
+
+    def close(self):
+        '''
+        Wait for the background thread and sync the directories. Raises the
+        first error of the background thread.
+        '''
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.queue = None
+        self.flush()
+        self.check()
+
+
+def sync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # Windows: directories can't be opened.
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
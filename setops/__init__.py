@@ -67,9 +67,19 @@ setops <(setops <(grep -l bar *.txt) + <(grep -l foo *.txt)) - <(grep -l foobar
         ' '.join(operator.aliases)) for operator in operators]))
 
 
+class ArgumentParser(argparse.ArgumentParser):
+    '''
+    Creates the description when the help gets printed, not at each start.
+    '''
+
+    def format_help(self):
+        if self.description is None:
+            self.description = description()
+        return super(ArgumentParser, self).format_help()
+
+
 def main():
-    parser = argparse.ArgumentParser(description=description(),
-                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser = ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('set1', type=string_to_set)
     parser.add_argument('operator', type=string_to_operator)
     parser.add_argument('set2', type=string_to_set)